@@ -0,0 +1,187 @@
+"""Score many candidate sites without the web app.
+
+Usage:
+    python data/batch_siting.py sites.csv results.parquet --workers 8
+
+The input (CSV or Parquet) needs the columns lat, lon, h2 and turbine_type
+(HAWT or VAWT), plus radius for HAWT or rotor_height and diameter for VAWT.
+The columns years (default 20) and average_wind_direction (fetched from the
+weather API when missing) are optional. With --power-curves, the energy of the
+rows with a turbine_model column comes from that model's power curve (see
+energy_engine.py) instead of the fixed efficiency. These rows don't need the
+turbine size columns, and their capacity factor is reported too.
+"""
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import siting_engine
+from energy_engine import load_power_curves
+from pipeline_trace import Tracer, span, tracing
+from wind_raster import WindSpeedSampler
+
+result_schema = pa.schema([
+    ('site_id', pa.int64()),
+    ('lat', pa.float64()),
+    ('lon', pa.float64()),
+    ('h2', pa.float64()),
+    ('turbine_type', pa.string()),
+    ('turbine_model', pa.string()),
+    ('A', pa.float64()),
+    ('years', pa.float64()),
+    ('original_wind_speed', pa.float64()),
+    ('average_wind_direction', pa.float64()),
+    ('obstacle_distance', pa.float64()),
+    ('obstacle_height', pa.float64()),
+    ('wind_speed_reduction', pa.float64()),
+    ('final_wind_speed', pa.float64()),
+    ('wind_power', pa.float64()),
+    ('annual_energy_output', pa.float64()),
+    ('capacity_factor', pa.float64()),
+] + [
+    (f'{kind}_co2_savings_{fuel}', pa.float64())
+    for fuel in siting_engine.emission_factors for kind in ('annual', 'total')
+] + [
+    ('error', pa.string()),
+])
+
+# Resources opened once in every worker process
+_sampler = None
+_height_maps = None
+_power_curves = None
+_weibull_k = 2.0
+
+
+def _init_worker(geotiff_path, wms_url, ndom_dir=None, power_curves_path=None, weibull_k=2.0):
+    global _sampler, _height_maps, _power_curves, _weibull_k
+    _sampler = WindSpeedSampler(geotiff_path)
+    _height_maps = siting_engine.get_height_map_source(ndom_dir, wms_url)
+    _power_curves = load_power_curves(power_curves_path) if power_curves_path else None
+    _weibull_k = weibull_k
+
+
+def _optional(row, column):
+    value = row.get(column)
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
+
+
+# Function to evaluate one input row, errors are reported in the result instead of stopping the run
+def evaluate_row(row):
+    result = {'site_id': row['site_id'], 'lat': row['lat'], 'lon': row['lon'], 'h2': row['h2'],
+              'turbine_type': _optional(row, 'turbine_type'), 'years': _optional(row, 'years') or 20}
+    try:
+        turbine_model = _optional(row, 'turbine_model')
+        sizes = {column: _optional(row, column) for column in ('radius', 'rotor_height', 'diameter')}
+        # The energy of a power curve doesn't depend on the swept area
+        if turbine_model is None or any(size is not None for size in sizes.values()):
+            A = siting_engine.calculate_swept_area(result['turbine_type'], **sizes)
+        else:
+            A = None
+        result['A'] = A
+        if turbine_model is not None and _power_curves is None:
+            raise ValueError("The row has a turbine_model, but no --power-curves were given")
+        power_curve = _power_curves.select(str(turbine_model)) if turbine_model is not None else None
+        site = siting_engine.evaluate_site(_sampler, row['lat'], row['lon'], row['h2'], A, result['years'],
+                                           average_wind_direction=_optional(row, 'average_wind_direction'),
+                                           height_maps=_height_maps, power_curve=power_curve,
+                                           weibull_k=_weibull_k)
+        del site['height_map'], site['bbox'], site['wind_rose']
+        result.update(site)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+# Function to evaluate a chunk of rows, optionally returning the timings of all stages too
+def evaluate_chunk(rows, trace=False):
+    if not trace:
+        return [evaluate_row(row) for row in rows], []
+
+    with tracing(Tracer()) as tracer:
+        results = []
+        for row in rows:
+            with span('site', site_id=row['site_id']):
+                results.append(evaluate_row(row))
+    return results, tracer.spans
+
+
+# Function to read the input file in chunks of rows
+def read_sites(path, chunk_size):
+    if path.endswith('.parquet'):
+        batches = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size))
+    else:
+        batches = pd.read_csv(path, chunksize=chunk_size)
+
+    site_id = 0
+    for batch in batches:
+        batch = batch.reset_index(drop=True)
+        batch.insert(0, 'site_id', range(site_id, site_id + len(batch)))
+        site_id += len(batch)
+        yield batch.to_dict('records')
+
+
+def run(input_path, output_path, workers=None, chunk_size=200, geotiff_path=siting_engine.geotiff_path,
+        wms_url=siting_engine.wms_url, trace_path=None, ndom_dir=None, power_curves_path=None, weibull_k=2.0):
+    workers = workers or os.cpu_count()
+    tracer = Tracer()
+    written = 0
+    # The workers are started fresh (spawn), so they don't inherit the thread pools, connections and
+    # open files of this process
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker,
+                             initargs=(geotiff_path, wms_url, ndom_dir, power_curves_path, weibull_k)) as executor, \
+            pq.ParquetWriter(output_path, result_schema) as writer:
+        # Keep a bounded number of chunks in flight and write them in input order
+        pending = []
+        for rows in read_sites(input_path, chunk_size):
+            pending.append(executor.submit(evaluate_chunk, rows, trace_path is not None))
+            if len(pending) >= 2 * workers:
+                written += _write(writer, tracer, *pending.pop(0).result())
+        for future in pending:
+            written += _write(writer, tracer, *future.result())
+
+    if trace_path is not None:
+        tracer.write(trace_path)
+    return written
+
+
+def _write(writer, tracer, results, spans):
+    tracer.extend(spans)
+    table = pa.Table.from_pylist(results, schema=result_schema)
+    writer.write_table(table)
+    print(f"Wrote {len(results)} sites ({sum(r.get('error') is not None for r in results)} failed)")
+    return len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score candidate wind turbine sites.")
+    parser.add_argument('input', help="CSV or Parquet file with the candidate sites")
+    parser.add_argument('output', help="Parquet file for the results")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=200, help="Sites per task and per written row group")
+    parser.add_argument('--geotiff', default=siting_engine.geotiff_path, help="Wind speed GeoTIFF at 100 meters")
+    parser.add_argument('--wms-url', default=siting_engine.wms_url, help="nDOM WMS service for the building heights")
+    parser.add_argument('--ndom-dir', default=siting_engine.ndom_dir,
+                        help="Directory of local nDOM GeoTIFF tiles, used instead of the WMS (fully offline)")
+    parser.add_argument('--power-curves', default=None,
+                        help="CSV file with the columns model, wind_speed (m/s) and power (kW)")
+    parser.add_argument('--weibull-k', type=float, default=2.0,
+                        help="Shape of the Weibull distribution of the wind speeds for the power curves")
+    parser.add_argument('--trace', default=None,
+                        help="Write the timings of all stages to this file (Chrome trace for .json, else JSON lines)")
+    args = parser.parse_args()
+
+    written = run(args.input, args.output, args.workers, args.chunk_size, args.geotiff, args.wms_url, args.trace,
+                  args.ndom_dir, args.power_curves, args.weibull_k)
+    print(f"Done: {written} sites written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
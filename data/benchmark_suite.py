@@ -0,0 +1,310 @@
+"""Benchmarks of the siting pipeline, run offline against recorded service responses.
+
+Usage:
+    python data/benchmark_suite.py record
+    python data/benchmark_suite.py run --repeat 5
+    python data/benchmark_suite.py run --update-baseline
+
+"record" sends the end-to-end workload once to the real weather API, WMS and
+Nominatim through replay_server and stores their responses. "run" replays
+them (requests that were never recorded get synthetic answers) and times every
+stage and the whole calculation. The median times are compared with the
+baseline file; a benchmark more than --tolerance slower than its baseline is
+reported as a regression and the exit code is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+import location_cache
+import replay_server
+import service_io
+import siting_engine
+from energy_engine import annual_energy_weibull, synthetic_catalogue, weibull_scale
+from ndom_decoder import build_palette_lut, decode_height_map, smooth_height_map
+from obstacle_search import cast_rays, sector_directions
+from placement_optimizer import best_locations
+from stand_in_wms import render_heights, synthetic_city
+from wind_raster import WindSpeedSampler
+from wms_tile_cache import TileCache, TiledHeightMapFetcher
+
+default_baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baseline.json')
+
+# Locations of the end-to-end workload (lat, lon) and its fixed weather window
+sites = [
+    (51.4818, 7.2162),  # Bochum
+    (51.5136, 7.4653),  # Dortmund
+    (51.4556, 7.0116),  # Essen
+    (51.9607, 7.6261),  # Münster
+    (50.9375, 6.9603),  # Köln
+    (51.2277, 6.7735),  # Düsseldorf
+]
+weather_end_date = '2024-06-30'
+hub_height = 10
+swept_area = 3.0
+years = 20
+
+
+# Function to get a synthetic height map of a city block area and its bounding box
+def _city_height_map(lat=51.4818, lon=7.2162, shape=(300, 400), bbox_size=0.001):
+    bbox = (lon - bbox_size, lat - bbox_size, lon + bbox_size, lat + bbox_size)
+    lons = bbox[0] + (np.arange(shape[1]) + 0.5) * (bbox[2] - bbox[0]) / shape[1]
+    lats = bbox[3] - (np.arange(shape[0]) + 0.5) * (bbox[3] - bbox[1]) / shape[0]
+    return synthetic_city(*np.meshgrid(lons, lats)).astype(float), bbox
+
+
+# Every benchmark is a function that prepares its inputs and returns (run, number of items).
+# Only run() is timed.
+
+def bench_raster_sampling(count=10000):
+    sampler = WindSpeedSampler(siting_engine.geotiff_path)
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(50.4, 52.4, count)
+    lons = rng.uniform(6.0, 9.4, count)
+    return lambda: sampler.wind_speed_at_height(lats, lons, hub_height), count
+
+
+def bench_palette_decode():
+    image = render_heights(_city_height_map()[0])
+    lut = build_palette_lut()
+    return lambda: decode_height_map(image, lut), 1
+
+
+def bench_smoothing():
+    height_map = decode_height_map(render_heights(_city_height_map()[0]))
+    return lambda: smooth_height_map(height_map.copy()), 1
+
+
+def bench_obstacle_search():
+    height_map, bbox = _city_height_map()
+    lat, lon = (bbox[1] + bbox[3]) / 2, (bbox[0] + bbox[2]) / 2
+    directions = sector_directions(225)
+    return lambda: cast_rays(height_map, bbox, lat, lon, directions, hub_height), 1
+
+
+def bench_obstacle_search_full_circle():
+    height_map, bbox = _city_height_map()
+    lat, lon = (bbox[1] + bbox[3]) / 2, (bbox[0] + bbox[2]) / 2
+    directions = sector_directions(0, sector_width=360)
+    return lambda: cast_rays(height_map, bbox, lat, lon, directions, hub_height), 1
+
+
+def bench_hub_height_sweep(count=40):
+    height_map, bbox = _city_height_map()
+    lat, lon = (bbox[1] + bbox[3]) / 2, (bbox[0] + bbox[2]) / 2
+    h2_values = np.linspace(2, 40, count)
+    return lambda: siting_engine.upwind_obstacles(height_map, bbox, lat, lon, 225, h2_values), count
+
+
+def bench_energy_co2(count=100000):
+    wind_speeds = np.random.default_rng(0).uniform(0, 8, count)
+
+    def run():
+        wind_power = siting_engine.calculate_wind_power(swept_area, wind_speeds)
+        annual_energy_output = siting_engine.calculate_annual_energy_output(wind_power)
+        for co2_per_kwh in siting_engine.emission_factors.values():
+            siting_engine.calculate_total_co2_savings(
+                siting_engine.calculate_co2_savings(annual_energy_output, co2_per_kwh), years)
+
+    return run, count
+
+
+def bench_power_curve_sweep(turbines=200, count=10000):
+    power_curves = synthetic_catalogue(turbines)
+    scales = weibull_scale(np.random.default_rng(0).uniform(3, 8, count))
+    return lambda: annual_energy_weibull(power_curves, 2.0, scales), turbines * count
+
+
+def bench_placement_search():
+    height_map, bbox = _city_height_map()
+    return lambda: best_locations(height_map, bbox, 225, 4.0, hub_height, swept_area), 1
+
+
+# The end-to-end benchmarks send their requests to replay_server. A cold run starts with empty
+# tile and location caches, a warm run repeats the same calculations with the filled caches.
+class _Workload:
+
+    def __init__(self, wms_url):
+        self.wms_url = wms_url
+        self.sampler = WindSpeedSampler(siting_engine.geotiff_path)
+        self._directory = tempfile.TemporaryDirectory(prefix='wind_benchmark_')
+        self._runs = 0
+        self.clear_caches()
+
+    def clear_caches(self):
+        self._runs += 1
+        cache_dir = os.path.join(self._directory.name, str(self._runs))
+        # get_location_cache() of the pipeline opens one cache per path, so a new path starts empty
+        location_cache.default_cache_path = os.path.join(cache_dir, 'locations.sqlite')
+        self.height_maps = TiledHeightMapFetcher(self.wms_url, siting_engine.building_height_layer,
+                                                 TileCache(os.path.join(cache_dir, 'ndom')))
+
+    def evaluate_sites(self):
+        return [siting_engine.evaluate_site(self.sampler, lat, lon, hub_height, swept_area, years,
+                                            height_maps=self.height_maps, weather_end_date=weather_end_date)
+                for lat, lon in sites]
+
+    def reverse_geocode_sites(self):
+        return [service_io.reverse_geocode(lat, lon) for lat, lon in sites]
+
+
+# Function to time run() repeat times, calling before() untimed ahead of every run
+def _time(run, repeat, before=None):
+    durations = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+# Function to run all benchmarks. Returns {name: {'median_s', 'min_s', 'items_per_s'}}.
+def run_benchmarks(wms_url, repeat=5, only=None):
+    stage_benchmarks = {
+        'raster_sampling': bench_raster_sampling,
+        'palette_decode': bench_palette_decode,
+        'smoothing': bench_smoothing,
+        'obstacle_search': bench_obstacle_search,
+        'obstacle_search_full_circle': bench_obstacle_search_full_circle,
+        'hub_height_sweep': bench_hub_height_sweep,
+        'energy_co2': bench_energy_co2,
+        'power_curve_sweep': bench_power_curve_sweep,
+        'placement_search': bench_placement_search,
+    }
+    workload = _Workload(wms_url)
+    # Cold runs clear the caches first, warm runs fill them once before timing
+    service_benchmarks = {
+        'reverse_geocode_cold': (workload.reverse_geocode_sites, workload.clear_caches, len(sites)),
+        'end_to_end_cold': (workload.evaluate_sites, workload.clear_caches, len(sites)),
+        'end_to_end_warm': (workload.evaluate_sites, None, len(sites)),
+    }
+
+    results = {}
+    for name, bench in stage_benchmarks.items():
+        if only and name not in only:
+            continue
+        run, items = bench()
+        run()  # warm-up, e.g. the first read of raster blocks
+        results[name] = _summarize(_time(run, repeat), items)
+    for name, (run, before, items) in service_benchmarks.items():
+        if only and name not in only:
+            continue
+        if before is None:
+            run()
+        results[name] = _summarize(_time(run, repeat, before), items)
+    return results
+
+
+def _summarize(durations, items):
+    median = statistics.median(durations)
+    return {'median_s': median, 'min_s': min(durations), 'items_per_s': items / median}
+
+
+# Function to compare results with a baseline. Returns a list of (name, baseline, current, ratio)
+# for the benchmarks whose median time grew by more than tolerance (0.25 is 25 % slower).
+def find_regressions(results, baseline, tolerance=0.25):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get('benchmarks', {}).get(name)
+        if reference is None:
+            continue
+        ratio = result['median_s'] / reference['median_s']
+        if ratio > 1 + tolerance:
+            regressions.append((name, reference['median_s'], result['median_s'], ratio))
+    return regressions
+
+
+def machine_info():
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'numpy': np.__version__}
+
+
+def _print_results(results, baseline):
+    reference = baseline.get('benchmarks', {}) if baseline else {}
+    print(f"{'benchmark':<30}{'median ms':>12}{'items/s':>14}{'baseline ms':>14}{'change':>9}")
+    for name, result in results.items():
+        line = f"{name:<30}{result['median_s'] * 1000:>12.2f}{result['items_per_s']:>14.1f}"
+        if name in reference:
+            change = result['median_s'] / reference[name]['median_s'] - 1
+            line += f"{reference[name]['median_s'] * 1000:>14.2f}{change:>+9.0%}"
+        print(line)
+
+
+def record(recordings_dir):
+    server, url = replay_server.serve('record', recordings_dir)
+    wms_url = replay_server.use_server(url)
+    workload = _Workload(wms_url)
+    workload.evaluate_sites()
+    workload.reverse_geocode_sites()
+    server.shutdown()
+    print(f"Recorded {server.stats['recorded']} responses in {recordings_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the siting pipeline against recorded services.")
+    parser.add_argument('command', choices=['record', 'run'])
+    parser.add_argument('--recordings', default=replay_server.default_recordings_dir,
+                        help="Directory of the recorded service responses")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument('--only', nargs='+', help="Run only these benchmarks")
+    parser.add_argument('--baseline', default=default_baseline_path, help="Baseline JSON file")
+    parser.add_argument('--update-baseline', action='store_true', help="Store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed slowdown against the baseline before a regression is reported")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.recordings)
+        return 0
+
+    server, url = replay_server.serve('replay', args.recordings)
+    results = run_benchmarks(replay_server.use_server(url), args.repeat, args.only)
+    server.shutdown()
+    if server.stats['synthetic']:
+        print(f"Note: {server.stats['synthetic']} requests were not recorded and got synthetic answers")
+
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'machine': machine_info(),
+              'repeat': args.repeat, 'benchmarks': results}
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    _print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.update_baseline:
+        if baseline is not None:
+            # Benchmarks left out with --only keep their old baseline
+            report['benchmarks'] = {**baseline.get('benchmarks', {}), **results}
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        return 0
+
+    if baseline.get('machine') != report['machine']:
+        print("Warning: the baseline was measured on a different machine or software versions")
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for name, before, after, ratio in regressions:
+        print(f"REGRESSION {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms ({ratio - 1:+.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from location_cache import geohash
+
+
+class PoolBusy(Exception):
+    pass
+
+
+# Runs pipeline jobs on a bounded number of worker threads shared by all users of the process.
+# At most max_queue jobs wait for a worker; further submissions wait up to queue_timeout seconds
+# for a free place and are then rejected with PoolBusy. Jobs with the same key that are queued or
+# running at the same time run only once, and all callers get the same future.
+class ComputePool:
+
+    def __init__(self, max_workers=None, max_queue=32, queue_timeout=10, wait_history=1000):
+        self.max_workers = max_workers or os.cpu_count() or 4
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='compute')
+        self._slots = threading.BoundedSemaphore(self.max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._queued = 0
+        self._running = 0
+        self._counts = {'submitted': 0, 'coalesced': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+        # Seconds between submission and start of the last jobs
+        self._wait_times = deque(maxlen=wait_history)
+
+    # Function to run fn(*args, **kwargs) on the pool, or join the identical job already in flight.
+    # Returns a concurrent.futures.Future.
+    def submit(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._counts['coalesced'] += 1
+                return future
+
+        # Backpressure: wait for a place in the queue outside of the lock
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._counts['rejected'] += 1
+            raise PoolBusy(f"All {self.max_workers} workers are busy and {self.max_queue} jobs are waiting")
+
+        with self._lock:
+            # The same job may have been submitted while waiting for the place
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._slots.release()
+                self._counts['coalesced'] += 1
+                return future
+            future = Future()
+            self._in_flight[key] = future
+            self._queued += 1
+            self._counts['submitted'] += 1
+
+        context = contextvars.copy_context()
+        self._executor.submit(self._run, key, future, time.monotonic(), context, fn, args, kwargs)
+        return future
+
+    def _run(self, key, future, submitted, context, fn, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._wait_times.append(time.monotonic() - submitted)
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(context.run(fn, *args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._counts['failed' if future.cancelled() or future.exception() else 'completed'] += 1
+                del self._in_flight[key]
+            self._slots.release()
+
+    # Function to get the current load and the statistics of the pool
+    def metrics(self):
+        with self._lock:
+            wait_times = np.array(self._wait_times)
+            metrics = {'workers': self.max_workers, 'queue_depth': self._queued, 'running': self._running,
+                       'in_flight': len(self._in_flight), **self._counts}
+        if len(wait_times):
+            metrics['wait_p50_ms'] = float(np.percentile(wait_times, 50) * 1000)
+            metrics['wait_p95_ms'] = float(np.percentile(wait_times, 95) * 1000)
+            metrics['wait_max_ms'] = float(wait_times.max() * 1000)
+        return metrics
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait)
+
+
+# Function to get the key of a site calculation. Locations in the same geohash cell (precision 9
+# is about 5 x 5 m) share the key, as do turbines with the same hub height and swept area.
+def site_key(lat, lon, h2, A, *options, precision=9):
+    return (geohash(lat, lon, precision), round(float(h2), 2), round(float(A), 3)) + options
+
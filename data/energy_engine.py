@@ -0,0 +1,213 @@
+"""Annual energy of many turbine models at many sites, from tabulated power curves.
+
+Usage:
+    python data/energy_engine.py --turbines 200 --sites 10000
+
+The hours of every site are spread over a fine grid of wind speeds (linear
+binning of hourly series, or the probabilities of a Weibull distribution), so
+the energy of all turbines at all sites is one matrix product:
+hours per speed (sites x speeds) @ power per speed (speeds x turbines) = kWh.
+Running it directly times a sweep of a synthetic turbine catalogue.
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+air_density = 1.2255
+hours_per_year = 24 * 365
+
+# Grid of wind speeds (m/s) for the power curves and histograms
+speed_step = 0.25
+max_speed = 40.0
+
+
+# Power curves of several turbine models, resampled to a common grid of wind speeds.
+# curves is a list of (wind speeds in m/s, power in kW) tables, one per model.
+class PowerCurves:
+
+    def __init__(self, models, curves, speed_step=speed_step, max_speed=max_speed):
+        self.models = list(models)
+        self.wind_speeds = np.arange(0, max_speed + speed_step / 2, speed_step)
+        # Outside of its table a turbine produces nothing (below cut-in, above cut-out)
+        self.power = np.array([np.interp(self.wind_speeds, speeds, power, left=0, right=0)
+                               for speeds, power in curves])
+        self.rated_power = self.power.max(axis=1)
+
+    def __len__(self):
+        return len(self.models)
+
+    # Function to get the power curves of some of the models, by name
+    def select(self, models):
+        if isinstance(models, str):
+            models = [models]
+        missing = [model for model in models if model not in self.models]
+        if missing:
+            raise ValueError(f"Unknown turbine model: {', '.join(map(str, missing))}")
+        selected = PowerCurves.__new__(PowerCurves)
+        rows = [self.models.index(model) for model in models]
+        selected.models = list(models)
+        selected.wind_speeds = self.wind_speeds
+        selected.power = self.power[rows]
+        selected.rated_power = self.rated_power[rows]
+        return selected
+
+
+# Function to get the power curve (speeds, power in kW) of a generic turbine: the wind power
+# times cp from cut_in, limited to rated_power, and nothing from cut_out on.
+def parametric_power_curve(rated_power, swept_area, cut_in=3.0, rated_speed=None, cut_out=25.0, cp=0.4):
+    speeds = np.arange(0, cut_out + speed_step / 2, speed_step / 2)
+    power = (air_density / 2) * swept_area * speeds ** 3 * cp / 1000
+    if rated_speed is not None:
+        power = np.minimum(power, power[np.searchsorted(speeds, rated_speed)])
+    power = np.minimum(power, rated_power)
+    power[speeds < cut_in] = 0
+    # Drop to zero right after the last speed of the table
+    return np.append(speeds, cut_out + 1e-6), np.append(power, 0.0)
+
+
+# Function to read power curves from a CSV file with the columns model, wind_speed (m/s) and power (kW)
+def load_power_curves(path):
+    import pandas as pd
+
+    table = pd.read_csv(path).sort_values(['model', 'wind_speed'])
+    models, curves = [], []
+    for model, rows in table.groupby('model', sort=False):
+        models.append(model)
+        curves.append((rows['wind_speed'].to_numpy(float), rows['power'].to_numpy(float)))
+    return PowerCurves(models, curves)
+
+
+# Function to spread the hours of each site over the speed grid. Every hour is split between
+# the two nearest grid speeds (linear binning), so the energy equals the one of the interpolated
+# power curve. wind_speeds has one row of hourly speeds per site; NaN hours are left out.
+# Returns an array sites x grid speeds.
+def speed_histogram(wind_speeds, grid):
+    wind_speeds = np.atleast_2d(wind_speeds)
+    sites, size = wind_speeds.shape[0], len(grid)
+    step = grid[1] - grid[0]
+    valid = ~np.isnan(wind_speeds)
+    # Speeds above the grid count as the last grid speed
+    position = np.clip(np.where(valid, wind_speeds, 0) / step, 0, size - 1)
+    lower = np.minimum(position.astype(np.int64), size - 2)
+    upper_share = position - lower
+    # One bincount over all sites: every site has its own range of counters
+    index = (lower + np.arange(sites)[:, None] * size)[valid]
+    upper_share = upper_share[valid]
+    counts = np.bincount(index, 1 - upper_share, minlength=sites * size)
+    counts += np.bincount(index + 1, upper_share, minlength=sites * size)
+    return counts.reshape(sites, size)
+
+
+# Function to get the hours per year at each grid speed for Weibull distributions with shape k
+# and scale c (one value or one per site). Each grid speed gets the hours of the speeds closer to
+# it than to its neighbours. Returns an array sites x grid speeds.
+def weibull_hours(k, c, grid, hours=hours_per_year):
+    k = np.atleast_1d(np.asarray(k, dtype=float))[:, None]
+    c = np.atleast_1d(np.asarray(c, dtype=float))[:, None]
+    edges = np.concatenate([[0], (grid[:-1] + grid[1:]) / 2, [np.inf]])
+    cdf = 1 - np.exp(-(edges[None, :] / c) ** k)
+    return hours * np.diff(cdf, axis=1)
+
+
+# Function to get the Weibull scale that gives the mean wind speed for shape k (k=2 is a Rayleigh distribution)
+def weibull_scale(mean_wind_speed, k=2.0):
+    k = np.asarray(k, dtype=float)
+    return np.asarray(mean_wind_speed, dtype=float) / np.vectorize(math.gamma)(1 + 1 / k)
+
+
+# Function to fit a Weibull distribution to every row of hourly wind speeds (method of moments).
+# Returns the shape k and the scale c per site.
+def fit_weibull(wind_speeds):
+    wind_speeds = np.atleast_2d(wind_speeds)
+    mean = np.nanmean(wind_speeds, axis=1)
+    std = np.nanstd(wind_speeds, axis=1)
+    k = np.clip((std / mean) ** -1.086, 0.5, 10)
+    return k, weibull_scale(mean, k)
+
+
+# Function to get the energy (kWh) of every turbine at every site from the hours per grid speed.
+# Returns an array sites x turbines.
+def energy_from_hours(power_curves, hours):
+    return hours @ power_curves.power.T
+
+
+# Function to get the annual energy (kWh, sites x turbines) for Weibull distributed wind speeds
+def annual_energy_weibull(power_curves, k, c, chunk_size=4096):
+    c = np.atleast_1d(np.asarray(c, dtype=float))
+    k = np.broadcast_to(np.asarray(k, dtype=float), c.shape)
+    energy = np.empty((len(c), len(power_curves)))
+    # Chunks keep the hours table small for very many sites
+    for start in range(0, len(c), chunk_size):
+        end = start + chunk_size
+        energy[start:end] = energy_from_hours(power_curves, weibull_hours(k[start:end], c[start:end],
+                                                                          power_curves.wind_speeds))
+    return energy
+
+
+# Function to get the annual energy (kWh, sites x turbines) at sites with the given mean wind speeds
+# at hub height, assuming Weibull distributed speeds with shape k. Sites without wind give 0.
+def annual_energy_at_mean_speed(power_curves, mean_wind_speed, k=2.0):
+    mean_wind_speed = np.atleast_1d(np.asarray(mean_wind_speed, dtype=float))
+    windy = mean_wind_speed > 0
+    energy = np.zeros((len(mean_wind_speed), len(power_curves)))
+    if windy.any():
+        energy[windy] = annual_energy_weibull(power_curves, k, weibull_scale(mean_wind_speed[windy], k))
+    return energy
+
+
+# Function to get the annual energy (kWh, sites x turbines) from hourly wind speed series at hub
+# height (one row per site). Series shorter or longer than a year, or with gaps, are scaled to a year.
+def annual_energy_from_series(power_curves, wind_speeds, chunk_size=1024):
+    wind_speeds = np.atleast_2d(wind_speeds)
+    energy = np.empty((wind_speeds.shape[0], len(power_curves)))
+    for start in range(0, wind_speeds.shape[0], chunk_size):
+        hours = speed_histogram(wind_speeds[start:start + chunk_size], power_curves.wind_speeds)
+        valid_hours = hours.sum(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hours *= hours_per_year / valid_hours
+        energy[start:start + chunk_size] = energy_from_hours(power_curves, hours)
+    return energy
+
+
+# Function to get the capacity factors (sites x turbines) of annual energies
+def capacity_factors(power_curves, annual_energy):
+    return annual_energy / (power_curves.rated_power * hours_per_year)
+
+
+# Function to make a catalogue of generic turbines from 1 to 3000 kW, e.g. for benchmarks
+def synthetic_catalogue(count, seed=0):
+    rng = np.random.default_rng(seed)
+    rated_power = np.geomspace(1, 3000, count)
+    # Rated at 10 to 14 m/s
+    rated_speed = rng.uniform(10, 14, count)
+    swept_area = rated_power * 1000 / (air_density / 2 * 0.4 * rated_speed ** 3)
+    cut_in = rng.uniform(2, 4, count)
+    curves = [parametric_power_curve(*values) for values in zip(rated_power, swept_area, cut_in, rated_speed)]
+    return PowerCurves([f"generic_{p:.0f}kW" for p in rated_power], curves)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time a sweep of turbine power curves over many sites.")
+    parser.add_argument('--turbines', type=int, default=200)
+    parser.add_argument('--sites', type=int, default=10000)
+    parser.add_argument('--series-sites', type=int, default=1000, help="Sites with a full year of hourly speeds")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    power_curves = synthetic_catalogue(args.turbines)
+    mean_speeds = rng.uniform(3, 8, args.sites)
+
+    start = time.perf_counter()
+    energy = annual_energy_weibull(power_curves, 2.0, weibull_scale(mean_speeds))
+    print(f"Weibull: {args.turbines} turbines x {args.sites} sites in {time.perf_counter() - start:.3f} s")
+
+    series = (weibull_scale(mean_speeds[:args.series_sites])[:, None] *
+              rng.weibull(2.0, (args.series_sites, hours_per_year))).astype(np.float32)
+    start = time.perf_counter()
+    series_energy = annual_energy_from_series(power_curves, series)
+    print(f"Hourly series: {args.turbines} turbines x {args.series_sites} sites x {hours_per_year} hours "
+          f"in {time.perf_counter() - start:.3f} s")
+    deviation = np.nanmedian(np.abs(series_energy / energy[:args.series_sites] - 1))
+    print(f"Median deviation between the two: {deviation:.2%}")
@@ -0,0 +1,220 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+
+default_cache_path = os.environ.get('LOCATION_CACHE_PATH',
+                                    os.path.join(os.path.expanduser('~'), '.cache', 'wind_turbine_tool',
+                                                 'locations.sqlite'))
+
+_base32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+# Function to encode a location as a geohash (precision 7 is about 150 x 150 m, 8 about 40 x 20 m)
+def geohash(lat, lon, precision=7):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, value_range = (lon, lon_range) if even else (lat, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_base32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+# Function to get the bounds (south, west, north, east) of a geohash cell
+def geohash_bounds(cell):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        bits = _base32.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            mid = (value_range[0] + value_range[1]) / 2
+            if bits >> shift & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+# Function to get the centre (lat, lon) of a geohash cell
+def geohash_center(cell):
+    south, west, north, east = geohash_bounds(cell)
+    return (south + north) / 2, (west + east) / 2
+
+
+# Function to get the day (YYYY-MM-DD) of a Visual Crossing value
+def _value_day(value):
+    if 'datetimeStr' in value:
+        return value['datetimeStr'][:10]
+    return datetime.fromtimestamp(value['datetime'] / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+
+# Function to split a list of days into ranges of consecutive days
+def _day_ranges(days):
+    ranges = []
+    for day in days:
+        if ranges and date.fromisoformat(day) - date.fromisoformat(ranges[-1][1]) == timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return ranges
+
+
+# Persistent cache of place names and daily weather, keyed on geohash cells.
+# Entries expire after their TTL and the least recently used ones are removed above max_entries.
+class LocationCache:
+
+    def __init__(self, path=default_cache_path, max_entries=100000, geocode_precision=8, weather_precision=7,
+                 geocode_ttl=30 * 24 * 3600, weather_ttl=365 * 24 * 3600, recent_weather_ttl=6 * 3600,
+                 recent_days=3, missing_weather_ttl=3600):
+        self.max_entries = max_entries
+        self.geocode_precision = geocode_precision
+        self.weather_precision = weather_precision
+        self.geocode_ttl = geocode_ttl
+        self.weather_ttl = weather_ttl
+        # The last few days may still be corrected by the weather service, so they expire sooner
+        self.recent_weather_ttl = recent_weather_ttl
+        self.recent_days = recent_days
+        # Days the weather service had no data for (usually today) are asked for again after this time
+        self.missing_weather_ttl = missing_weather_ttl
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS places "
+                             "(cell TEXT PRIMARY KEY, address TEXT, expires REAL, last_access REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS weather_days "
+                             "(cell TEXT, day TEXT, value TEXT, expires REAL, last_access REAL, "
+                             "PRIMARY KEY (cell, day))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS aggregates "
+                             "(cell TEXT, key TEXT, value TEXT, expires REAL, last_access REAL, "
+                             "PRIMARY KEY (cell, key))")
+
+    # Function to get the place name of a location, calling geocode(lat, lon) on a cache miss
+    def reverse_geocode(self, lat, lon, geocode):
+        cell = geohash(lat, lon, self.geocode_precision)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT address FROM places WHERE cell = ? AND expires > ?", (cell, now)).fetchone()
+            if row is not None:
+                with self._db:
+                    self._db.execute("UPDATE places SET last_access = ? WHERE cell = ?", (now, cell))
+                return row[0]
+
+        address = geocode(lat, lon)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?)",
+                             (cell, address, now + self.geocode_ttl, now))
+            self._evict('places')
+        return address
+
+    # Function to get the daily weather of a location between start_date and end_date (YYYY-MM-DD).
+    # Only the days missing from the cache are fetched with fetch(location, start_date, end_date),
+    # which must return a Visual Crossing history response. The result has the same structure.
+    def weather(self, lat, lon, start_date, end_date, fetch):
+        cell = geohash(lat, lon, self.weather_precision)
+        center_lat, center_lon = geohash_center(cell)
+        location = f"{center_lat:.6f},{center_lon:.6f}"
+        start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute("SELECT day, value FROM weather_days WHERE cell = ? AND day BETWEEN ? AND ? "
+                                    "AND expires > ?", (cell, start_date, end_date, now)).fetchall()
+            with self._db:
+                self._db.execute("UPDATE weather_days SET last_access = ? WHERE cell = ? AND day BETWEEN ? AND ?",
+                                 (now, cell, start_date, end_date))
+        cached = {day: json.loads(value) for day, value in rows}
+
+        # Fetch each run of missing days with one request
+        missing = [day for day in days if day not in cached]
+        for first_day, last_day in _day_ranges(missing):
+            data = fetch(location, first_day, last_day)
+            fetched = {}
+            for location_data in data.get('locations', {}).values():
+                for value in location_data.get('values', []):
+                    fetched[_value_day(value)] = value
+            self._store_days(cell, fetched)
+            cached.update({day: value for day, value in fetched.items() if first_day <= day <= last_day})
+            # Days without data are cached as missing (null) for a short time, so they are not fetched on every call
+            not_found = {day: None for day in missing if first_day <= day <= last_day and day not in fetched}
+            if not_found:
+                self._store_days(cell, not_found, self.missing_weather_ttl)
+                cached.update(not_found)
+
+        values = [cached[day] for day in days if cached.get(day) is not None]
+        return {'locations': {location: {'values': values}}}
+
+    # Function to get a value computed from the weather of a location up to last_day (YYYY-MM-DD),
+    # e.g. the statistics of one month. On a cache miss compute(location) is called with the location
+    # string of the weather cell, and must return a JSON serializable value.
+    def aggregate(self, lat, lon, key, last_day, compute):
+        cell = geohash(lat, lon, self.weather_precision)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value FROM aggregates WHERE cell = ? AND key = ? AND expires > ?",
+                                   (cell, key, now)).fetchone()
+            if row is not None:
+                with self._db:
+                    self._db.execute("UPDATE aggregates SET last_access = ? WHERE cell = ? AND key = ?",
+                                     (now, cell, key))
+                return json.loads(row[0])
+
+        center_lat, center_lon = geohash_center(cell)
+        value = compute(f"{center_lat:.6f},{center_lon:.6f}")
+        recent = (date.today() - timedelta(days=self.recent_days)).isoformat()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO aggregates VALUES (?, ?, ?, ?, ?)", (
+                cell, key, json.dumps(value),
+                now + (self.recent_weather_ttl if last_day >= recent else self.weather_ttl), now))
+            self._evict('aggregates')
+        return value
+
+    def _store_days(self, cell, values, ttl=None):
+        now = time.time()
+        recent = (date.today() - timedelta(days=self.recent_days)).isoformat()
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO weather_days VALUES (?, ?, ?, ?, ?)", [
+                (cell, day, json.dumps(value),
+                 now + (ttl if ttl is not None else self.recent_weather_ttl if day >= recent else self.weather_ttl),
+                 now)
+                for day, value in values.items()])
+            self._evict('weather_days')
+
+    def _evict(self, table):
+        self._db.execute(f"DELETE FROM {table} WHERE expires <= ?", (time.time(),))
+        count = self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute(f"DELETE FROM {table} WHERE rowid IN "
+                             f"(SELECT rowid FROM {table} ORDER BY last_access LIMIT ?)", (count - self.max_entries,))
+
+
+# Function to get the location cache shared by the whole process (default_cache_path if path is None)
+def get_location_cache(path=None):
+    return _location_cache(path or default_cache_path)
+
+
+@lru_cache(maxsize=None)
+def _location_cache(path):
+    return LocationCache(path)
+
+
+# A forked process opens its own database connection instead of using the parent's
+os.register_at_fork(after_in_child=_location_cache.cache_clear)
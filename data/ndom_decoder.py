@@ -0,0 +1,147 @@
+import numpy as np
+
+# Color to height mapping of the nw_ndom WMS layer (RGBA -> height range in meters)
+color_to_height = {
+    (255, 255, 255, 255): (0, 1.5),
+    (31, 120, 180, 255): (1.5, 3.0),
+    (54, 214, 209, 255): (3.0, 5.0),
+    (64, 207, 39, 255): (5.0, 10.0),
+    (255, 255, 71, 255): (10.0, 15.0),
+    (255, 206, 71, 255): (15.0, 20.0),
+    (255, 127, 0, 255): (20.0, 25.0),
+    (215, 25, 28, 255): (25.0, 50.0),
+    (114, 0, 11, 255): 50.0
+}
+
+
+# Function to pack RGBA values into single uint32 keys
+def _pack_rgba(rgba):
+    rgba = rgba.astype(np.uint32)
+    return (rgba[..., 0] << 24) | (rgba[..., 1] << 16) | (rgba[..., 2] << 8) | rgba[..., 3]
+
+
+# Function to build the palette lookup table (sorted keys and the matching heights)
+def build_palette_lut(palette=None):
+    if palette is None:
+        palette = color_to_height
+    colors = np.array(list(palette.keys()), dtype=np.uint8)
+    # Ranges are represented by their midpoint, single values are used as they are
+    heights = np.array([np.mean(value) if isinstance(value, tuple) else value
+                        for value in palette.values()], dtype=float)
+    keys = _pack_rgba(colors)
+    order = np.argsort(keys)
+    return keys[order], heights[order]
+
+
+_default_lut = build_palette_lut()
+
+
+# Function to convert an RGBA image (PIL image or HxWx4 array) into a height map
+def decode_height_map(image, lut=None):
+    keys, heights = _default_lut if lut is None else lut
+    if not isinstance(image, np.ndarray):
+        image = np.asarray(image.convert('RGBA'))
+
+    pixel_keys = _pack_rgba(image)
+    idx = np.searchsorted(keys, pixel_keys)
+    idx[idx == len(keys)] = 0
+    # Colors that are not part of the palette have no height data
+    return np.where(keys[idx] == pixel_keys, heights[idx], np.nan)
+
+
+# Function to smooth transitions between height ranges using the 4 neighbours of each pixel
+def smooth_height_map(height_map):
+    # The smoothing is done in place row by row, so the upper and left neighbours
+    # have already been smoothed when a pixel is visited. All pixels of one
+    # anti-diagonal only depend on the previous one, which lets us process a whole
+    # diagonal at once and still give the same result as the pixel by pixel loop.
+    height_map = np.array(height_map, dtype=float)
+    height, width = height_map.shape
+    if height < 3 or width < 3:
+        return height_map
+
+    flat = height_map.reshape(-1)
+    for diagonal in range(2, height + width - 3):
+        ys = np.arange(max(1, diagonal - (width - 2)), min(height - 2, diagonal - 1) + 1)
+        idx = ys * width + (diagonal - ys)
+        idx = idx[~np.isnan(flat[idx])]
+        if idx.size == 0:
+            continue
+
+        # Neighbours are summed in the same order as before (up, down, left, right)
+        total = np.zeros(idx.size)
+        count = np.zeros(idx.size)
+        for neighbour in (flat[idx - width], flat[idx + width], flat[idx - 1], flat[idx + 1]):
+            valid = ~np.isnan(neighbour)
+            total += np.where(valid, neighbour, 0.0)
+            count += valid
+
+        has_values = count > 0
+        flat[idx[has_values]] = total[has_values] / count[has_values]
+
+    return height_map
+
+
+# Function to turn a WMS nDOM image into a smoothed height map
+def image_to_height_map(image, lut=None):
+    return smooth_height_map(decode_height_map(image, lut))
+
+
+# Reference implementation with the original pixel by pixel loops, used by the benchmark
+def _image_to_height_map_loops(image):
+    width, height = image.size
+    height_map = np.zeros((height, width))
+    pixels = image.load()
+
+    for y in range(height):
+        for x in range(width):
+            rgba = pixels[x, y]
+            if rgba in color_to_height:
+                height_value = color_to_height[rgba]
+                if isinstance(height_value, tuple):
+                    height_map[y, x] = np.mean(height_value)
+                else:
+                    height_map[y, x] = height_value
+            else:
+                height_map[y, x] = np.nan
+
+    for y in range(1, height - 1):
+        for x in range(1, width - 1):
+            if not np.isnan(height_map[y, x]):
+                surrounding_values = [
+                    height_map[y - 1, x], height_map[y + 1, x],
+                    height_map[y, x - 1], height_map[y, x + 1]
+                ]
+                valid_values = [v for v in surrounding_values if not np.isnan(v)]
+                if valid_values:
+                    height_map[y, x] = np.mean(valid_values)
+
+    return height_map
+
+
+# Micro-benchmark: python data/ndom_decoder.py [width] [height] [repeats]
+if __name__ == '__main__':
+    import sys
+    import timeit
+    from PIL import Image
+
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    # Random image using the palette colors plus transparent pixels without height data
+    rng = np.random.default_rng(0)
+    colors = np.array(list(color_to_height.keys()) + [(0, 0, 0, 0)], dtype=np.uint8)
+    image = Image.fromarray(colors[rng.integers(0, len(colors), size=(height, width))], 'RGBA')
+
+    vectorized = image_to_height_map(image)
+    loops = _image_to_height_map_loops(image)
+    identical = np.array_equal(vectorized, loops, equal_nan=True)
+
+    time_vectorized = min(timeit.repeat(lambda: image_to_height_map(image), number=1, repeat=repeats))
+    time_loops = min(timeit.repeat(lambda: _image_to_height_map_loops(image), number=1, repeat=1))
+
+    print(f"Image size: {width} x {height}")
+    print(f"Loops:      {time_loops * 1000:.1f} ms")
+    print(f"Vectorized: {time_vectorized * 1000:.1f} ms ({time_loops / time_vectorized:.0f}x faster)")
+    print(f"Identical output: {identical}")
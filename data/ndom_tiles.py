@@ -0,0 +1,228 @@
+"""Building heights from a directory of local nDOM GeoTIFF tiles, without the WMS.
+
+Usage:
+    python data/ndom_tiles.py /path/to/ndom_tiles --lat 51.4818 --lon 7.2162
+
+The footprints of all tiles are kept in an R-tree, so a query opens only the
+tiles it intersects and reads only the window it needs. The heights are true
+meters, not the palette classes of the WMS image. Running it directly indexes
+the directory and times a few height map queries.
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds
+
+from pipeline_trace import span
+
+index_file_name = 'ndom_index.json'
+
+
+def _str_order(boxes, node_size):
+    # Sort-Tile-Recursive packing: vertical slabs by x, then y within every slab
+    groups = math.ceil(len(boxes) / node_size)
+    slab_size = math.ceil(math.sqrt(groups)) * node_size
+    center_x = boxes[:, 0] + boxes[:, 2]
+    center_y = boxes[:, 1] + boxes[:, 3]
+    slabs = np.empty(len(boxes), dtype=np.int64)
+    slabs[np.argsort(center_x, kind='stable')] = np.arange(len(boxes)) // slab_size
+    return np.lexsort((center_y, slabs))
+
+
+def _overlaps(boxes, bbox):
+    west, south, east, north = bbox
+    return (boxes[:, 0] <= east) & (boxes[:, 2] >= west) & (boxes[:, 1] <= north) & (boxes[:, 3] >= south)
+
+
+# Static R-tree over bounding boxes (west, south, east, north), packed with Sort-Tile-Recursive.
+# Every level is a numpy array, so a query tests whole levels at once.
+class TileIndex:
+
+    def __init__(self, boxes, node_size=16):
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.node_size = node_size
+        order = _str_order(boxes, node_size) if len(boxes) else np.arange(0)
+        self._leaf_items = order
+        self._leaf_boxes = boxes[order]
+
+        # Upper levels: the boxes of the nodes and their range of children in the level below
+        self._levels = []
+        level_boxes = self._leaf_boxes
+        while len(level_boxes) > node_size:
+            starts = np.arange(0, len(level_boxes), node_size)
+            ends = np.minimum(starts + node_size, len(level_boxes))
+            parents = np.column_stack([np.minimum.reduceat(level_boxes[:, 0], starts),
+                                       np.minimum.reduceat(level_boxes[:, 1], starts),
+                                       np.maximum.reduceat(level_boxes[:, 2], starts),
+                                       np.maximum.reduceat(level_boxes[:, 3], starts)])
+            parent_order = _str_order(parents, node_size)
+            self._levels.append((parents[parent_order], starts[parent_order], ends[parent_order]))
+            level_boxes = parents[parent_order]
+
+    def __len__(self):
+        return len(self._leaf_items)
+
+    # Function to get the indices of the boxes that intersect bbox (west, south, east, north)
+    def query(self, bbox):
+        if not self._levels:
+            candidates = np.arange(len(self._leaf_boxes))
+        else:
+            candidates = np.arange(len(self._levels[-1][0]))
+            for level in range(len(self._levels) - 1, -1, -1):
+                level_boxes, starts, ends = self._levels[level]
+                hit = candidates[_overlaps(level_boxes[candidates], bbox)]
+                # All children of the hit nodes, as one index array
+                lengths = ends[hit] - starts[hit]
+                offsets = np.repeat(starts[hit] - np.cumsum(lengths) + lengths, lengths)
+                candidates = np.arange(lengths.sum()) + offsets
+        hit = candidates[_overlaps(self._leaf_boxes[candidates], bbox)]
+        return np.sort(self._leaf_items[hit])
+
+    def query_point(self, lon, lat):
+        return self.query((lon, lat, lon, lat))
+
+
+# Function to read the footprints of all GeoTIFF tiles in a directory. The result is kept in
+# ndom_index.json, so only new or changed files are opened again.
+def scan_tiles(directory):
+    index_path = os.path.join(directory, index_file_name)
+    known = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            known = {tile['path']: tile for tile in json.load(f)}
+
+    tiles, changed = [], False
+    paths = sorted(glob.glob(os.path.join(directory, '**', '*.tif'), recursive=True) +
+                   glob.glob(os.path.join(directory, '**', '*.tiff'), recursive=True))
+    for path in paths:
+        relative_path = os.path.relpath(path, directory)
+        stat = os.stat(path)
+        tile = known.get(relative_path)
+        if tile is None or tile['mtime'] != stat.st_mtime or tile['size'] != stat.st_size:
+            with rasterio.open(path) as src:
+                tile = {'path': relative_path, 'mtime': stat.st_mtime, 'size': stat.st_size,
+                        'bounds': list(transform_bounds(src.crs, 'EPSG:4326', *src.bounds, densify_pts=21))}
+            changed = True
+        tiles.append(tile)
+
+    if changed or len(tiles) != len(known):
+        try:
+            with open(index_path, 'w') as f:
+                json.dump(tiles, f)
+        except OSError:
+            # A read-only tile directory is indexed again next time
+            pass
+    return tiles
+
+
+# Height maps from local nDOM tiles, on the same lon/lat pixel grid as wms_tile_cache.TiledHeightMapFetcher,
+# so it can be used in its place (see siting_engine.get_height_map_source).
+class LocalHeightMapSource:
+
+    def __init__(self, directory, resolution=(0.001 / 200, 0.001 / 150), max_open_files=64):
+        self.directory = directory
+        self.resolution = resolution
+        self.max_open_files = max_open_files
+        self.tiles = scan_tiles(directory)
+        if not self.tiles:
+            raise ValueError(f"No GeoTIFF tiles found in {directory}")
+        self.index = TileIndex([tile['bounds'] for tile in self.tiles])
+        self._datasets = OrderedDict()
+        # Datasets must not be read from several threads at the same time
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            for src in self._datasets.values():
+                src.close()
+            self._datasets.clear()
+
+    def _dataset(self, path):
+        src = self._datasets.get(path)
+        if src is not None:
+            self._datasets.move_to_end(path)
+            return src
+        src = self._datasets[path] = rasterio.open(os.path.join(self.directory, path))
+        if len(self._datasets) > self.max_open_files:
+            self._datasets.popitem(last=False)[1].close()
+        return src
+
+    # Function to get the paths of the tiles intersecting bbox (lon/lat)
+    def tiles_for_bbox(self, bbox):
+        return [self.tiles[i]['path'] for i in self.index.query(bbox)]
+
+    # Function to read the heights of one tile into a lon/lat grid (NaN where the tile has no data).
+    # Returns None if the tile does not reach into bbox (the lon/lat footprints are a bit larger than the tiles).
+    def _read_tile(self, path, bbox, dst_transform, shape):
+        with self._lock:
+            src = self._dataset(path)
+            # Only the window around the requested area is read, with a margin of one pixel
+            window = from_bounds(*transform_bounds('EPSG:4326', src.crs, *bbox, densify_pts=21), src.transform)
+            col_off, row_off = max(math.floor(window.col_off) - 1, 0), max(math.floor(window.row_off) - 1, 0)
+            col_end = min(math.ceil(window.col_off + window.width) + 1, src.width)
+            row_end = min(math.ceil(window.row_off + window.height) + 1, src.height)
+            if col_end <= col_off or row_end <= row_off:
+                return None
+            window = Window(col_off, row_off, col_end - col_off, row_end - row_off)
+            data = src.read(1, window=window, masked=True).astype(np.float32).filled(np.nan)
+            src_transform, src_crs = src.window_transform(window), src.crs
+
+        heights = np.full(shape, np.nan, dtype=np.float32)
+        reproject(data, heights, src_transform=src_transform, src_crs=src_crs, src_nodata=np.nan,
+                  dst_transform=dst_transform, dst_crs='EPSG:4326', dst_nodata=np.nan, resampling=Resampling.nearest)
+        return heights
+
+    # Function to get the height map around a location and its bounding box (lon/lat), like
+    # TiledHeightMapFetcher.height_map. The window is snapped to the pixel grid.
+    def height_map(self, lat, lon, bbox_size=0.001, cancel=None):
+        dx, dy = self.resolution
+        width = int(round(2 * bbox_size / dx))
+        height = int(round(2 * bbox_size / dy))
+        col0 = int(round(lon / dx - width / 2))
+        row0 = int(round(-lat / dy - height / 2))
+        bbox = (col0 * dx, -(row0 + height) * dy, (col0 + width) * dx, -row0 * dy)
+
+        with span('ndom_index_query'):
+            paths = self.tiles_for_bbox(bbox)
+        if not paths:
+            raise ValueError(f"No local nDOM tile covers the location ({lat:.5f}, {lon:.5f}).")
+
+        dst_transform = from_origin(bbox[0], bbox[3], dx, dy)
+        height_map = np.full((height, width), np.nan)
+        with span('ndom_read', tiles=len(paths)):
+            for path in paths:
+                heights = self._read_tile(path, bbox, dst_transform, (height, width))
+                if heights is not None:
+                    height_map = np.where(np.isnan(height_map), heights, height_map)
+        return height_map, bbox
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Index a directory of nDOM GeoTIFF tiles and time some queries.")
+    parser.add_argument('directory')
+    parser.add_argument('--lat', type=float, required=True)
+    parser.add_argument('--lon', type=float, required=True)
+    parser.add_argument('--queries', type=int, default=100)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    source = LocalHeightMapSource(args.directory)
+    print(f"Indexed {len(source.tiles)} tiles in {time.perf_counter() - start:.3f} s")
+
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    for lat, lon in zip(args.lat + rng.uniform(-0.002, 0.002, args.queries),
+                        args.lon + rng.uniform(-0.003, 0.003, args.queries)):
+        source.height_map(lat, lon)
+    print(f"{args.queries} height maps in {time.perf_counter() - start:.3f} s")
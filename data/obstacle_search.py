@@ -0,0 +1,77 @@
+import numpy as np
+from pyproj import Geod
+
+geod = Geod(ellps='WGS84')
+
+# Heights up to this value (meters) count as free space between the turbine and an obstacle
+clear_height = 1.5
+
+
+# Function to get the affine transform of a north-up height map covering bbox (lon/lat)
+def height_map_transform(bbox, shape):
+    from rasterio.transform import from_bounds
+    height, width = shape
+    return from_bounds(bbox[0], bbox[1], bbox[2], bbox[3], width, height)
+
+
+# Function to get the search directions (degrees) of a sector centred on a direction.
+# A sector width of 360 degrees or more sweeps all directions.
+def sector_directions(center, sector_width=20, direction_step=1):
+    if sector_width >= 360:
+        return np.arange(0, 360, direction_step, dtype=float)
+    start = int(center - sector_width / 2)
+    end = int(center + sector_width / 2)
+    return np.arange(start, end + direction_step / 2, direction_step, dtype=float)
+
+
+# Function to get the distances (meters) sampled along every ray
+def ray_distances(max_distance=100, distance_step=1):
+    return np.arange(distance_step, max_distance + distance_step / 2, distance_step, dtype=float)
+
+
+# Function to compute all sample points (directions x distances) with one geodesic call
+def polar_samples(lat, lon, directions, distances):
+    azimuths, dists = np.meshgrid(directions, distances, indexing='ij')
+    lons, lats, _ = geod.fwd(np.full(azimuths.size, lon), np.full(azimuths.size, lat),
+                             azimuths.ravel(), dists.ravel())
+    return np.reshape(lons, azimuths.shape), np.reshape(lats, azimuths.shape)
+
+
+# Function to read the height map at arbitrary coordinates, NaN outside of the map
+def sample_height_map(height_map, transform, lons, lats):
+    inverse = ~transform
+    cols = np.floor(inverse.a * lons + inverse.b * lats + inverse.c).astype(int)
+    rows = np.floor(inverse.d * lons + inverse.e * lats + inverse.f).astype(int)
+    height, width = height_map.shape
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    heights = np.full(lons.shape, np.nan)
+    heights[inside] = height_map[rows[inside], cols[inside]]
+    return heights
+
+
+# Function to find, for every ray, the first obstacle higher than h2 after the ray has left
+# the building the turbine stands on (first free sample). Returns the distances and heights
+# of the obstacles per ray, NaN where a ray has no obstacle. With an array of hub heights, the
+# results get a leading axis with one row per hub height (the rays are sampled only once).
+def nearest_obstacles(heights, distances, h2):
+    clear = np.isnan(heights) | ((heights >= 0) & (heights <= clear_height))
+    cleared = np.logical_or.accumulate(clear, axis=-1)
+    h2 = np.reshape(h2, np.shape(h2) + (1,) * heights.ndim)
+    with np.errstate(invalid='ignore'):
+        hit = cleared & (heights > h2)
+
+    has_hit = hit.any(axis=-1)
+    first = np.argmax(hit, axis=-1)
+    obstacle_distance = np.where(has_hit, distances[first], np.nan)
+    obstacle_height = np.where(has_hit, np.take_along_axis(np.broadcast_to(heights, hit.shape), first[..., None],
+                                                           axis=-1)[..., 0], np.nan)
+    return obstacle_distance, obstacle_height
+
+
+# Function to cast rays from a location over the height map and return, per direction,
+# the distance and height of the nearest obstacle higher than h2 (one row per hub height for an array)
+def cast_rays(height_map, bbox, lat, lon, directions, h2, max_distance=100, distance_step=1):
+    distances = ray_distances(max_distance, distance_step)
+    lons, lats = polar_samples(lat, lon, directions, distances)
+    heights = sample_height_map(height_map, height_map_transform(bbox, height_map.shape), lons, lats)
+    return nearest_obstacles(heights, distances, h2)
@@ -0,0 +1,109 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Tracer of the current calculation, None when timing is disabled
+_current_tracer = contextvars.ContextVar('pipeline_tracer', default=None)
+_disabled_span = nullcontext()
+
+
+# Collects the timings (spans) of the pipeline stages of one or more calculations
+class Tracer:
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        start = time.time()
+        start_counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_counter
+            record = {'name': name, 'start': start, 'duration': duration, 'pid': os.getpid(),
+                      'thread': threading.current_thread().name}
+            if attrs:
+                record['attrs'] = attrs
+            with self._lock:
+                self.spans.append(record)
+
+    def extend(self, spans):
+        with self._lock:
+            self.spans.extend(spans)
+
+    # Function to get the total time and number of calls per stage
+    def summary(self):
+        stages = {}
+        for record in self.spans:
+            stage = stages.setdefault(record['name'], {'stage': record['name'], 'calls': 0, 'total_ms': 0.0})
+            stage['calls'] += 1
+            stage['total_ms'] += record['duration'] * 1000
+        return sorted(stages.values(), key=lambda stage: -stage['total_ms'])
+
+    # Function to write the spans as JSON lines (an existing file is replaced)
+    def write_jsonl(self, path):
+        with open(path, 'w') as f:
+            for record in self.spans:
+                f.write(json.dumps(record) + '\n')
+
+    # Function to get the spans in the Chrome trace format (chrome://tracing, Perfetto).
+    # Thread ids must be numbers, so every thread gets a small number and a thread_name event.
+    def chrome_trace(self):
+        thread_ids = {}
+        events = []
+        for record in self.spans:
+            thread = (record['pid'], record['thread'])
+            if thread not in thread_ids:
+                thread_ids[thread] = len(thread_ids) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': record['pid'], 'tid': thread_ids[thread],
+                               'args': {'name': record['thread']}})
+            events.append({
+                'name': record['name'],
+                'ph': 'X',
+                'ts': record['start'] * 1e6,
+                'dur': record['duration'] * 1e6,
+                'pid': record['pid'],
+                'tid': thread_ids[thread],
+                'args': record.get('attrs', {}),
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    # Function to write the spans, as Chrome trace for .json files and JSON lines otherwise
+    def write(self, path):
+        if path.endswith('.json'):
+            self.write_chrome_trace(path)
+        else:
+            self.write_jsonl(path)
+
+
+# Function to time a pipeline stage: with span('obstacle_search'): ...
+# Does nothing when no tracer is active.
+def span(name, **attrs):
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return _disabled_span
+    return tracer.span(name, **attrs)
+
+
+# Function to make tracer the active tracer of the current thread (None disables timing)
+def activate(tracer):
+    return _current_tracer.set(tracer)
+
+
+# Function to use a tracer for a block of code: with tracing(Tracer()) as tracer: ...
+@contextmanager
+def tracing(tracer):
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
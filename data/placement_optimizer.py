@@ -0,0 +1,141 @@
+import math
+
+import numpy as np
+from pyproj import Geod
+
+from obstacle_search import clear_height, height_map_transform
+from siting_engine import (calculate_annual_energy_output, calculate_wind_power, calculate_wind_speed_reduction,
+                           drag_coefficient)
+
+geod = Geod(ellps='WGS84')
+
+
+# Function to get the size (meters) of one height map pixel in x and y
+def pixel_size_meters(bbox, shape):
+    height, width = shape
+    lat = (bbox[1] + bbox[3]) / 2
+    lon = (bbox[0] + bbox[2]) / 2
+    width_meters = geod.inv(bbox[0], lat, bbox[2], lat)[2]
+    height_meters = geod.inv(lon, bbox[1], lon, bbox[3])[2]
+    return width_meters / width, height_meters / height
+
+
+# Function to get the bbox_size (degrees) of a height map around (lat, lon) that covers the one of
+# bbox_size plus max_distance meters on every side. Searching such a map finds the obstacles of all
+# pixels of the smaller map, also near its upwind edge.
+def search_bbox_size(lat, lon, bbox_size=0.001, max_distance=100):
+    east = geod.fwd(lon, lat, 90, max_distance)[0]
+    north = geod.fwd(lon, lat, 0, max_distance)[1]
+    return bbox_size + max(east - lon, north - lat)
+
+
+# Function to find, for every pixel at once, the nearest obstacle higher than h2 in one direction.
+# The whole height map is shifted pixel by pixel along the direction (a shadow sweep), so the cost
+# grows with the search distance in pixels, not with the number of pixels.
+# Returns the distances (meters) and heights of the obstacles, NaN where there is none, and a mask
+# of the pixels whose search left the height map before finding an obstacle (result unknown).
+def upwind_obstacle_maps(height_map, bbox, direction, h2, max_distance=100):
+    height, width = height_map.shape
+    pixel_width, pixel_height = pixel_size_meters(bbox, height_map.shape)
+    step = min(pixel_width, pixel_height)
+    dx, dy = math.sin(math.radians(direction)), math.cos(math.radians(direction))
+
+    offsets = []
+    for distance in np.arange(step, max_distance + step / 2, step):
+        # Rows grow southwards, columns eastwards
+        offset = (int(round(-distance * dy / pixel_height)), int(round(distance * dx / pixel_width)))
+        if offset != (0, 0) and offset not in offsets:
+            offsets.append(offset)
+
+    obstacle_distance = np.full(height_map.shape, np.nan)
+    obstacle_height = np.full(height_map.shape, np.nan)
+    # A search distance shorter than one pixel finds no obstacles
+    if not offsets:
+        return obstacle_distance, obstacle_height, np.zeros(height_map.shape, dtype=bool)
+
+    pad = max(max(abs(r), abs(c)) for r, c in offsets)
+    with np.errstate(invalid='ignore'):
+        clear = np.isnan(height_map) | ((height_map >= 0) & (height_map <= clear_height))
+        tall = height_map > h2
+    clear = np.pad(clear, pad, constant_values=True)
+    tall = np.pad(tall, pad, constant_values=False)
+    inside = np.pad(np.ones(height_map.shape, dtype=bool), pad, constant_values=False)
+    padded_heights = np.pad(height_map, pad, constant_values=np.nan)
+
+    cleared = np.zeros(height_map.shape, dtype=bool)
+    unresolved = np.ones(height_map.shape, dtype=bool)
+
+    for row_offset, col_offset in offsets:
+        window = (slice(pad + row_offset, pad + row_offset + height), slice(pad + col_offset, pad + col_offset + width))
+        cleared |= clear[window]
+        hit = cleared & tall[window]
+        hit &= unresolved
+        if hit.any():
+            obstacle_distance[hit] = math.hypot(row_offset * pixel_height, col_offset * pixel_width)
+            obstacle_height[hit] = padded_heights[window][hit]
+            unresolved &= ~hit
+
+    # A search that ended outside of the height map may have missed an obstacle
+    unknown = unresolved & ~inside[window]
+    return obstacle_distance, obstacle_height, unknown
+
+
+# Function to score every pixel of the height map as turbine location. wind_speed is the wind
+# speed at height h2 without obstacles (a number or an array like the height map).
+# Returns a dict of arrays like the height map. Pixels inside buildings higher than h2 and pixels
+# too close to the upwind edge of the map to search the full distance get NaN.
+def score_locations(height_map, bbox, direction, wind_speed, h2, A, max_distance=100):
+    obstacle_distance, obstacle_height, unknown = upwind_obstacle_maps(height_map, bbox, direction, h2, max_distance)
+    wind_speed_reduction = np.where(np.isnan(obstacle_height), 0.0,
+                                    calculate_wind_speed_reduction(drag_coefficient, obstacle_height,
+                                                                   obstacle_distance))
+    final_wind_speed = np.maximum(wind_speed - wind_speed_reduction, 0)
+    with np.errstate(invalid='ignore'):
+        final_wind_speed = np.where((height_map > h2) | unknown, np.nan, final_wind_speed)
+
+    wind_power = calculate_wind_power(A, final_wind_speed)
+    return {
+        'obstacle_distance': obstacle_distance,
+        'obstacle_height': obstacle_height,
+        'wind_speed_reduction': wind_speed_reduction,
+        'final_wind_speed': final_wind_speed,
+        'wind_power': wind_power,
+        'annual_energy_output': calculate_annual_energy_output(wind_power),
+    }
+
+
+# Function to find the n best turbine locations in the height map, at least min_separation
+# meters apart. Returns a list of dicts with the location (lat, lon) and its scores.
+# With within (a bbox inside bbox), only the locations inside it are suggested.
+def best_locations(height_map, bbox, direction, wind_speed, h2, A, n=5, min_separation=10, max_distance=100,
+                   within=None):
+    scores = score_locations(height_map, bbox, direction, wind_speed, h2, A, max_distance)
+    power = scores['wind_power']
+    if within is not None:
+        height, width = height_map.shape
+        lons = bbox[0] + (np.arange(width) + 0.5) * (bbox[2] - bbox[0]) / width
+        lats = bbox[3] - (np.arange(height) + 0.5) * (bbox[3] - bbox[1]) / height
+        inside = ((lats >= within[1]) & (lats <= within[3]))[:, None] & ((lons >= within[0]) & (lons <= within[2]))
+        power = np.where(inside, power, np.nan)
+    pixel_width, pixel_height = pixel_size_meters(bbox, height_map.shape)
+    transform = height_map_transform(bbox, height_map.shape)
+
+    candidates = np.flatnonzero(~np.isnan(power))
+    candidates = candidates[np.argsort(-power.ravel()[candidates], kind='stable')]
+    rows, cols = np.divmod(candidates, height_map.shape[1])
+
+    chosen = []
+    for row, col in zip(rows, cols):
+        if len(chosen) == n:
+            break
+        if any(math.hypot((row - r) * pixel_height, (col - c) * pixel_width) < min_separation for r, c in chosen):
+            continue
+        chosen.append((row, col))
+
+    locations = []
+    for row, col in chosen:
+        lon, lat = transform * (col + 0.5, row + 0.5)
+        location = {'lat': float(lat), 'lon': float(lon)}
+        location.update({name: float(values[row, col]) for name, values in scores.items()})
+        locations.append(location)
+    return locations
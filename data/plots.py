@@ -0,0 +1,85 @@
+from functools import lru_cache
+from io import BytesIO
+
+import numpy as np
+
+# Colors of the CO2 bar plot
+co2_colors = ['#2d2d96', '#5858cc', '#7e7ed8', '#a4a4e3']
+
+
+# Function to get the transformer from lon/lat to Web Mercator, created once per process
+@lru_cache(maxsize=None)
+def get_web_mercator_transformer():
+    from pyproj import Transformer
+    return Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+
+
+# Function to create a figure that is not registered with pyplot, so it is freed as soon as it is
+# no longer used (pyplot keeps every figure until it is closed)
+def _figure(**subplot_kw):
+    from matplotlib.figure import Figure
+    fig = Figure()
+    return fig, fig.add_subplot(**subplot_kw)
+
+
+def _png(fig):
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+# Function to plot the annual CO2 savings compared to the fossil fuels, returns a PNG image
+def co2_plot(annual_co2_savings_coal, annual_co2_savings_gas, annual_co2_savings_oil):
+    fig, ax = _figure()
+    fossil_fuel_types = ['Coal', 'Natural Gas', 'Oil', 'Wind Turbine']
+    total_savings = [annual_co2_savings_coal, annual_co2_savings_gas, annual_co2_savings_oil, 0]
+    ax.bar(fossil_fuel_types, total_savings, color=co2_colors)
+    ax.set_xlabel('Fossil Fuel Type')
+    ax.set_ylabel('Total CO2  (kg)')
+    ax.set_title('Total CO2 for energy over a year')
+    return _png(fig)
+
+
+# Function to plot the height map around the chosen location (bbox in lon/lat), returns a PNG image
+def height_map_plot(height_map, bbox):
+    # Reproject the height map extent from EPSG:4326 to EPSG:3857
+    X, Y = get_web_mercator_transformer().transform([bbox[0], bbox[2]], [bbox[1], bbox[3]])
+
+    fig, ax = _figure()
+    im = ax.imshow(height_map, cmap='viridis', interpolation='none', extent=(X[0], X[1], Y[0], Y[1]))
+    fig.colorbar(im, ax=ax, label='Height (m)')
+
+    # Remove axis labels and ticks and hide the coordinate values displayed on the corners
+    ax.set_xticks([])
+    ax.set_yticks([])
+    ax.set_xlim(left=X[0], right=X[1])
+    ax.set_ylim(bottom=Y[0], top=Y[1])
+    ax.set_title('Height Map')
+    return _png(fig)
+
+
+# Function to plot the share of the hours from each direction sector, returns a PNG image
+def wind_rose_plot(sector_centers, frequencies, sector_width, title):
+    fig, ax = _figure(projection='polar')
+    ax.set_theta_zero_location('N')
+    ax.set_theta_direction(-1)
+    ax.bar(np.radians(sector_centers), np.asarray(frequencies) * 100, width=np.radians(sector_width),
+           color='#5858cc', edgecolor='white')
+    ax.set_title(title)
+    return _png(fig)
+
+
+# Function to plot the annual energy of a sweep over hub heights (rows) and rotor sizes (columns)
+# as a response surface with the best configuration marked, returns a PNG image
+def sweep_plot(h2_values, rotor_sizes, annual_energy_output, best_h2, best_rotor_size, rotor_size_label):
+    fig, ax = _figure()
+    mesh = ax.pcolormesh(rotor_sizes, h2_values, annual_energy_output, cmap='viridis', shading='nearest')
+    fig.colorbar(mesh, ax=ax, label='Annual energy (kWh)')
+    if len(h2_values) > 1 and len(rotor_sizes) > 1:
+        contours = ax.contour(rotor_sizes, h2_values, annual_energy_output, colors='white', linewidths=0.6)
+        ax.clabel(contours, fontsize=7, fmt='%.0f')
+    ax.plot(best_rotor_size, best_h2, marker='*', markersize=14, color='#ff5050', markeredgecolor='white')
+    ax.set_xlabel(rotor_size_label)
+    ax.set_ylabel('Hub height (m)')
+    ax.set_title('Annual energy of the turbine configurations')
+    return _png(fig)
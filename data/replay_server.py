@@ -0,0 +1,270 @@
+"""Record and replay the external services, so the pipeline can be benchmarked offline.
+
+Usage:
+    python data/replay_server.py --mode record --port 8090
+    python data/replay_server.py --mode replay --port 8090
+
+One local server stands in for the weather API (/weather), the nDOM WMS (/wms)
+and Nominatim (/nominatim/reverse). In record mode every request is forwarded to
+the real service and the response is stored in the recordings directory. In
+replay mode the stored responses are served again; requests that were never
+recorded are answered by synthetic stand-ins (synthetic mode uses only those).
+API keys are never part of a recording.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qsl, urlparse
+
+import numpy as np
+
+import service_io
+import siting_engine
+from stand_in_wms import capabilities_template, render_heights, synthetic_city
+
+default_recordings_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'recordings')
+
+# Real services behind the local paths
+upstream_urls = {
+    'weather': siting_engine.weather_url,
+    'wms': siting_engine.wms_url,
+    'nominatim': 'https://nominatim.openstreetmap.org',
+}
+
+modes = ['record', 'replay', 'synthetic']
+
+# Requests forwarded to the public Nominatim keep its limit of one per second. This is not the
+# limiter of the geocoding client, which use_server() turns off for the local server.
+upstream_geocoding_rate_limiter = service_io.RateLimiter(service_io.geocoding_interval)
+
+# Request parameters that are left out of the recordings
+_secret_params = {'key'}
+
+# Placeholder for the address of the local server in recorded capabilities documents
+_server_placeholder = '{replay_server}'
+
+
+# Stores the recorded responses as files, with an index from request to file
+class RecordingStore:
+
+    def __init__(self, directory=default_recordings_dir):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(directory, 'index.json')
+        self._index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+
+    # Function to get the key of a request, the parameter order and secret parameters don't matter
+    @staticmethod
+    def request_key(service, path, params):
+        params = sorted((name.lower(), value) for name, value in params.items() if name.lower() not in _secret_params)
+        return f"{service} {path} {json.dumps(params)}"
+
+    # Function to get a recorded response (body, content type), None if it was not recorded
+    def get(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+        if entry is None:
+            return None
+        with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+            return f.read(), entry['content_type']
+
+    def put(self, key, body, content_type):
+        name = hashlib.sha256(key.encode()).hexdigest()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(body)
+        with self._lock:
+            self._index[key] = {'file': name, 'content_type': content_type}
+            with open(self._index_path, 'w') as f:
+                json.dump(self._index, f, indent=1, sort_keys=True)
+
+    def __len__(self):
+        return len(self._index)
+
+
+# Function to get a number in [0, 1) that depends only on the text
+def _noise(text):
+    return zlib.crc32(text.encode()) / 2 ** 32
+
+
+# Function to answer a weather history request with deterministic synthetic values in the
+# Visual Crossing format. The wind mostly blows from the south-west, like in the Ruhr area.
+def synthetic_weather(params):
+    location = params.get('location', '')
+    start = date.fromisoformat(params['startDateTime'][:10])
+    end = date.fromisoformat(params['endDateTime'][:10])
+    aggregate_hours = int(params.get('aggregateHours', 24))
+
+    values = []
+    day = start
+    while day <= end:
+        for hour in range(0, 24, aggregate_hours):
+            stamp = f"{day.isoformat()}T{hour:02d}:00:00"
+            values.append({
+                'datetimeStr': stamp + '+00:00',
+                'wdir': round((225 + 120 * (_noise(location + stamp) - 0.5)) % 360, 1),
+                'wspd': round(5 + 25 * _noise(stamp + location), 1),
+                'temp': round(10 + 10 * _noise(stamp), 1),
+            })
+        day += timedelta(days=1)
+    return {'locations': {location: {'id': location, 'address': location, 'values': values}}}
+
+
+# Function to answer a Nominatim reverse request with a synthetic place
+def synthetic_place(params):
+    lat, lon = float(params['lat']), float(params['lon'])
+    street = 1 + int(_noise(f"{lat:.4f},{lon:.4f}") * 200)
+    return {
+        'place_id': street,
+        'lat': f"{lat:.7f}",
+        'lon': f"{lon:.7f}",
+        'display_name': f"{street} Synthetic Street, {lat:.4f}, {lon:.4f}, Nordrhein-Westfalen, Deutschland",
+        'address': {'road': f"{street} Synthetic Street", 'state': 'Nordrhein-Westfalen', 'country': 'Deutschland'},
+    }
+
+
+# Function to answer a WMS request with the synthetic city of stand_in_wms
+def synthetic_wms(params, server_url):
+    request = params.get('request', '').lower()
+    if request == 'getcapabilities':
+        body = capabilities_template.format(url=f"{server_url}/wms", layer=siting_engine.building_height_layer)
+        return body.encode(), 'application/vnd.ogc.wms_xml'
+    if request == 'getmap':
+        west, south, east, north = map(float, params['bbox'].split(','))
+        width, height = int(params['width']), int(params['height'])
+        lons = west + (np.arange(width) + 0.5) * (east - west) / width
+        lats = north - (np.arange(height) + 0.5) * (north - south) / height
+        buffer = BytesIO()
+        render_heights(synthetic_city(*np.meshgrid(lons, lats))).save(buffer, format='PNG')
+        return buffer.getvalue(), 'image/png'
+    raise ValueError(f"Unsupported WMS request: {request}")
+
+
+# Function to point the links of a recorded capabilities document to the placeholder
+def _strip_upstream(body, upstream_url):
+    origin = '{0.scheme}://{0.netloc}'.format(urlparse(upstream_url))
+    return re.sub(rb'xlink:href="' + re.escape(origin.encode()) + rb'[^"?]*\??"',
+                  b'xlink:href="' + _server_placeholder.encode() + b'/wms?"', body)
+
+
+def _new_stats():
+    return {'recorded': 0, 'replayed': 0, 'synthetic': 0, 'lock': threading.Lock()}
+
+
+def make_handler(mode, store, stats):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = dict(parse_qsl(url.query, keep_blank_values=True))
+            service = url.path.strip('/').split('/')[0]
+            if service not in upstream_urls:
+                self.send_error(404, "Unknown service")
+                return
+
+            server_url = f"http://{self.headers['Host']}"
+            key = store.request_key(service, url.path, params)
+            try:
+                if mode == 'record':
+                    body, content_type = self._record(service, url.path, params, key)
+                    source = 'recorded'
+                else:
+                    recorded = store.get(key) if mode == 'replay' else None
+                    if recorded is not None:
+                        body, content_type = recorded
+                        source = 'replayed'
+                    else:
+                        body, content_type = self._synthetic(service, params, server_url)
+                        source = 'synthetic'
+            except service_io.ServiceError as e:
+                # Upstream errors are passed on, a failed connection is a bad gateway
+                self.send_error(e.status_code or 502, str(e))
+                return
+            except (KeyError, ValueError) as e:
+                self.send_error(400, str(e))
+                return
+
+            with stats['lock']:
+                stats[source] += 1
+            if 'xml' in content_type:
+                body = body.replace(_server_placeholder.encode(), server_url.encode())
+            self._send(body, content_type)
+
+        def _record(self, service, path, params, key):
+            upstream = upstream_urls[service] + path[len(service) + 1:]
+            if service == 'nominatim':
+                # Nominatim's usage policy asks for an identifying user agent and one request per second
+                service_io.get_session('geocoding').headers['User-Agent'] = service_io.user_agent
+                upstream_geocoding_rate_limiter.wait()
+            response = service_io.get('geocoding' if service == 'nominatim' else service, upstream, params)
+            body, content_type = response.content, response.headers.get('Content-Type', 'application/octet-stream')
+            if service == 'wms' and 'xml' in content_type:
+                body = _strip_upstream(body, upstream_urls['wms'])
+            store.put(key, body, content_type)
+            return body, content_type
+
+        def _synthetic(self, service, params, server_url):
+            if service == 'weather':
+                return json.dumps(synthetic_weather(params)).encode(), 'application/json'
+            if service == 'nominatim':
+                return json.dumps(synthetic_place(params)).encode(), 'application/json'
+            return synthetic_wms(params, server_url)
+
+        def _send(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# Function to start the server in a background thread. Returns the server and its URL.
+# server.stats counts the recorded, replayed and synthetic responses.
+def serve(mode='replay', recordings_dir=default_recordings_dir, port=0):
+    if mode not in modes:
+        raise ValueError(f"Unknown mode: {mode}")
+    stats = _new_stats()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(mode, RecordingStore(recordings_dir), stats))
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# Function to send the weather, geocoding and WMS requests of this process to the server at url.
+# Returns the WMS URL, to be passed to a wms_tile_cache.TiledHeightMapFetcher.
+def use_server(url):
+    siting_engine.weather_url = f"{url}/weather"
+    siting_engine.wms_url = f"{url}/wms"
+    parsed = urlparse(url)
+    # The local server doesn't need Nominatim's rate limit, it limits the requests it forwards itself
+    service_io.configure_geocoder(f"{parsed.netloc}/nominatim", parsed.scheme, min_interval=0)
+    return siting_engine.wms_url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record or replay the external services.")
+    parser.add_argument('--mode', choices=modes, default='replay')
+    parser.add_argument('--recordings', default=default_recordings_dir, help="Directory of the recorded responses")
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port),
+                                 make_handler(args.mode, RecordingStore(args.recordings), _new_stats()))
+    print(f"Services ({args.mode}) at http://127.0.0.1:{args.port}/weather, /wms and /nominatim/reverse")
+    server.serve_forever()
@@ -0,0 +1,259 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import siting_engine
+from location_cache import geohash, geohash_bounds
+
+default_store_dir = os.environ.get('RESULTS_STORE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'wind_turbine_tool', 'results'))
+
+# Geohash precision of the partitions (4 is about 40 x 20 km)
+partition_precision = 4
+
+# Results depend on the weather, so they are calculated again after this many seconds: a day for
+# the average wind direction of the last 30 days, a week for a wind rose of several years
+average_direction_max_age = 24 * 3600
+wind_rose_max_age = 7 * 24 * 3600
+
+input_columns = ['lat', 'lon', 'h2', 'turbine_type', 'A', 'years', 'wind_rose_years', 'sectors']
+
+result_schema = pa.schema([
+    ('input_key', pa.string()),
+    ('created', pa.float64()),
+    ('geohash', pa.string()),
+    ('lat', pa.float64()),
+    ('lon', pa.float64()),
+    ('h2', pa.float64()),
+    ('turbine_type', pa.string()),
+    ('A', pa.float64()),
+    ('years', pa.float64()),
+    ('wind_rose_years', pa.int64()),
+    ('sectors', pa.int64()),
+    ('original_wind_speed', pa.float64()),
+    ('average_wind_direction', pa.float64()),
+    ('obstacle_distance', pa.float64()),
+    ('obstacle_height', pa.float64()),
+    ('wind_speed_reduction', pa.float64()),
+    ('final_wind_speed', pa.float64()),
+    ('wind_power', pa.float64()),
+    ('annual_energy_output', pa.float64()),
+] + [
+    (f'{kind}_co2_savings_{fuel}', pa.float64())
+    for fuel in siting_engine.emission_factors for kind in ('annual', 'total')
+])
+
+
+# Function to get the key of the inputs of a calculation, equal inputs give equal keys
+def input_key(lat, lon, h2, turbine_type, A, years, wind_rose_years=None, sectors=12):
+    inputs = [round(float(lat), 6), round(float(lon), 6), round(float(h2), 3),
+              siting_engine.turbine_types.get(turbine_type, turbine_type), round(float(A), 4), float(years),
+              int(wind_rose_years or 0), int(sectors) if wind_rose_years else 0]
+    return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()[:32]
+
+
+# The stored rows of one geohash partition, in the chunks they were added in. The columns
+# needed by the viewport queries are joined into arrays on the first query after a change.
+class _Partition:
+
+    def __init__(self, cell):
+        self.cell = cell
+        self.bounds = geohash_bounds(cell)
+        self.chunks = []
+        self.num_rows = 0
+        self._table = None
+        self._arrays = None
+
+    def add(self, table):
+        self.chunks.append(table)
+        self.num_rows += table.num_rows
+        self._table = self._arrays = None
+        return len(self.chunks) - 1
+
+    def table(self):
+        if self._table is None:
+            self._table = pa.concat_tables(self.chunks)
+        return self._table
+
+    def arrays(self):
+        if self._arrays is None:
+            table = self.table()
+            self._arrays = tuple(table.column(name).to_numpy() for name in ('lat', 'lon', 'created'))
+        return self._arrays
+
+    def overlaps(self, south, west, north, east):
+        cell_south, cell_west, cell_north, cell_east = self.bounds
+        return cell_south <= north and cell_north >= south and cell_west <= east and cell_east >= west
+
+
+# Append-only store of calculation results in Parquet files, partitioned by geohash cell
+# (cell=u1jm/part-....parquet). Files are never changed, so several processes can append at the
+# same time; refresh() picks up the files written by others. Appended results are buffered and
+# written with one file per cell when flush_rows results are waiting, when flush_interval seconds
+# have passed since the last write, or on flush() (also called at exit). The store is indexed in
+# memory by input key and by partition, so a map viewport only looks at the partitions it overlaps.
+class ResultsStore:
+
+    def __init__(self, store_dir=default_store_dir, flush_rows=500, flush_interval=30, row_group_size=10000):
+        self.store_dir = store_dir
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.row_group_size = row_group_size
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._files = set()
+        self._partitions = {}
+        # Input key -> (partition, chunk, row) of the latest result of these inputs
+        self._keys = {}
+        self._pending = {}
+        self._pending_rows = 0
+        self._last_flush = time.time()
+        self.refresh()
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return sum(partition.num_rows for partition in self._partitions.values())
+
+    # Function to load the partition files written since the last refresh (by other processes)
+    def refresh(self):
+        with self._lock:
+            for cell_dir in sorted(os.listdir(self.store_dir)):
+                if not cell_dir.startswith('cell='):
+                    continue
+                for name in sorted(os.listdir(os.path.join(self.store_dir, cell_dir))):
+                    path = os.path.join(cell_dir, name)
+                    if name.endswith('.parquet') and path not in self._files:
+                        self._add(cell_dir[len('cell='):],
+                                  pq.read_table(os.path.join(self.store_dir, path), schema=result_schema))
+                        self._files.add(path)
+            self._flush_if_due()
+
+    def _add(self, cell, table):
+        partition = self._partitions.get(cell)
+        if partition is None:
+            partition = self._partitions[cell] = _Partition(cell)
+        chunk = partition.add(table)
+        # Later results of the same inputs replace earlier ones
+        for row, key in enumerate(table.column('input_key').to_pylist()):
+            self._keys[key] = (partition, chunk, row)
+
+    # Function to store results (dicts with the input and result columns). They can be looked up
+    # and queried at once, and are written to disk with the next flush.
+    def append(self, results):
+        now = time.time()
+        rows = []
+        for result in results:
+            row = {name: result.get(name) for name in result_schema.names}
+            row['input_key'] = input_key(*(result.get(name) for name in input_columns))
+            row['created'] = result.get('created', now)
+            row['geohash'] = geohash(result['lat'], result['lon'], 9)
+            row['wind_rose_years'] = int(result.get('wind_rose_years') or 0)
+            row['sectors'] = int(result.get('sectors') or 0)
+            rows.append(row)
+
+        table = pa.Table.from_pylist(rows, schema=result_schema)
+        cells = np.array([row['geohash'][:partition_precision] for row in rows])
+        with self._lock:
+            for cell in np.unique(cells):
+                cell_table = table.filter(pa.array(cells == cell))
+                self._add(str(cell), cell_table)
+                self._pending.setdefault(str(cell), []).append(cell_table)
+            self._pending_rows += len(rows)
+            self._flush_if_due()
+
+    def _flush_if_due(self):
+        if self._pending_rows >= self.flush_rows or (
+                self._pending_rows and time.time() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    # Function to write the buffered results, one file per geohash cell
+    def flush(self):
+        with self._lock:
+            now = time.time()
+            for cell, tables in self._pending.items():
+                path = os.path.join(f"cell={cell}", f"part-{int(now * 1000)}-{uuid.uuid4().hex[:8]}.parquet")
+                os.makedirs(os.path.join(self.store_dir, os.path.dirname(path)), exist_ok=True)
+                # Write to a temporary name first so readers never see half a file
+                tmp_path = os.path.join(self.store_dir, path + '.tmp')
+                pq.write_table(pa.concat_tables(tables), tmp_path, row_group_size=self.row_group_size)
+                os.replace(tmp_path, os.path.join(self.store_dir, path))
+                self._files.add(path)
+            self._pending = {}
+            self._pending_rows = 0
+            self._last_flush = now
+
+    # Function to get the stored result of the inputs, None if there is none (or older than max_age seconds)
+    def lookup(self, key, max_age=None):
+        with self._lock:
+            location = self._keys.get(key)
+            if location is None:
+                return None
+            partition, chunk, row = location
+            result = partition.chunks[chunk].slice(row, 1).to_pylist()[0]
+        if max_age is not None and time.time() - result['created'] > max_age:
+            return None
+        return result
+
+    # Function to get the stored results in a bounding box (south, west, north, east), the newest
+    # first and at most limit of them. Returns a pyarrow table.
+    def query_bbox(self, south, west, north, east, limit=5000, columns=None):
+        with self._lock:
+            partitions = [partition for partition in self._partitions.values()
+                          if partition.overlaps(south, west, north, east)]
+            matches = []
+            for number, partition in enumerate(partitions):
+                lats, lons, created = partition.arrays()
+                rows = np.flatnonzero((lats >= south) & (lats <= north) & (lons >= west) & (lons <= east))
+                matches.append((np.full(len(rows), number), rows, created[rows]))
+            tables = [partition.table() for partition in partitions]
+
+        if not matches:
+            table = result_schema.empty_table()
+            return table.select(columns) if columns else table
+        numbers, rows, created = (np.concatenate(values) for values in zip(*matches))
+        # The newest first; results of the same time keep the order they were added in
+        order = np.lexsort((rows, -created))[:limit]
+        numbers, rows = numbers[order], rows[order]
+        taken = pa.concat_tables([tables[number].take(pa.array(rows[numbers == number]))
+                                  for number in np.unique(numbers)])
+        # Back to the newest first order over all partitions
+        grouped = np.argsort(numbers, kind='stable')
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[grouped] = np.arange(len(order))
+        table = taken.take(pa.array(positions))
+        return table.select(columns) if columns else table
+
+
+# Function to get how long (seconds) a stored result of the inputs stays valid
+def result_max_age(wind_rose_years=None):
+    return wind_rose_max_age if wind_rose_years else average_direction_max_age
+
+
+# Function to calculate a site, or answer from the store when the same inputs were calculated
+# before (less than max_age seconds ago). New results are appended to the store.
+# A stored result has no wind rose; its height map comes from the tile cache.
+def evaluate_site_stored(store, sampler, lat, lon, h2, A, years, turbine_type, wind_rose_years=None, sectors=12,
+                         max_age=None, **options):
+    key = input_key(lat, lon, h2, turbine_type, A, years, wind_rose_years, sectors)
+    stored = store.lookup(key, max_age)
+    if stored is not None:
+        height_map_source = options.get('height_maps') or siting_engine.get_height_map_source()
+        stored['height_map'], stored['bbox'] = height_map_source.height_map(lat, lon)
+        stored['wind_rose'] = None
+        stored['from_store'] = True
+        return stored
+
+    result = siting_engine.evaluate_site(sampler, lat, lon, h2, A, years, wind_rose_years=wind_rose_years,
+                                         sectors=sectors, **options)
+    store.append([{**result, 'turbine_type': siting_engine.turbine_types.get(turbine_type, turbine_type),
+                   'wind_rose_years': wind_rose_years, 'sectors': sectors}])
+    result['from_store'] = False
+    return result
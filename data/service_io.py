@@ -0,0 +1,231 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import backoff
+import requests
+from requests.adapters import HTTPAdapter
+from geopy.exc import GeocoderServiceError, GeocoderTimedOut, GeopyError
+from geopy.geocoders import Nominatim
+
+from location_cache import get_location_cache
+from pipeline_trace import span
+
+# Timeout in seconds of a single request to each service
+service_timeouts = {
+    'weather': 30,
+    'wms': 20,
+    'geocoding': 10,
+}
+
+# Number of attempts per request, with exponential backoff between them
+max_tries = 3
+
+# Status codes that are worth another attempt
+retry_status_codes = {429, 500, 502, 503, 504}
+
+user_agent = "my_python_geocoder_app"
+nominatim_domain = 'nominatim.openstreetmap.org'
+nominatim_scheme = 'https'
+
+# Nominatim's usage policy allows at most one request per second
+geocoding_interval = 1.0
+
+
+# Error of a request to a service that failed after all attempts (timeout, no connection or an
+# error status, status_code is None without a response). It is a ValueError like the other errors
+# of the calculation, so the web app shows it as a message.
+class ServiceError(ValueError):
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Cancelled(ServiceError):
+    pass
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+# Function to get the keep-alive session of a service, shared by all threads
+def get_session(service):
+    with _sessions_lock:
+        session = _sessions.get(service)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[service] = session
+        return session
+
+
+def _giveup(e, cancel):
+    if cancel is not None and cancel.is_set():
+        return True
+    response = getattr(e, 'response', None)
+    return response is not None and response.status_code not in retry_status_codes
+
+
+# Function to send a GET request to a service with its timeout, retrying failed attempts.
+# cancel is an optional threading.Event that stops further attempts once it is set.
+# Raises ServiceError when all attempts failed and Cancelled when the request was cancelled.
+def get(service, url, params=None, cancel=None):
+
+    @backoff.on_exception(backoff.expo, requests.RequestException, max_tries=max_tries,
+                          giveup=lambda e: _giveup(e, cancel))
+    def attempt():
+        if cancel is not None and cancel.is_set():
+            raise Cancelled(f"Request to {service} was cancelled")
+        response = get_session(service).get(url, params=params, timeout=service_timeouts[service])
+        response.raise_for_status()
+        return response
+
+    try:
+        return attempt()
+    except requests.HTTPError as e:
+        raise ServiceError(f"Error fetching data from {service}: {e.response.status_code}",
+                           e.response.status_code) from e
+    except requests.Timeout as e:
+        raise ServiceError(f"The {service} service did not answer within {service_timeouts[service]} seconds") from e
+    except requests.RequestException as e:
+        raise ServiceError(f"Unable to reach the {service} service: {e}") from e
+
+
+# Two pools: one for the pipeline stages and one for the single requests they send,
+# so a stage waiting for its requests can never block the pool they run on.
+pool_sizes = {'io-stage': 8, 'io-request': 16}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Function to get a thread pool, created on first use
+def _pool(name):
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ThreadPoolExecutor(max_workers=pool_sizes[name], thread_name_prefix=name)
+        return pool
+
+
+# A forked process (e.g. a worker of a process pool) inherits the pools and sessions but not their
+# threads and connections, so it starts with new ones
+def _reset_after_fork():
+    global _sessions_lock, _pools_lock, _geolocator_lock, _geolocator
+    _sessions.clear()
+    _geolocator = None
+    _pools.clear()
+    _sessions_lock, _pools_lock, _geolocator_lock = threading.Lock(), threading.Lock(), threading.Lock()
+    geocoding_rate_limiter._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Function to run a single request function in the background. The function runs in a copy of the
+# caller's context, so it is timed by the caller's tracer.
+def submit(fn, *args, **kwargs):
+    return _pool('io-request').submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# Function to run several I/O stages at the same time. tasks maps a name to a function that
+# takes a cancel event. When one stage fails or the timeout expires, the others are cancelled
+# and the error is raised. Returns a dict with the result of every stage.
+def run_concurrently(tasks, timeout=None):
+    cancel = threading.Event()
+    futures = {name: _pool('io-stage').submit(contextvars.copy_context().run, fn, cancel) for name, fn in tasks.items()}
+    done, not_done = wait(futures.values(), timeout=timeout, return_when=FIRST_EXCEPTION)
+
+    failed = [future for future in done if future.exception() is not None]
+    if failed or not_done:
+        cancel.set()
+        for future in not_done:
+            future.cancel()
+        if failed:
+            raise failed[0].exception()
+        raise TimeoutError(f"I/O stages did not finish within {timeout} seconds")
+
+    return {name: future.result() for name, future in futures.items()}
+
+
+# Spaces out calls so that they are at least min_interval seconds apart, across all threads
+class RateLimiter:
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._next_call = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = self._next_call - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_call = time.monotonic() + self.min_interval
+
+
+geocoding_rate_limiter = RateLimiter(geocoding_interval)
+
+_geolocator = None
+_geolocator_lock = threading.Lock()
+
+
+# Function to get the shared Nominatim geocoder
+def get_geolocator():
+    global _geolocator
+    with _geolocator_lock:
+        if _geolocator is None:
+            _geolocator = Nominatim(user_agent=user_agent, timeout=service_timeouts['geocoding'],
+                                    domain=nominatim_domain, scheme=nominatim_scheme)
+        return _geolocator
+
+
+# Function to point the geocoder to another Nominatim server, e.g. a local stand-in
+def configure_geocoder(domain, scheme='https', min_interval=geocoding_interval):
+    global _geolocator, nominatim_domain, nominatim_scheme
+    with _geolocator_lock:
+        nominatim_domain, nominatim_scheme = domain, scheme
+        _geolocator = None
+    geocoding_rate_limiter.min_interval = min_interval
+
+
+# Function to get coordinates from a place name using Nominatim
+def get_coordinates_from_place(place_name):
+    geocoding_rate_limiter.wait()
+    try:
+        location = get_geolocator().geocode(place_name, timeout=30)
+    except GeopyError as e:
+        raise ValueError(f"Geocoding failed for place: {place_name} ({e})") from e
+
+    if location:
+        return location.latitude, location.longitude
+    else:
+        raise ValueError(f"Could not find coordinates for place: {place_name}")
+
+
+@backoff.on_exception(backoff.expo, GeocoderServiceError, max_tries=max_tries,
+                      giveup=lambda e: isinstance(e, GeocoderTimedOut))
+def _reverse(lat, lon):
+    geocoding_rate_limiter.wait()
+    location = get_geolocator().reverse((lat, lon))
+    if location is None:
+        raise ValueError(f"No place name found for ({lat:.5f}, {lon:.5f})")
+    return location.address
+
+
+# Function to retrieve place name from coordinates, nearby locations share the cached name.
+# Errors of the geocoding service (e.g. rate limited or unavailable) are raised as ValueError.
+def reverse_geocode(lat, lon):
+    try:
+        with span('reverse_geocode'):
+            return get_location_cache().reverse_geocode(lat, lon, _reverse)
+    except GeocoderTimedOut:
+        return "Timeout: Unable to get the place name"
+    except GeopyError as e:
+        raise ValueError(f"Unable to get the place name: {e}") from e
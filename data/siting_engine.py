@@ -0,0 +1,437 @@
+import math
+import os
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+import service_io
+from energy_engine import annual_energy_at_mean_speed, capacity_factors, hours_per_year
+from pipeline_trace import span
+from location_cache import get_location_cache
+from obstacle_search import cast_rays, sector_directions
+from wind_rose import WindRose, month_chunks, whole_month_window, wind_rose_from_weather
+from wms_tile_cache import TiledHeightMapFetcher
+
+# Path to the wind speed geotiff file
+geotiff_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'en_100m_klas.tif')
+
+# Visual Crossing weather API
+weather_url = 'https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/weatherdata/history'
+weather_api_key = os.environ.get('VISUAL_CROSSING_API_KEY', 'RZVMEQKLB4H52H7TGUUZ6GGDK')
+
+# WMS service and layer with the building height information
+wms_url = 'https://www.wms.nrw.de/geobasis/wms_nw_ndom'
+building_height_layer = 'nw_ndom'
+
+# Directory of local nDOM GeoTIFF tiles, used instead of the WMS when set
+ndom_dir = os.environ.get('NDOM_DIR')
+
+# Drag coefficient of the buildings
+drag_coefficient = 0.8
+
+# Emission factors for different fossil fuels in kg CO2 per kWh
+emission_factors = {
+    'coal': 0.87,
+    'natural_gas': 0.49,
+    'oil': 0.6
+}
+
+turbine_types = {
+    'HAWT': "Horizontal-Axis Wind Turbine (HAWT)",
+    'VAWT': "Vertical-Axis Wind Turbine (VAWT)",
+}
+
+
+# Function to fetch historical weather data, daily values unless aggregate_hours is given
+def fetch_historical_weather(api_key, location, start_date, end_date, cancel=None, aggregate_hours=24):
+    params = {
+        'aggregateHours': str(aggregate_hours),
+        'startDateTime': start_date,
+        'endDateTime': end_date,
+        'unitGroup': 'metric',
+        'contentType': 'json',
+        'dayStartTime': '0:0:00',
+        'dayEndTime': '0:0:00',
+        'location': location,
+        'key': api_key,
+    }
+    with span('weather_request', start=start_date, end=end_date):
+        return service_io.get('weather', weather_url, params, cancel).json()
+
+
+# Function to calculate the average wind direction
+def calculate_average_wind_direction(data):
+    if 'locations' in data and data['locations']:
+        location_data = data['locations'][list(data['locations'].keys())[0]]
+        if 'values' in location_data and location_data['values']:
+            values = location_data['values']
+
+            wind_directions = [entry['wdir'] for entry in values]
+
+            import pandas as pd
+
+            wind_directions = pd.Series(pd.to_numeric(wind_directions, errors='coerce'))
+
+            angles = wind_directions.dropna() * (2 * np.pi / 360)
+            sin_sum = np.sin(angles).sum()
+            cos_sum = np.cos(angles).sum()
+            average_direction = np.arctan2(sin_sum, cos_sum) * (360 / (2 * np.pi))
+
+            if average_direction < 0:
+                average_direction += 360
+
+            return average_direction
+        else:
+            raise ValueError("No 'values' found in the API response. Check the data structure.")
+    else:
+        raise ValueError("No 'locations' found in the API response. Check the data structure.")
+
+
+# Function to fetch the last 30 days of weather and average the wind direction
+# The window ends today unless end_date (YYYY-MM-DD) is given.
+def fetch_average_wind_direction(lat, lon, api_key=None, days=30, cancel=None, end_date=None):
+    end = date.fromisoformat(end_date) if end_date else date.today()
+    end_date = end.strftime('%Y-%m-%d')
+    start_date = (end - timedelta(days=days)).strftime('%Y-%m-%d')
+    # Days already downloaded for this area are served from the location cache
+    with span('weather'):
+        weather_data = get_location_cache().weather(
+            lat, lon, start_date, end_date,
+            lambda location, start, end: fetch_historical_weather(api_key or weather_api_key, location, start, end,
+                                                                  cancel))
+    with span('wind_direction'):
+        return calculate_average_wind_direction(weather_data)
+
+
+# Function to get the shared source of building heights: the local nDOM tiles in ndom_dir if set,
+# the WMS otherwise
+def get_height_map_source(directory=None, url=None):
+    directory = directory or ndom_dir
+    if directory:
+        return _local_height_map_source(os.path.abspath(directory))
+    return get_height_map_fetcher(url)
+
+
+@lru_cache(maxsize=None)
+def _local_height_map_source(directory):
+    from ndom_tiles import LocalHeightMapSource
+    return LocalHeightMapSource(directory)
+
+
+# Function to build the wind rose of the hourly weather of the last years, month by month.
+# Months already aggregated for this area come from the location cache, so a longer or later
+# window only downloads the new months. The window is made of whole calendar months and ends with
+# the last complete month before today (or end_date).
+def fetch_wind_rose(lat, lon, years=3, sectors=12, api_key=None, cancel=None, end_date=None):
+    start, end = whole_month_window(end_date or date.today().isoformat(), years)
+    cache = get_location_cache()
+
+    def month_rose(first_day, last_day):
+        def compute(location):
+            data = fetch_historical_weather(api_key or weather_api_key, location, first_day, last_day, cancel,
+                                            aggregate_hours=1)
+            return wind_rose_from_weather(data, sectors).to_dict()
+        return cache.aggregate(lat, lon, f"wind_rose|{sectors}|{first_day}|{last_day}", last_day, compute)
+
+    rose = WindRose(sectors)
+    with span('wind_rose', years=years, sectors=sectors):
+        futures = [service_io.submit(month_rose, first_day, last_day)
+                   for first_day, last_day in month_chunks(start, end)]
+        # Only the statistics of every month are kept, never the hourly values
+        for future in futures:
+            rose.merge(WindRose.from_dict(future.result()))
+    return rose
+
+
+# Function to get the shared height map fetcher, which caches the WMS tiles on disk (wms_url if url is None)
+def get_height_map_fetcher(url=None):
+    return _height_map_fetcher(url or wms_url)
+
+
+@lru_cache(maxsize=None)
+def _height_map_fetcher(url):
+    return TiledHeightMapFetcher(url, building_height_layer)
+
+
+# A forked process opens its own tile cache database and rasters instead of using the parent's
+def _reset_after_fork():
+    _height_map_fetcher.cache_clear()
+    _local_height_map_source.cache_clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Function to find the nearest building higher than h2 upwind of a location, for one hub height
+# or an array of them. Returns the distances and heights (meters), NaN where there is no such building.
+def upwind_obstacles(height_map, bbox, lat, lon, average_wind_direction, h2, max_distance=100,
+                     sector_width=20, direction_step=1, distance_step=1):
+    directions = sector_directions(average_wind_direction, sector_width, direction_step)
+    distances, heights = cast_rays(height_map, bbox, lat, lon, directions, h2, max_distance, distance_step)
+    nearest = np.argmin(np.nan_to_num(distances, nan=np.inf), axis=-1)[..., None]
+    return (np.take_along_axis(distances, nearest, axis=-1)[..., 0],
+            np.take_along_axis(heights, nearest, axis=-1)[..., 0])
+
+
+# Function to find the nearest building higher than h2 upwind of a location.
+# Returns (distance in meters, height in meters) or None if there is no such building.
+def find_upwind_obstacle(height_map, bbox, lat, lon, average_wind_direction, h2, max_distance=100,
+                         sector_width=20, direction_step=1, distance_step=1):
+    obstacle_distance, obstacle_height = upwind_obstacles(height_map, bbox, lat, lon, average_wind_direction, h2,
+                                                          max_distance, sector_width, direction_step, distance_step)
+    if np.isnan(obstacle_distance):
+        return None
+    return float(obstacle_distance), float(obstacle_height)
+
+
+# Function to weight the wind speed reduction by the nearest building higher than h2 over all
+# sectors of a wind rose, with the share of hours from each sector. Rays are cast in all directions
+# and every sector uses the nearest obstacle of its directions.
+# Returns the weighted reduction and, per sector, the distance and height of the obstacle (NaN if none).
+# With an array of hub heights, every result gets a leading axis with one row per hub height.
+def sector_wind_speed_reduction(height_map, bbox, lat, lon, wind_rose, h2, max_distance=100, direction_step=1,
+                                distance_step=1):
+    directions = sector_directions(0, 360, direction_step)
+    distances, heights = cast_rays(height_map, bbox, lat, lon, directions, h2, max_distance, distance_step)
+
+    # Sort the rays by sector and distance, the first ray of every sector has the nearest obstacle
+    sectors = wind_rose.sector_of(directions)
+    order = np.lexsort((np.nan_to_num(distances, nan=np.inf), np.broadcast_to(sectors, distances.shape)), axis=-1)
+    found, first = np.unique(np.sort(sectors), return_index=True)
+    sector_distance = np.full(distances.shape[:-1] + (wind_rose.sectors,), np.nan)
+    sector_height = np.full(distances.shape[:-1] + (wind_rose.sectors,), np.nan)
+    sector_distance[..., found] = np.take_along_axis(distances, order, axis=-1)[..., first]
+    sector_height[..., found] = np.take_along_axis(heights, order, axis=-1)[..., first]
+
+    reductions = obstacle_wind_speed_reduction(sector_distance, sector_height)
+    return np.sum(wind_rose.frequencies * reductions, axis=-1), sector_distance, sector_height
+
+
+# Function to get the wind speed reduction by obstacles (NaN distance means no obstacle, no reduction)
+def obstacle_wind_speed_reduction(obstacle_distance, obstacle_height):
+    with np.errstate(invalid='ignore'):
+        return np.where(np.isnan(obstacle_distance), 0.0,
+                        calculate_wind_speed_reduction(drag_coefficient, obstacle_height, obstacle_distance))
+
+
+# Function to calculate wind speed reduction due to nearby buildings
+def calculate_wind_speed_reduction(Cd, h, r):
+    delta_V = Cd * h / r
+    return delta_V
+
+
+# Function to calculate wind power
+def calculate_wind_power(A, final_wind_speed):
+    rho = 1.2255
+    efficiency = 0.4
+    PWind = (rho / 2) * A * final_wind_speed ** 3
+    PEffective = PWind * efficiency
+    return PEffective
+
+
+# Function to calculate the annual energy output
+def calculate_annual_energy_output(power):
+
+    hours_per_year = 24 * 365
+    annual_energy_output = power * hours_per_year / 1000
+    return annual_energy_output
+
+
+def calculate_co2_savings(annual_energy_output, co2_per_kwh):
+
+    co2_savings = annual_energy_output * co2_per_kwh
+    return co2_savings
+
+
+def calculate_total_co2_savings(annual_co2_savings, years):
+
+    total_co2_savings = annual_co2_savings * years
+    return total_co2_savings
+
+
+# Function to calculate the swept area of a turbine
+def calculate_swept_area(turbine_type, radius=None, rotor_height=None, diameter=None):
+    turbine_type = turbine_types.get(turbine_type, turbine_type)
+    if turbine_type == turbine_types['HAWT']:
+        return math.pi * radius ** 2
+    elif turbine_type == turbine_types['VAWT']:
+        return rotor_height * diameter  # A simple approximation
+    else:
+        raise ValueError(f"Unknown turbine type: {turbine_type}")
+
+
+# Function to download the weather history and the building heights of a location at the same time.
+# Returns the height map, its bbox, the average wind direction and the wind rose (None without wind_rose_years).
+def fetch_site_data(lat, lon, average_wind_direction=None, api_key=None, height_maps=None, weather_end_date=None,
+                    wind_rose_years=None, sectors=12):
+    height_maps = height_maps or get_height_map_source()
+    tasks = {'height_map': lambda cancel: height_maps.height_map(lat, lon, cancel=cancel)}
+    if wind_rose_years:
+        tasks['wind_rose'] = lambda cancel: fetch_wind_rose(lat, lon, wind_rose_years, sectors, api_key, cancel,
+                                                            weather_end_date)
+    elif average_wind_direction is None:
+        tasks['average_wind_direction'] = lambda cancel: fetch_average_wind_direction(
+            lat, lon, api_key, cancel=cancel, end_date=weather_end_date)
+    with span('downloads'):
+        downloads = service_io.run_concurrently(tasks)
+    height_map, bbox = downloads['height_map']
+    average_wind_direction = downloads.get('average_wind_direction', average_wind_direction)
+    wind_rose = downloads.get('wind_rose')
+    if wind_rose is not None and average_wind_direction is None:
+        average_wind_direction = wind_rose.mean_direction()
+    return height_map, bbox, average_wind_direction, wind_rose
+
+
+# Function to run the whole calculation for one location.
+# sampler is a wind_raster.WindSpeedSampler, height_maps a wms_tile_cache.TiledHeightMapFetcher or
+# ndom_tiles.LocalHeightMapSource (the shared one if missing). The weather window ends today unless weather_end_date is given.
+# With wind_rose_years, the obstacle reduction is weighted over the sectors of the wind rose of the
+# hourly weather of that many years, instead of using only the average wind direction.
+# With power_curve (an energy_engine.PowerCurves of one turbine model), the energy comes from the
+# power curve over Weibull distributed wind speeds (shape weibull_k) with the final wind speed as
+# mean, and wind_power is the mean power. Without it, the fixed efficiency of calculate_wind_power is used.
+def evaluate_site(sampler, lat, lon, h2, A, years, average_wind_direction=None, api_key=None, height_maps=None,
+                  weather_end_date=None, wind_rose_years=None, sectors=12, power_curve=None, weibull_k=2.0):
+    if power_curve is not None and len(power_curve) != 1:
+        raise ValueError(f"Expected the power curve of one turbine model, got {len(power_curve)}")
+
+    # Wind speed at the specified location and height
+    with span('raster_speed'):
+        original_wind_speed = float(sampler.wind_speed_at_height(lat, lon, h2))
+    if np.isnan(original_wind_speed):
+        raise ValueError("Latitude and longitude are out of raster bounds or have no wind speed data.")
+
+    # Weather history and building heights are downloaded at the same time
+    height_map, bbox, average_wind_direction, wind_rose = fetch_site_data(
+        lat, lon, average_wind_direction, api_key, height_maps, weather_end_date, wind_rose_years, sectors)
+
+    if wind_rose is not None:
+        # Wind speed reduction weighted over all sectors, the obstacle of the prevailing sector is reported
+        with span('obstacle_search'):
+            wind_speed_reduction, sector_distance, sector_height = sector_wind_speed_reduction(
+                height_map, bbox, lat, lon, wind_rose, h2)
+        wind_speed_reduction = float(wind_speed_reduction)
+        prevailing = wind_rose.prevailing_sector()
+        obstacle_distance, obstacle_height = float(sector_distance[prevailing]), float(sector_height[prevailing])
+    else:
+        # Wind speed reduction due to the first building higher than h2 upwind
+        with span('obstacle_search'):
+            obstacle = find_upwind_obstacle(height_map, bbox, lat, lon, average_wind_direction, h2)
+        if obstacle is None:
+            obstacle_distance, obstacle_height = np.nan, np.nan
+            wind_speed_reduction = 0
+        else:
+            obstacle_distance, obstacle_height = obstacle
+            wind_speed_reduction = calculate_wind_speed_reduction(drag_coefficient, obstacle_height,
+                                                                  obstacle_distance)
+
+    # Adjust the original wind speed considering the reduction, it can't be negative
+    final_wind_speed = max(original_wind_speed - wind_speed_reduction, 0)
+
+    with span('energy'):
+        if power_curve is None:
+            wind_power = calculate_wind_power(A, final_wind_speed)
+            annual_energy_output = calculate_annual_energy_output(wind_power)
+            capacity_factor = None
+        else:
+            annual_energy_output = float(annual_energy_at_mean_speed(power_curve, final_wind_speed, weibull_k)[0, 0])
+            wind_power = annual_energy_output * 1000 / hours_per_year
+            capacity_factor = float(capacity_factors(power_curve, annual_energy_output)[0])
+
+    result = {
+        'lat': lat,
+        'lon': lon,
+        'h2': h2,
+        'A': A,
+        'years': years,
+        'turbine_model': power_curve.models[0] if power_curve is not None else None,
+        'original_wind_speed': original_wind_speed,
+        'average_wind_direction': average_wind_direction,
+        'obstacle_distance': obstacle_distance,
+        'obstacle_height': obstacle_height,
+        'wind_speed_reduction': wind_speed_reduction,
+        'final_wind_speed': final_wind_speed,
+        'wind_power': wind_power,
+        'annual_energy_output': annual_energy_output,
+        'capacity_factor': capacity_factor,
+    }
+    for fuel, co2_per_kwh in emission_factors.items():
+        annual_co2_savings = calculate_co2_savings(annual_energy_output, co2_per_kwh)
+        result[f'annual_co2_savings_{fuel}'] = annual_co2_savings
+        result[f'total_co2_savings_{fuel}'] = calculate_total_co2_savings(annual_co2_savings, years)
+
+    # Kept for the height map plot of the web app
+    result['height_map'] = height_map
+    result['bbox'] = bbox
+    result['wind_rose'] = wind_rose
+    return result
+
+
+# Function to calculate a location for every combination of hub height and swept area at once.
+# The site data is downloaded once and the rays over the height map are sampled once for all hub
+# heights, so a grid of hundreds of configurations costs about as much as evaluate_site.
+# The wind speeds and obstacles have one value per hub height, the power, energy and CO2 savings
+# one row per hub height and one column per swept area. 'best' is the configuration with the most power,
+# with its row (h2_index) and column (A_index).
+def sweep_site(sampler, lat, lon, h2_values, areas, years, average_wind_direction=None, api_key=None,
+               height_maps=None, weather_end_date=None, wind_rose_years=None, sectors=12):
+    h2_values = np.asarray(h2_values, dtype=float)
+    areas = np.asarray(areas, dtype=float)
+    if h2_values.ndim != 1 or areas.ndim != 1 or not len(h2_values) or not len(areas):
+        raise ValueError("The sweep needs at least one hub height and one swept area.")
+
+    with span('raster_speed'):
+        original_wind_speed = sampler.wind_speed_at_height(lat, lon, h2_values)
+    if np.isnan(original_wind_speed).any():
+        raise ValueError("Latitude and longitude are out of raster bounds or have no wind speed data.")
+
+    height_map, bbox, average_wind_direction, wind_rose = fetch_site_data(
+        lat, lon, average_wind_direction, api_key, height_maps, weather_end_date, wind_rose_years, sectors)
+
+    with span('obstacle_search', configurations=len(h2_values)):
+        if wind_rose is not None:
+            wind_speed_reduction, sector_distance, sector_height = sector_wind_speed_reduction(
+                height_map, bbox, lat, lon, wind_rose, h2_values)
+            prevailing = wind_rose.prevailing_sector()
+            obstacle_distance, obstacle_height = sector_distance[:, prevailing], sector_height[:, prevailing]
+        else:
+            obstacle_distance, obstacle_height = upwind_obstacles(height_map, bbox, lat, lon, average_wind_direction,
+                                                                  h2_values)
+            wind_speed_reduction = obstacle_wind_speed_reduction(obstacle_distance, obstacle_height)
+
+    final_wind_speed = np.maximum(original_wind_speed - wind_speed_reduction, 0)
+
+    with span('energy', configurations=len(h2_values) * len(areas)):
+        wind_power = calculate_wind_power(areas[None, :], final_wind_speed[:, None])
+        annual_energy_output = calculate_annual_energy_output(wind_power)
+
+    best_h2, best_area = np.unravel_index(np.argmax(wind_power), wind_power.shape)
+    result = {
+        'lat': lat,
+        'lon': lon,
+        'h2': h2_values,
+        'A': areas,
+        'years': years,
+        'original_wind_speed': original_wind_speed,
+        'average_wind_direction': average_wind_direction,
+        'obstacle_distance': obstacle_distance,
+        'obstacle_height': obstacle_height,
+        'wind_speed_reduction': wind_speed_reduction,
+        'final_wind_speed': final_wind_speed,
+        'wind_power': wind_power,
+        'annual_energy_output': annual_energy_output,
+        'best': {'h2_index': int(best_h2), 'A_index': int(best_area),
+                 'h2': float(h2_values[best_h2]), 'A': float(areas[best_area]),
+                 'final_wind_speed': float(final_wind_speed[best_h2]),
+                 'wind_power': float(wind_power[best_h2, best_area]),
+                 'annual_energy_output': float(annual_energy_output[best_h2, best_area])},
+    }
+    for fuel, co2_per_kwh in emission_factors.items():
+        annual_co2_savings = calculate_co2_savings(annual_energy_output, co2_per_kwh)
+        result[f'annual_co2_savings_{fuel}'] = annual_co2_savings
+        result[f'total_co2_savings_{fuel}'] = calculate_total_co2_savings(annual_co2_savings, years)
+    result['height_map'] = height_map
+    result['bbox'] = bbox
+    result['wind_rose'] = wind_rose
+    return result
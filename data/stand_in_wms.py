@@ -0,0 +1,132 @@
+"""Local stand-in for the nDOM WMS, so the height map code can run offline.
+
+Usage:
+    python data/stand_in_wms.py --port 8080
+
+It answers GetCapabilities and GetMap (EPSG:4326, PNG) requests for the
+nw_ndom layer with a synthetic city of rectangular buildings, coloured with
+the same palette as the real service.
+"""
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+from ndom_decoder import color_to_height
+
+capabilities_template = """<?xml version="1.0" encoding="UTF-8"?>
+<WMT_MS_Capabilities version="1.1.1">
+  <Service>
+    <Name>OGC:WMS</Name>
+    <Title>Stand-in nDOM WMS</Title>
+    <OnlineResource xmlns:xlink="http://www.w3.org/1999/xlink" xlink:href="{url}"/>
+  </Service>
+  <Capability>
+    <Request>
+      <GetCapabilities>
+        <Format>application/vnd.ogc.wms_xml</Format>
+        <DCPType><HTTP><Get><OnlineResource xmlns:xlink="http://www.w3.org/1999/xlink" xlink:href="{url}?"/></Get></HTTP></DCPType>
+      </GetCapabilities>
+      <GetMap>
+        <Format>image/png</Format>
+        <DCPType><HTTP><Get><OnlineResource xmlns:xlink="http://www.w3.org/1999/xlink" xlink:href="{url}?"/></Get></HTTP></DCPType>
+      </GetMap>
+    </Request>
+    <Exception><Format>application/vnd.ogc.se_xml</Format></Exception>
+    <Layer>
+      <Title>Stand-in nDOM</Title>
+      <SRS>EPSG:4326</SRS>
+      <LatLonBoundingBox minx="-180" miny="-90" maxx="180" maxy="90"/>
+      <Layer queryable="0">
+        <Name>{layer}</Name>
+        <Title>{layer}</Title>
+        <SRS>EPSG:4326</SRS>
+        <LatLonBoundingBox minx="-180" miny="-90" maxx="180" maxy="90"/>
+      </Layer>
+    </Layer>
+  </Capability>
+</WMT_MS_Capabilities>
+"""
+
+# Upper limits of the palette height classes, in the order of color_to_height
+_class_limits = [1.5, 3.0, 5.0, 10.0, 15.0, 20.0, 25.0, 50.0]
+_palette = np.array(list(color_to_height.keys()), dtype=np.uint8)
+
+
+# Function giving the building heights (meters) of a synthetic city at the given coordinates.
+# Buildings are placed on a regular block grid with a height that depends only on the block.
+def synthetic_city(lons, lats, block_size=(0.0004, 0.0003), building_share=0.6):
+    block_x = lons / block_size[0]
+    block_y = lats / block_size[1]
+    i, j = np.floor(block_x).astype(np.int64), np.floor(block_y).astype(np.int64)
+    margin = (1 - building_share) / 2
+    in_building = ((block_x - i > margin) & (block_x - i < 1 - margin) &
+                   (block_y - j > margin) & (block_y - j < 1 - margin))
+    block_height = ((i * 73856093) ^ (j * 19349663)) % 40 + 2
+    return np.where(in_building, block_height, 0.0)
+
+
+# Function to render heights into an RGBA image using the nDOM palette (NaN is transparent)
+def render_heights(heights):
+    classes = np.minimum(np.searchsorted(_class_limits, np.nan_to_num(heights), side='left'), len(_palette) - 1)
+    rgba = _palette[classes]
+    rgba[np.isnan(heights)] = 0
+    return Image.fromarray(rgba, 'RGBA')
+
+
+def make_handler(layer, height_function):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            query = {k.lower(): v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            request = query.get('request', '').lower()
+            if request == 'getcapabilities':
+                url = f"http://{self.headers['Host']}{urlparse(self.path).path}"
+                body = capabilities_template.format(url=url, layer=layer).encode()
+                self._send(body, 'application/vnd.ogc.wms_xml')
+            elif request == 'getmap':
+                west, south, east, north = map(float, query['bbox'].split(','))
+                width, height = int(query['width']), int(query['height'])
+                # Heights are sampled at the pixel centres, row 0 is the north edge
+                lons = west + (np.arange(width) + 0.5) * (east - west) / width
+                lats = north - (np.arange(height) + 0.5) * (north - south) / height
+                heights = height_function(*np.meshgrid(lons, lats))
+                buffer = BytesIO()
+                render_heights(heights).save(buffer, format='PNG')
+                self._send(buffer.getvalue(), 'image/png')
+            else:
+                self.send_error(400, "Unsupported request")
+
+        def _send(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# Function to start the stand-in WMS in a background thread. Returns the server and its URL.
+def serve(port=0, layer='nw_ndom', height_function=synthetic_city):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(layer, height_function))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/wms"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the nDOM WMS.")
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler('nw_ndom', synthetic_city))
+    print(f"Stand-in WMS running at http://127.0.0.1:{args.port}/wms")
+    server.serve_forever()
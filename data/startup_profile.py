@@ -0,0 +1,80 @@
+"""Measure the cold start, rerun latency and memory of the web app.
+
+Usage:
+    python data/startup_profile.py --reruns 20 --output profile.json
+
+Every measurement runs in a fresh Python process. The app is run headless with
+Streamlit's AppTest: the first run is the cold start, the following runs are
+reruns like the ones triggered by every widget change. The resident memory
+(peak RSS) is reported after the cold start and after all reruns, and the
+time to import the calculation modules is measured separately.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+data_dir = os.path.dirname(os.path.abspath(__file__))
+app_path = os.path.join(data_dir, 'webapp_wind_LCA.py')
+
+_import_probe = """
+import resource, time
+start = time.perf_counter()
+import siting_engine, service_io, wind_raster, placement_optimizer, results_store, compute_pool
+print(json.dumps({'import_s': time.perf_counter() - start,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+_app_probe = """
+import resource, time
+from streamlit.testing.v1 import AppTest
+
+app = AppTest.from_file(APP_PATH, default_timeout=300)
+start = time.perf_counter()
+app.run()
+cold_s = time.perf_counter() - start
+cold_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+rerun_s = []
+for _ in range(RERUNS):
+    start = time.perf_counter()
+    app.run()
+    rerun_s.append(time.perf_counter() - start)
+print(json.dumps({'cold_s': cold_s, 'rerun_s': sorted(rerun_s)[len(rerun_s) // 2] if rerun_s else None,
+                  'cold_rss_mb': cold_rss_mb, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'exceptions': [str(e.value) for e in app.exception]}))
+"""
+
+
+def _run_probe(code):
+    process = subprocess.run([sys.executable, '-c', 'import json\n' + code], cwd=data_dir, capture_output=True,
+                             text=True, env={**os.environ, 'PYTHONPATH': data_dir})
+    if process.returncode != 0:
+        return {'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'failed'}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+# Function to measure the import cost of the calculation modules, the median of several fresh processes
+def measure_imports(repeat=5):
+    runs = [_run_probe(_import_probe) for _ in range(repeat)]
+    if 'error' in runs[0]:
+        return runs[0]
+    return {name: sorted(run[name] for run in runs)[repeat // 2] for name in runs[0]}
+
+
+# Function to measure the cold start and the reruns of the app (needs streamlit)
+def measure_app(reruns=20):
+    return _run_probe(_app_probe.replace('APP_PATH', repr(app_path)).replace('RERUNS', str(reruns)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the cold start, rerun latency and memory of the web app.")
+    parser.add_argument('--reruns', type=int, default=20)
+    parser.add_argument('--output', help="Also write the measurements to this JSON file")
+    args = parser.parse_args()
+
+    profile = {'imports': measure_imports(), 'app': measure_app(args.reruns)}
+    print(json.dumps(profile, indent=1))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(profile, f, indent=1)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the app are imported by their bare names, like in the app itself
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,74 @@
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import batch_siting
+import service_io
+import siting_engine
+from ndom_tiles import LocalHeightMapSource
+from stand_in_wms import synthetic_city
+from wind_raster import WindSpeedSampler
+
+lat, lon = 51.4818, 7.2162
+
+
+# A local nDOM tile of the synthetic city around the location, so the workers need no WMS
+@pytest.fixture(scope='module')
+def ndom_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('ndom')
+    resolution, size = 0.00001, 1000
+    transform = from_origin(lon - size * resolution / 2, lat + size * resolution / 2, resolution, resolution)
+    cols, rows = np.meshgrid(np.arange(size) + 0.5, np.arange(size) + 0.5)
+    heights = synthetic_city(*(transform * (cols, rows))).astype(np.float32)
+    with rasterio.open(directory / 'ndom.tif', 'w', driver='GTiff', width=size, height=size, count=1,
+                       dtype='float32', crs='EPSG:4326', transform=transform) as dst:
+        dst.write(heights, 1)
+    return str(directory)
+
+
+def test_run_matches_evaluate_site(ndom_dir, tmp_path):
+    rng = np.random.default_rng(0)
+    lats, lons = lat + rng.uniform(-0.002, 0.002, 10), lon + rng.uniform(-0.002, 0.002, 10)
+    input_path = tmp_path / 'sites.csv'
+    with open(input_path, 'w') as f:
+        f.write('lat,lon,h2,turbine_type,radius,rotor_height,diameter,average_wind_direction\n')
+        for i, (site_lat, site_lon) in enumerate(zip(lats, lons)):
+            if i % 2:
+                f.write(f'{site_lat},{site_lon},{4 + i},HAWT,1.5,,,{20 * i}\n')
+            else:
+                f.write(f'{site_lat},{site_lon},{4 + i},VAWT,,2.0,1.2,{20 * i}\n')
+        # Outside of the wind speed raster
+        f.write('10.0,10.0,6,HAWT,1.0,,,180\n')
+
+    output_path = str(tmp_path / 'results.parquet')
+    assert batch_siting.run(str(input_path), output_path, workers=2, chunk_size=3, ndom_dir=ndom_dir) == 11
+    results = pq.read_table(output_path).to_pylist()
+    assert [result['site_id'] for result in results] == list(range(11))
+    assert results[10]['error'].startswith('ValueError')
+
+    height_maps = LocalHeightMapSource(ndom_dir)
+    with WindSpeedSampler(siting_engine.geotiff_path) as sampler:
+        for i, result in enumerate(results[:10]):
+            assert result['error'] is None
+            A = (siting_engine.calculate_swept_area('HAWT', radius=1.5) if i % 2 else
+                 siting_engine.calculate_swept_area('VAWT', rotor_height=2.0, diameter=1.2))
+            expected = siting_engine.evaluate_site(sampler, lats[i], lons[i], 4 + i, A, 20,
+                                                   average_wind_direction=20 * i, height_maps=height_maps)
+            for name in ('A', 'original_wind_speed', 'wind_speed_reduction', 'final_wind_speed', 'wind_power',
+                         'annual_energy_output', 'total_co2_savings_coal'):
+                assert result[name] == pytest.approx(expected[name], nan_ok=True)
+
+
+def test_run_after_io_stages_in_parent(ndom_dir, tmp_path):
+    # Idle I/O threads in this process must not leave the workers without any
+    assert service_io.run_concurrently({name: lambda cancel: 1 for name in 'abcdefgh'}) == dict.fromkeys('abcdefgh', 1)
+    input_path = tmp_path / 'sites.csv'
+    with open(input_path, 'w') as f:
+        f.write('lat,lon,h2,turbine_type,radius,average_wind_direction\n')
+        f.write(f'{lat},{lon},6,HAWT,1.0,225\n' * 4)
+
+    output_path = str(tmp_path / 'results.parquet')
+    assert batch_siting.run(str(input_path), output_path, workers=2, chunk_size=2, ndom_dir=ndom_dir) == 4
+    assert pq.read_table(output_path).column('error').to_pylist() == [None] * 4
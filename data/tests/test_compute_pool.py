@@ -0,0 +1,77 @@
+import contextvars
+import threading
+
+import pytest
+
+from compute_pool import ComputePool, PoolBusy, site_key
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+class BlockingJob:
+
+    # Waits until released, counting how often it ran
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self, value):
+        self.calls += 1
+        self.release.wait(5)
+        return value
+
+
+def test_identical_jobs_run_once():
+    pool = ComputePool(max_workers=2)
+    job = BlockingJob()
+    futures = [pool.submit('same', job, 1) for _ in range(5)]
+    other = pool.submit('other', job, 2)
+    assert all(future is futures[0] for future in futures)
+    job.release.set()
+    assert futures[0].result() == 1 and other.result() == 2
+    assert job.calls == 2
+    metrics = pool.metrics()
+    assert (metrics['submitted'], metrics['coalesced'], metrics['completed']) == (2, 4, 2)
+
+    # A finished job is not in flight anymore, the next one runs again
+    assert pool.submit('same', job, 3).result() == 3 and job.calls == 3
+    pool.shutdown()
+
+
+def test_full_queue_rejects_jobs():
+    pool = ComputePool(max_workers=1, max_queue=1, queue_timeout=0.1)
+    job = BlockingJob()
+    running = pool.submit('a', job, 1)
+    queued = pool.submit('b', job, 2)
+    with pytest.raises(PoolBusy):
+        pool.submit('c', job, 3)
+    # Joining a job in flight needs no place in the queue
+    assert pool.submit('b', job, 2) is queued
+    assert pool.metrics()['rejected'] == 1
+
+    job.release.set()
+    assert running.result() == 1 and queued.result() == 2
+    assert pool.submit('c', job, 3).result() == 3
+    pool.shutdown()
+
+
+def test_errors_and_context():
+    pool = ComputePool(max_workers=1)
+
+    def fail():
+        raise ValueError("no data")
+
+    with pytest.raises(ValueError):
+        pool.submit('fail', fail).result()
+    # The caller's context variables are visible in the job
+    request_id.set('session 1')
+    assert pool.submit('context', request_id.get).result() == 'session 1'
+    metrics = pool.metrics()
+    assert metrics['failed'] == 1 and metrics['in_flight'] == 0 and 'wait_p95_ms' in metrics
+    pool.shutdown()
+
+
+def test_site_key():
+    assert site_key(51.48180, 7.21620, 6.0, 3.14159) == site_key(51.481801, 7.216201, 6.001, 3.1416)
+    assert site_key(51.4818, 7.2162, 6.0, 3.0) != site_key(51.4819, 7.2162, 6.0, 3.0)
+    assert site_key(51.4818, 7.2162, 6.0, 3.0, 'HAWT') != site_key(51.4818, 7.2162, 6.0, 3.0, 'VAWT')
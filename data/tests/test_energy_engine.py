@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+import pytest
+
+from energy_engine import (PowerCurves, annual_energy_at_mean_speed, annual_energy_from_series,
+                           annual_energy_weibull, fit_weibull, hours_per_year, parametric_power_curve,
+                           speed_histogram, synthetic_catalogue, weibull_scale)
+
+
+@pytest.fixture(scope='module')
+def power_curves():
+    return synthetic_catalogue(5)
+
+
+def test_speed_histogram_matches_loop():
+    grid = np.arange(0, 10.01, 0.5)
+    speeds = np.array([[0.0, 0.2, 1.25, 9.9, 15.0, np.nan], [3.3, 3.3, 7.75, 0.5, np.nan, np.nan]])
+    expected = np.zeros((2, len(grid)))
+    for site, row in enumerate(speeds):
+        for speed in row[~np.isnan(row)]:
+            position = min(speed / 0.5, len(grid) - 1)
+            lower = min(int(position), len(grid) - 2)
+            expected[site, lower] += 1 - (position - lower)
+            expected[site, lower + 1] += position - lower
+    np.testing.assert_allclose(speed_histogram(speeds, grid), expected)
+
+
+def test_series_energy_matches_interpolated_curves(power_curves):
+    speeds = np.random.default_rng(0).weibull(2.0, (3, 1000)) * 6
+    expected = np.array([[np.interp(row, power_curves.wind_speeds, curve).sum() * hours_per_year / len(row)
+                          for curve in power_curves.power] for row in speeds])
+    np.testing.assert_allclose(annual_energy_from_series(power_curves, speeds), expected, rtol=1e-9)
+
+
+def test_weibull_energy_matches_integration(power_curves):
+    k, c = 2.0, 7.0
+    speeds = np.linspace(0, 40, 400001)
+    pdf = k / c * (speeds / c) ** (k - 1) * np.exp(-(speeds / c) ** k)
+    expected = []
+    for curve in power_curves.power:
+        values = np.interp(speeds, power_curves.wind_speeds, curve) * pdf
+        expected.append(hours_per_year * np.sum((values[1:] + values[:-1]) / 2 * np.diff(speeds)))
+    np.testing.assert_allclose(annual_energy_weibull(power_curves, k, c)[0], expected, rtol=0.01)
+
+
+def test_weibull_fit():
+    k, c = fit_weibull(np.random.default_rng(1).weibull(2.0, 200000) * 6.0)
+    assert abs(k[0] - 2.0) < 0.05 and abs(c[0] - 6.0) < 0.05
+    assert math.isclose(weibull_scale(6.0 * math.gamma(1.5)), 6.0)
+
+
+def test_mean_speed_energy(power_curves):
+    energy = annual_energy_at_mean_speed(power_curves, [0.0, 5.0])
+    np.testing.assert_array_equal(energy[0], 0)
+    np.testing.assert_allclose(energy[1], annual_energy_weibull(power_curves, 2.0, weibull_scale(5.0))[0])
+
+
+def test_select(power_curves):
+    model = power_curves.models[3]
+    selected = power_curves.select(model)
+    assert selected.models == [model] and len(selected) == 1
+    np.testing.assert_array_equal(selected.power[0], power_curves.power[3])
+    with pytest.raises(ValueError):
+        power_curves.select('unknown')
+
+
+def test_parametric_curve_limits():
+    curves = PowerCurves(['small'], [parametric_power_curve(5.0, 10.0, cut_in=3.0, cut_out=25.0)])
+    power = dict(zip(curves.wind_speeds, curves.power[0]))
+    assert power[2.5] == 0 and power[30.0] == 0
+    assert curves.rated_power[0] == 5.0
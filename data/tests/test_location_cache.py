@@ -0,0 +1,56 @@
+from datetime import date, timedelta
+
+import pytest
+
+from location_cache import LocationCache, geohash, geohash_center
+
+lat, lon = 51.4818, 7.2162
+
+
+class WeatherService:
+
+    # Answers with one value per day, except for the days in missing
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.requests = []
+
+    def __call__(self, location, start_date, end_date):
+        self.requests.append((start_date, end_date))
+        start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+        return {'locations': {location: {'values': [{'datetimeStr': f"{day}T00:00:00+02:00", 'wdir': 180.0}
+                                                    for day in days if day not in self.missing]}}}
+
+
+def days_before_today(count):
+    today = date.today()
+    return [(today - timedelta(days=i)).isoformat() for i in range(count - 1, -1, -1)]
+
+
+def weather_days(result):
+    return [value['datetimeStr'][:10] for location in result['locations'].values() for value in location['values']]
+
+
+def test_geohash():
+    assert geohash(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    center_lat, center_lon = geohash_center(geohash(lat, lon, 9))
+    assert abs(center_lat - lat) < 1e-4 and abs(center_lon - lon) < 1e-4
+
+
+def test_only_missing_days_are_fetched(tmp_path):
+    cache = LocationCache(str(tmp_path / 'cache.sqlite'))
+    service = WeatherService()
+    days = days_before_today(30)
+    assert weather_days(cache.weather(lat, lon, days[10], days[-1], service)) == days[10:]
+    assert weather_days(cache.weather(lat, lon, days[0], days[-1], service)) == days
+    assert service.requests == [(days[10], days[-1]), (days[0], days[9])]
+
+
+@pytest.mark.parametrize('missing_weather_ttl, fetched_again', [(3600, False), (-1, True)])
+def test_missing_day_is_cached(tmp_path, missing_weather_ttl, fetched_again):
+    cache = LocationCache(str(tmp_path / 'cache.sqlite'), missing_weather_ttl=missing_weather_ttl)
+    days = days_before_today(5)
+    service = WeatherService(missing=[days[-1]])
+    for _ in range(2):
+        assert weather_days(cache.weather(lat, lon, days[0], days[-1], service)) == days[:-1]
+    assert service.requests[1:] == ([(days[-1], days[-1])] if fetched_again else [])
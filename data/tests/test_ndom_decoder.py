@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from ndom_decoder import (_image_to_height_map_loops, color_to_height, decode_height_map, image_to_height_map,
+                          smooth_height_map)
+
+
+def random_image(width, height, seed=0):
+    # Palette colors plus transparent pixels without height data
+    rng = np.random.default_rng(seed)
+    colors = np.array(list(color_to_height.keys()) + [(0, 0, 0, 0)], dtype=np.uint8)
+    return Image.fromarray(colors[rng.integers(0, len(colors), size=(height, width))], 'RGBA')
+
+
+@pytest.mark.parametrize('width, height', [(40, 30), (3, 3), (2, 5), (1, 7), (17, 3), (3, 23)])
+def test_matches_pixel_loops(width, height):
+    for seed in range(3):
+        image = random_image(width, height, seed)
+        np.testing.assert_array_equal(image_to_height_map(image), _image_to_height_map_loops(image))
+
+
+def test_decode_palette():
+    image = np.array([[(255, 255, 255, 255), (114, 0, 11, 255), (1, 2, 3, 255)]], dtype=np.uint8)
+    np.testing.assert_array_equal(decode_height_map(image), [[0.75, 50.0, np.nan]])
+
+
+def test_smoothing_keeps_input():
+    height_map = np.arange(25, dtype=float).reshape(5, 5)
+    smooth_height_map(height_map)
+    np.testing.assert_array_equal(height_map, np.arange(25, dtype=float).reshape(5, 5))
@@ -0,0 +1,98 @@
+import json
+
+import numpy as np
+import pytest
+import rasterio
+from pyproj import Transformer
+from rasterio.transform import from_origin, rowcol
+
+import ndom_tiles
+from ndom_tiles import LocalHeightMapSource, TileIndex, index_file_name, scan_tiles
+from stand_in_wms import synthetic_city
+
+lat, lon = 51.4818, 7.2162
+
+
+def brute_force_query(boxes, bbox):
+    return np.flatnonzero(ndom_tiles._overlaps(np.asarray(boxes, dtype=float), bbox))
+
+
+@pytest.mark.parametrize('count', [0, 5, 16, 17, 300, 5000])
+def test_tile_index_matches_brute_force(count):
+    rng = np.random.default_rng(count)
+    west, south = rng.uniform(6, 9, count), rng.uniform(50, 52, count)
+    boxes = np.column_stack([west, south, west + rng.uniform(0, 0.05, count), south + rng.uniform(0, 0.05, count)])
+    index = TileIndex(boxes)
+    assert len(index) == count
+    for query_west, query_south, size in zip(rng.uniform(5.9, 9, 50), rng.uniform(49.9, 52, 50),
+                                             rng.uniform(0, 0.3, 50)):
+        bbox = (query_west, query_south, query_west + size, query_south + size)
+        np.testing.assert_array_equal(index.query(bbox), brute_force_query(boxes, bbox))
+    if count:
+        np.testing.assert_array_equal(index.query_point(boxes[0, 0], boxes[0, 1]),
+                                      brute_force_query(boxes, (boxes[0, 0], boxes[0, 1]) * 2))
+
+
+# The synthetic city as a 0.5 m raster in UTM 32N around the location, cut into 2 x 2 tiles.
+# Returns the directory and the whole raster, to read the expected heights from.
+@pytest.fixture(scope='module')
+def tile_directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('ndom')
+    to_utm = Transformer.from_crs('EPSG:4326', 'EPSG:25832', always_xy=True)
+    x, y = to_utm.transform(lon, lat)
+    size, resolution = 800, 0.5
+    transform = from_origin(round(x) - size * resolution / 2, round(y) + size * resolution / 2, resolution, resolution)
+    cols, rows = np.meshgrid(np.arange(size) + 0.5, np.arange(size) + 0.5)
+    lons, lats = to_utm.transform(*(transform * (cols, rows)), direction='INVERSE')
+    heights = synthetic_city(lons, lats).astype(np.float32)
+    heights[::9, ::13] = -9999
+
+    half = size // 2
+    for row in range(2):
+        for col in range(2):
+            profile = {'driver': 'GTiff', 'width': half, 'height': half, 'count': 1, 'dtype': 'float32',
+                       'crs': 'EPSG:25832', 'nodata': -9999,
+                       'transform': transform * transform.translation(col * half, row * half)}
+            with rasterio.open(directory / f'ndom_{row}_{col}.tif', 'w', **profile) as dst:
+                dst.write(heights[row * half:(row + 1) * half, col * half:(col + 1) * half], 1)
+    return directory, heights, transform
+
+
+# Reference: the nearest pixel of the whole raster at the centre of every height map pixel
+def direct_read(heights, transform, bbox, shape):
+    to_utm = Transformer.from_crs('EPSG:4326', 'EPSG:25832', always_xy=True)
+    lons = bbox[0] + (np.arange(shape[1]) + 0.5) * (bbox[2] - bbox[0]) / shape[1]
+    lats = bbox[3] - (np.arange(shape[0]) + 0.5) * (bbox[3] - bbox[1]) / shape[0]
+    xs, ys = to_utm.transform(*np.meshgrid(lons, lats))
+    rows, cols = rowcol(transform, xs.ravel(), ys.ravel())
+    values = heights[np.asarray(rows), np.asarray(cols)].reshape(shape).astype(float)
+    return np.where(values == -9999, np.nan, values)
+
+
+def test_height_map_matches_direct_read(tile_directory):
+    directory, heights, transform = tile_directory
+    source = LocalHeightMapSource(str(directory))
+    assert len(source.tiles) == 4
+    for point in [(lat, lon), (lat + 0.0004, lon - 0.0005)]:
+        height_map, bbox = source.height_map(*point)
+        assert height_map.shape == (300, 400)
+        # The window crosses the tile borders
+        assert len(source.tiles_for_bbox(bbox)) == 4
+        np.testing.assert_array_equal(height_map, direct_read(heights, transform, bbox, height_map.shape))
+    source.close()
+
+    with pytest.raises(ValueError):
+        source.height_map(48.0, 11.0)
+
+
+def test_scan_reuses_index(tile_directory, monkeypatch):
+    directory, _, _ = tile_directory
+    tiles = scan_tiles(str(directory))
+    with open(directory / index_file_name) as f:
+        assert json.load(f) == tiles
+
+    # Unchanged tiles are not opened again
+    opened = []
+    monkeypatch.setattr(ndom_tiles.rasterio, 'open', lambda *args, **kwargs: opened.append(args))
+    assert scan_tiles(str(directory)) == tiles
+    assert not opened
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from pyproj import Geod
+from rasterio.transform import rowcol
+
+from obstacle_search import (cast_rays, clear_height, height_map_transform, nearest_obstacles, ray_distances,
+                             sector_directions)
+from stand_in_wms import synthetic_city
+
+lat, lon = 51.4818, 7.2162
+bbox_size = 0.001
+bbox = (lon - bbox_size, lat - bbox_size, lon + bbox_size, lat + bbox_size)
+
+
+def city_height_map(shape=(300, 400)):
+    lons = bbox[0] + (np.arange(shape[1]) + 0.5) * (bbox[2] - bbox[0]) / shape[1]
+    lats = bbox[3] - (np.arange(shape[0]) + 0.5) * (bbox[3] - bbox[1]) / shape[0]
+    height_map = synthetic_city(*np.meshgrid(lons, lats)).astype(float)
+    # Some pixels without height data
+    height_map[::7, ::11] = np.nan
+    return height_map
+
+
+# Scalar reference: walks every ray point by point like the original loops, but per ray
+# (a ray must leave the turbine's own building) and with the north-up pixel lookup
+def reference_rays(height_map, directions, h2, max_distance=100):
+    geod = Geod(ellps='WGS84')
+    transform = height_map_transform(bbox, height_map.shape)
+    distances, heights = [], []
+    for direction in directions:
+        found, cleared = (np.nan, np.nan), False
+        for distance in range(1, max_distance + 1):
+            lon2, lat2, _ = geod.fwd(lon, lat, direction, distance)
+            row, col = rowcol(transform, lon2, lat2)
+            inside = 0 <= row < height_map.shape[0] and 0 <= col < height_map.shape[1]
+            height = height_map[row, col] if inside else np.nan
+            if np.isnan(height) or 0 <= height <= clear_height:
+                cleared = True
+            elif cleared and height > h2:
+                found = (float(distance), height)
+                break
+        distances.append(found[0])
+        heights.append(found[1])
+    return np.array(distances), np.array(heights)
+
+
+@pytest.mark.parametrize('center, width, h2', [(225, 20, 6.0), (10, 20, 12.0), (0, 360, 4.0), (350, 40, 30.0)])
+def test_cast_rays_matches_scalar_walk(center, width, h2):
+    height_map = city_height_map()
+    directions = sector_directions(center, width, 5)
+    np.testing.assert_array_equal(cast_rays(height_map, bbox, lat, lon, directions, h2),
+                                  reference_rays(height_map, directions, h2))
+
+
+def test_hub_heights_broadcast():
+    height_map = city_height_map()
+    directions = sector_directions(0, 360, 10)
+    h2_values = np.array([2.0, 6.0, 12.0, 30.0])
+    distances, heights = cast_rays(height_map, bbox, lat, lon, directions, h2_values)
+    assert distances.shape == heights.shape == (len(h2_values), len(directions))
+    for row, h2 in enumerate(h2_values):
+        np.testing.assert_array_equal((distances[row], heights[row]), cast_rays(height_map, bbox, lat, lon,
+                                                                                 directions, h2))
+    np.testing.assert_array_equal((distances[1], heights[1]), reference_rays(height_map, directions, 6.0))
+
+    # Rays sampled once, several hub heights at once
+    rng = np.random.default_rng(0)
+    samples = rng.choice([np.nan, 0.0, 1.0, 5.0, 9.0, 20.0], size=(3, 5, 40))
+    sample_distances = ray_distances(40)
+    per_h2 = [nearest_obstacles(samples, sample_distances, h2) for h2 in h2_values]
+    np.testing.assert_array_equal(nearest_obstacles(samples, sample_distances, h2_values),
+                                  tuple(np.stack(values) for values in zip(*per_h2)))
+
+
+def test_north_is_up():
+    # A single building north of the location; the old south-to-north row lookup found it to the south
+    height_map = np.zeros((300, 400))
+    height_map[100:110, 190:210] = 20.0
+    distance_north, _ = cast_rays(height_map, bbox, lat, lon, np.array([0.0]), 6.0)
+    distance_south, _ = cast_rays(height_map, bbox, lat, lon, np.array([180.0]), 6.0)
+    assert 0 < distance_north[0] < 100
+    assert np.isnan(distance_south[0])
+
+
+def test_ray_must_leave_own_building():
+    distances = ray_distances(10)
+    # Starts on a 10 m building, then free space, then a 12 m building
+    heights = np.array([[10, 10, 0, 0, 12, 12, 0, 0, 0, 0],
+                        [10, 10, 10, 10, 12, 12, 10, 10, 10, 10]], dtype=float)
+    obstacle_distance, obstacle_height = nearest_obstacles(heights, distances, 6.0)
+    np.testing.assert_array_equal(obstacle_distance, [5.0, np.nan])
+    np.testing.assert_array_equal(obstacle_height, [12.0, np.nan])
+
+
+def test_sector_directions():
+    np.testing.assert_array_equal(sector_directions(100, 20, 5), [90, 95, 100, 105, 110])
+    assert len(sector_directions(0, 360)) == 360
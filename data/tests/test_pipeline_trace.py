@@ -0,0 +1,55 @@
+import json
+import threading
+
+from pipeline_trace import Tracer, span, tracing
+
+
+def traced_run():
+    tracer = Tracer()
+    with tracing(tracer):
+        with span('evaluate_site', sites=1):
+            with span('downloads'):
+                pass
+
+    def worker():
+        with tracing(tracer):
+            with span('obstacle_search'):
+                pass
+    thread = threading.Thread(target=worker, name='worker-1')
+    thread.start()
+    thread.join()
+    return tracer
+
+
+def test_span_is_disabled_without_tracer():
+    with span('raster_speed'):
+        pass
+    tracer = Tracer()
+    with tracing(tracer):
+        pass
+    assert tracer.spans == []
+
+
+def test_summary():
+    summary = {stage['stage']: stage for stage in traced_run().summary()}
+    assert set(summary) == {'evaluate_site', 'downloads', 'obstacle_search'}
+    assert all(stage['calls'] == 1 for stage in summary.values())
+
+
+def test_chrome_trace_thread_ids_are_numbers():
+    events = traced_run().chrome_trace()['traceEvents']
+    spans = [event for event in events if event['ph'] == 'X']
+    names = {event['tid']: event['args']['name'] for event in events if event['ph'] == 'M'}
+    assert len(spans) == 3
+    assert all(isinstance(event['tid'], int) for event in events)
+    assert sorted(names.values()) == sorted([threading.current_thread().name, 'worker-1'])
+    assert {names[event['tid']] for event in spans if event['name'] == 'obstacle_search'} == {'worker-1'}
+    assert [event['args'] for event in spans if event['name'] == 'evaluate_site'] == [{'sites': 1}]
+
+
+def test_write_replaces_file(tmp_path):
+    path = str(tmp_path / 'trace.jsonl')
+    for _ in range(2):
+        traced_run().write(path)
+    with open(path) as f:
+        assert len([json.loads(line) for line in f]) == 3
@@ -0,0 +1,104 @@
+import math
+
+import numpy as np
+import pytest
+
+from obstacle_search import clear_height
+from placement_optimizer import (best_locations, pixel_size_meters, score_locations, search_bbox_size,
+                                 upwind_obstacle_maps)
+
+lat, lon = 51.4818, 7.2162
+bbox = (lon - 0.0005, lat - 0.0005, lon + 0.0005, lat + 0.0005)
+
+
+def small_city(shape=(40, 50), seed=0):
+    rng = np.random.default_rng(seed)
+    height_map = np.where(rng.random(shape) < 0.3, rng.uniform(2, 30, shape), rng.uniform(0, 1.5, shape))
+    height_map[rng.random(shape) < 0.05] = np.nan
+    return height_map
+
+
+# Scalar reference: walks from every pixel along the direction, one pixel offset at a time
+def reference_maps(height_map, direction, h2, max_distance):
+    height, width = height_map.shape
+    pixel_width, pixel_height = pixel_size_meters(bbox, height_map.shape)
+    step = min(pixel_width, pixel_height)
+    dx, dy = math.sin(math.radians(direction)), math.cos(math.radians(direction))
+    offsets = []
+    for distance in np.arange(step, max_distance + step / 2, step):
+        offset = (int(round(-distance * dy / pixel_height)), int(round(distance * dx / pixel_width)))
+        if offset != (0, 0) and offset not in offsets:
+            offsets.append(offset)
+
+    distances = np.full(height_map.shape, np.nan)
+    heights = np.full(height_map.shape, np.nan)
+    unknown = np.zeros(height_map.shape, dtype=bool)
+    for row in range(height):
+        for col in range(width):
+            cleared, found, left = False, False, False
+            for row_offset, col_offset in offsets:
+                r, c = row + row_offset, col + col_offset
+                if not (0 <= r < height and 0 <= c < width):
+                    left, cleared = True, True
+                    continue
+                value = height_map[r, c]
+                if np.isnan(value) or 0 <= value <= clear_height:
+                    cleared = True
+                elif cleared and value > h2:
+                    distances[row, col] = math.hypot(row_offset * pixel_height, col_offset * pixel_width)
+                    heights[row, col] = value
+                    found = True
+                    break
+            unknown[row, col] = not found and left
+    return distances, heights, unknown
+
+
+@pytest.mark.parametrize('direction, h2, max_distance', [(225, 6.0, 30), (0, 10.0, 20), (90, 3.0, 50), (310, 20, 15)])
+def test_matches_scalar_walk(direction, h2, max_distance):
+    height_map = small_city()
+    for actual, expected in zip(upwind_obstacle_maps(height_map, bbox, direction, h2, max_distance),
+                                reference_maps(height_map, direction, h2, max_distance)):
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_search_shorter_than_a_pixel():
+    height_map = small_city()
+    obstacle_distance, obstacle_height, unknown = upwind_obstacle_maps(height_map, bbox, 225, 6.0, max_distance=0.5)
+    assert np.isnan(obstacle_distance).all() and np.isnan(obstacle_height).all() and not unknown.any()
+    scores = score_locations(height_map, bbox, 225, 4.0, 6.0, 3.0, max_distance=0.5)
+    assert np.nanmax(scores['final_wind_speed']) == 4.0
+
+
+def test_best_locations_are_separated():
+    height_map = small_city()
+    locations = best_locations(height_map, bbox, 225, 4.0, 6.0, 3.0, n=5, min_separation=15, max_distance=20)
+    assert len(locations) == 5
+    powers = [location['wind_power'] for location in locations]
+    assert powers == sorted(powers, reverse=True)
+    for i, a in enumerate(locations):
+        for b in locations[i + 1:]:
+            distance = math.hypot((a['lat'] - b['lat']) * 111320,
+                                  (a['lon'] - b['lon']) * 111320 * math.cos(math.radians(lat)))
+            assert distance > 14
+
+
+def test_search_on_a_padded_map():
+    padding = search_bbox_size(lat, lon, 0.0005, max_distance=20) - 0.0005
+    assert padding == pytest.approx(20 / (111320 * math.cos(math.radians(lat))), rel=0.01)
+
+    # The map of bbox with 20 m more on every side, at the same resolution
+    padded_bbox = (bbox[0] - padding, bbox[1] - padding, bbox[2] + padding, bbox[3] + padding)
+    margin = (int(round(40 * padding / 0.001)), int(round(50 * padding / 0.001)))
+    padded_map = small_city((40 + 2 * margin[0], 50 + 2 * margin[1]))
+    height_map = padded_map[margin[0]:-margin[0], margin[1]:-margin[1]]
+
+    # Without the padding the pixels near the upwind (south-west) edge are unknown
+    unknown = upwind_obstacle_maps(height_map, bbox, 225, 6.0, 20)[2]
+    padded_unknown = upwind_obstacle_maps(padded_map, padded_bbox, 225, 6.0, 20)[2]
+    assert unknown[-1, 0] and not padded_unknown[margin[0]:-margin[0], margin[1]:-margin[1]].any()
+
+    locations = best_locations(padded_map, padded_bbox, 225, 4.0, 6.0, 3.0, n=padded_map.size, min_separation=0,
+                               max_distance=20, within=bbox)
+    assert len(locations) > (~np.isnan(score_locations(height_map, bbox, 225, 4.0, 6.0, 3.0, 20)['wind_power'])).sum()
+    assert all(bbox[0] <= location['lon'] <= bbox[2] and bbox[1] <= location['lat'] <= bbox[3]
+               for location in locations)
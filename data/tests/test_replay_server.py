@@ -0,0 +1,94 @@
+import json
+import time
+
+import pytest
+import requests
+
+import replay_server
+import service_io
+import siting_engine
+
+
+class Upstream:
+
+    # Stands in for the real services behind service_io.get
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, service, url, params=None, cancel=None):
+        self.calls.append((service, url, dict(params), time.monotonic()))
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps({'display_name': f"Place {params['lat']}", 'lat': params['lat']}).encode()
+        return response
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = Upstream()
+    monkeypatch.setattr(service_io, 'get', upstream)
+    return upstream
+
+
+@pytest.fixture
+def restore_services(monkeypatch):
+    # use_server changes module settings of the app, they are restored after the test
+    for module, name in [(siting_engine, 'weather_url'), (siting_engine, 'wms_url'),
+                         (service_io, 'nominatim_domain'), (service_io, 'nominatim_scheme'),
+                         (service_io, '_geolocator'), (service_io.geocoding_rate_limiter, 'min_interval')]:
+        monkeypatch.setattr(module, name, getattr(module, name))
+
+
+def reverse(url, lat, key=None):
+    params = {'lat': lat, 'lon': 7.2, 'format': 'json'}
+    if key:
+        params['key'] = key
+    response = requests.get(f"{url}/nominatim/reverse", params=params, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
+def test_record_then_replay(tmp_path, upstream):
+    server, url = replay_server.serve('record', str(tmp_path))
+    try:
+        recorded = reverse(url, '51.1', key='secret')
+    finally:
+        server.shutdown()
+    assert server.stats['recorded'] == 1
+    assert 'secret' not in (tmp_path / 'index.json').read_text()
+
+    server, url = replay_server.serve('replay', str(tmp_path))
+    try:
+        # The API key is not part of the recording, so another key replays the same response
+        assert reverse(url, '51.1', key='other') == recorded
+        assert 'display_name' in reverse(url, '51.2')
+    finally:
+        server.shutdown()
+    assert server.stats['replayed'] == 1 and server.stats['synthetic'] == 1
+    assert len(upstream.calls) == 1
+
+
+def test_recording_keeps_nominatim_rate_limit(tmp_path, upstream, restore_services, monkeypatch):
+    monkeypatch.setattr(replay_server, 'upstream_geocoding_rate_limiter', service_io.RateLimiter(0.2))
+    server, url = replay_server.serve('record', str(tmp_path))
+    try:
+        replay_server.use_server(url)
+        # The client limiter is off for the local server, the forwarded requests are still limited
+        assert service_io.geocoding_rate_limiter.min_interval == 0
+        for lat in ('51.1', '51.2', '51.3'):
+            reverse(url, lat)
+    finally:
+        server.shutdown()
+    times = [call[3] for call in upstream.calls]
+    assert len(times) == 3
+    assert min(later - earlier for earlier, later in zip(times, times[1:])) >= 0.19
+
+
+def test_synthetic_weather_is_deterministic():
+    params = {'location': '51.48,7.21', 'startDateTime': '2024-01-01', 'endDateTime': '2024-01-03',
+              'aggregateHours': '24'}
+    first = replay_server.synthetic_weather(params)
+    assert first == replay_server.synthetic_weather(params)
+    values = next(iter(first['locations'].values()))['values']
+    assert len(values) == 3
@@ -0,0 +1,160 @@
+import time
+
+import numpy as np
+import pytest
+
+import siting_engine
+from location_cache import geohash
+from results_store import (ResultsStore, evaluate_site_stored, input_key, partition_precision, result_max_age,
+                           wind_rose_max_age)
+from wind_raster import WindSpeedSampler
+
+
+def make_results(count, seed=0, south=51.0, west=6.5, north=52.0, east=8.0):
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(south, north, count)
+    lons = rng.uniform(west, east, count)
+    return [{'lat': float(lat), 'lon': float(lon), 'h2': 10.0, 'turbine_type': 'Small', 'A': 12.5, 'years': 20.0,
+             'final_wind_speed': float(i), 'wind_power': float(i) * 10, 'created': 1000.0 + i}
+            for i, (lat, lon) in enumerate(zip(lats, lons))]
+
+
+# The results in the bounding box, the newest first, by checking every result
+def brute_force_bbox(results, south, west, north, east):
+    inside = [result for result in results
+              if south <= result['lat'] <= north and west <= result['lon'] <= east]
+    return sorted(inside, key=lambda result: -result['created'])
+
+
+def test_query_bbox_matches_brute_force(tmp_path):
+    results = make_results(400)
+    store = ResultsStore(str(tmp_path), flush_rows=1000)
+    # Appended in several batches, so partitions have several chunks
+    for first in range(0, len(results), 70):
+        store.append(results[first:first + 70])
+    assert len(store) == len(results)
+
+    # Boxes inside one cell, over several cells and outside of all results
+    for bbox in [(51.40, 7.10, 51.50, 7.30), (51.2, 6.6, 51.9, 7.9), (51.0, 6.5, 52.0, 8.0), (10.0, 10.0, 11.0, 11.0)]:
+        expected = brute_force_bbox(results, *bbox)
+        table = store.query_bbox(*bbox)
+        assert table.column('final_wind_speed').to_pylist() == [result['final_wind_speed'] for result in expected]
+    assert store.query_bbox(51.0, 6.5, 52.0, 8.0, limit=25).column('created').to_pylist() == \
+        [result['created'] for result in brute_force_bbox(results, 51.0, 6.5, 52.0, 8.0)[:25]]
+    assert store.query_bbox(51.0, 6.5, 52.0, 8.0, columns=['lat', 'lon']).column_names == ['lat', 'lon']
+
+
+def test_query_bbox_ties_keep_insertion_order(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    results = [{**result, 'created': 1000.0} for result in make_results(20, south=51.40, west=7.10, north=51.41,
+                                                                        east=7.11)]
+    store.append(results[:8])
+    store.append(results[8:])
+    assert store.query_bbox(51.40, 7.10, 51.41, 7.11).column('final_wind_speed').to_pylist() == \
+        [result['final_wind_speed'] for result in results]
+
+
+def test_lookup_and_max_age(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    results = make_results(3)
+    results[0]['created'] = time.time() - 2 * 24 * 3600
+    results[1]['created'] = time.time()
+    store.append(results)
+
+    key = input_key(results[1]['lat'], results[1]['lon'], 10.0, 'Small', 12.5, 20.0)
+    assert store.lookup(key)['final_wind_speed'] == 1.0
+    assert store.lookup(key, result_max_age())['final_wind_speed'] == 1.0
+    old_key = input_key(results[0]['lat'], results[0]['lon'], 10.0, 'Small', 12.5, 20.0)
+    assert store.lookup(old_key)['final_wind_speed'] == 0.0
+    assert store.lookup(old_key, result_max_age()) is None
+    assert result_max_age(3) == wind_rose_max_age
+    assert store.lookup('unknown') is None
+
+    # A later result of the same inputs replaces the earlier one
+    store.append([{**results[1], 'final_wind_speed': 9.0, 'created': time.time()}])
+    assert store.lookup(key)['final_wind_speed'] == 9.0
+
+
+def test_appends_are_buffered_and_flushed_per_cell(tmp_path):
+    results = make_results(50)
+    store = ResultsStore(str(tmp_path), flush_rows=100)
+    for result in results:
+        store.append([result])
+    assert not list(tmp_path.rglob('*.parquet'))
+
+    store.flush()
+    files = list(tmp_path.rglob('*.parquet'))
+    cells = {geohash(result['lat'], result['lon'], partition_precision) for result in results}
+    assert sorted(path.parent.name for path in files) == sorted(f"cell={cell}" for cell in cells)
+
+    # A full buffer is written without flush()
+    store.append(make_results(100, seed=1))
+    assert len(list(tmp_path.rglob('*.parquet'))) > len(files)
+
+
+def test_refresh_loads_other_stores(tmp_path):
+    writer = ResultsStore(str(tmp_path))
+    reader = ResultsStore(str(tmp_path))
+    results = make_results(30)
+    writer.append(results)
+    assert len(reader) == 0
+
+    writer.flush()
+    reader.refresh()
+    assert len(reader) == len(results)
+    key = input_key(results[5]['lat'], results[5]['lon'], 10.0, 'Small', 12.5, 20.0)
+    assert reader.lookup(key)['final_wind_speed'] == 5.0
+    # Files are only loaded once
+    reader.refresh()
+    assert len(reader) == len(results)
+    assert reader.query_bbox(51.0, 6.5, 52.0, 8.0).num_rows == len(results)
+    # A new store loads all files
+    assert len(ResultsStore(str(tmp_path))) == len(results)
+
+
+def test_old_buffer_is_flushed_on_append(tmp_path):
+    store = ResultsStore(str(tmp_path), flush_interval=0)
+    store.append(make_results(1))
+    assert len(list(tmp_path.rglob('*.parquet'))) == 1
+
+
+# Flat height maps that count how often they are fetched
+class FlatHeightMaps:
+
+    def __init__(self):
+        self.calls = 0
+
+    def height_map(self, lat, lon, bbox_size=0.001, cancel=None):
+        self.calls += 1
+        return np.zeros((100, 150)), (lon - bbox_size, lat - bbox_size, lon + bbox_size, lat + bbox_size)
+
+
+@pytest.fixture(scope='module')
+def sampler():
+    with WindSpeedSampler(siting_engine.geotiff_path) as sampler:
+        yield sampler
+
+
+def test_evaluate_site_stored(sampler, tmp_path):
+    store = ResultsStore(str(tmp_path))
+    height_maps = FlatHeightMaps()
+
+    def evaluate(max_age=None):
+        return evaluate_site_stored(store, sampler, 51.4818, 7.2162, 10.0, 12.5, 20, 'Small', max_age=max_age,
+                                    average_wind_direction=225.0, height_maps=height_maps)
+
+    # Not stored yet: calculated and appended
+    calculated = evaluate()
+    assert not calculated['from_store'] and len(store) == 1
+
+    # Stored: only the height map is fetched again
+    stored = evaluate(max_age=60)
+    assert stored['from_store'] and len(store) == 1 and height_maps.calls == 2
+    assert stored['final_wind_speed'] == calculated['final_wind_speed']
+    assert stored['height_map'].shape == calculated['height_map'].shape and stored['wind_rose'] is None
+
+    # Stored longer ago than max_age: calculated again
+    store.append([{**calculated, 'turbine_type': 'Small', 'created': time.time() - 3600}])
+    recalculated = evaluate(max_age=60)
+    assert not recalculated['from_store'] and len(store) == 3
+    assert evaluate(max_age=60)['from_store']
@@ -0,0 +1,145 @@
+import multiprocessing
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import backoff._sync
+import pytest
+from geopy.exc import ConfigurationError, GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable
+
+import location_cache
+import service_io
+import siting_engine
+from wms_tile_cache import cached_wms_client
+
+
+class Geolocator:
+
+    def __init__(self, error=None, location=None):
+        self.error = error
+        self.location = location
+        self.calls = 0
+
+    def reverse(self, point):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.location
+
+
+class Location:
+    address = "Bochum, Nordrhein-Westfalen, Deutschland"
+
+
+@pytest.fixture
+def geolocator(monkeypatch, tmp_path):
+    monkeypatch.setattr(location_cache, 'default_cache_path', str(tmp_path / 'locations.sqlite'))
+    monkeypatch.setattr(service_io.geocoding_rate_limiter, 'min_interval', 0)
+    monkeypatch.setattr(backoff._sync.time, 'sleep', lambda seconds: None)
+
+    def use(geolocator):
+        monkeypatch.setattr(service_io, 'get_geolocator', lambda: geolocator)
+        return geolocator
+    return use
+
+
+@pytest.mark.parametrize('error', [GeocoderRateLimited("429"), GeocoderUnavailable("503"),
+                                   ConfigurationError("bad domain")])
+def test_service_errors_become_value_errors(geolocator, error):
+    geolocator(Geolocator(error))
+    with pytest.raises(ValueError):
+        service_io.reverse_geocode(51.4818, 7.2162)
+
+
+def test_service_errors_are_retried(geolocator):
+    failing = geolocator(Geolocator(GeocoderUnavailable("503")))
+    with pytest.raises(ValueError):
+        service_io.reverse_geocode(51.4818, 7.2162)
+    assert failing.calls == service_io.max_tries
+
+
+def test_timeout_message(geolocator):
+    geolocator(Geolocator(GeocoderTimedOut("slow")))
+    assert service_io.reverse_geocode(51.4818, 7.2162).startswith("Timeout")
+
+
+def test_no_place_found(geolocator):
+    geolocator(Geolocator())
+    with pytest.raises(ValueError):
+        service_io.reverse_geocode(51.4818, 7.2162)
+
+
+def test_address_is_cached(geolocator):
+    found = geolocator(Geolocator(location=Location()))
+    assert service_io.reverse_geocode(51.4818, 7.2162) == Location.address
+    assert service_io.reverse_geocode(51.48181, 7.21621) == Location.address
+    assert found.calls == 1
+
+
+# A service that answers /slow too late and /missing with 404, counting the requests
+@pytest.fixture
+def stub_service(monkeypatch):
+    monkeypatch.setattr(backoff._sync.time, 'sleep', lambda seconds: None)
+    monkeypatch.setitem(service_io.service_timeouts, 'weather', 0.2)
+    monkeypatch.setitem(service_io.service_timeouts, 'wms', 0.2)
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            requests.append(self.path)
+            if self.path.startswith('/slow'):
+                # time.sleep is patched for the backoff
+                threading.Event().wait(0.5)
+            self.send_error(404 if self.path.startswith('/missing') else 503)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", requests
+    server.shutdown()
+
+
+def test_request_errors_become_value_errors(stub_service, monkeypatch, tmp_path):
+    url, requests = stub_service
+    monkeypatch.setattr(siting_engine, 'weather_url', f"{url}/slow")
+    with pytest.raises(ValueError, match="did not answer"):
+        siting_engine.fetch_historical_weather('key', '51.48,7.21', '2024-01-01', '2024-01-31')
+    assert len(requests) == service_io.max_tries
+
+    # An error status that is not worth another attempt
+    with pytest.raises(service_io.ServiceError) as error:
+        cached_wms_client(f"{url}/missing", str(tmp_path))
+    assert error.value.status_code == 404 and len(requests) == service_io.max_tries + 1
+
+    # No server at all
+    with socket.socket() as closed:
+        closed.bind(('127.0.0.1', 0))
+        port = closed.getsockname()[1]
+    with pytest.raises(ValueError, match="Unable to reach"):
+        service_io.get('wms', f"http://127.0.0.1:{port}/wms")
+
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(ValueError, match="cancelled"):
+        service_io.get('weather', f"{url}/slow", cancel=cancel)
+
+
+def _stages_in_child(results):
+    try:
+        results.put(service_io.run_concurrently({'a': lambda cancel: 1, 'b': lambda cancel: 2}, timeout=5))
+    except Exception as e:
+        results.put(repr(e))
+
+
+def test_forked_process_gets_new_pools():
+    # The parent's pools have idle threads before the fork
+    assert service_io.run_concurrently({name: lambda cancel: 1 for name in 'abcdefgh'}) == dict.fromkeys('abcdefgh', 1)
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=_stages_in_child, args=(results,))
+    process.start()
+    process.join(30)
+    assert results.get(timeout=1) == {'a': 1, 'b': 2}
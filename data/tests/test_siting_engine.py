@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+import batch_siting
+import siting_engine
+from energy_engine import annual_energy_at_mean_speed, synthetic_catalogue
+from stand_in_wms import synthetic_city
+from wind_raster import WindSpeedSampler
+from wind_rose import WindRose
+
+lat, lon = 51.4818, 7.2162
+
+
+# Height maps of the synthetic city of the stand-in WMS, without any download
+class CityHeightMaps:
+
+    def height_map(self, lat, lon, bbox_size=0.001, cancel=None, shape=(300, 400)):
+        bbox = (lon - bbox_size, lat - bbox_size, lon + bbox_size, lat + bbox_size)
+        lons = bbox[0] + (np.arange(shape[1]) + 0.5) * (bbox[2] - bbox[0]) / shape[1]
+        lats = bbox[3] - (np.arange(shape[0]) + 0.5) * (bbox[3] - bbox[1]) / shape[0]
+        return synthetic_city(*np.meshgrid(lons, lats)).astype(float), bbox
+
+
+@pytest.fixture(scope='module')
+def sampler():
+    with WindSpeedSampler(siting_engine.geotiff_path) as sampler:
+        yield sampler
+
+
+def evaluate(sampler, h2=6.0, A=3.0, **options):
+    return siting_engine.evaluate_site(sampler, lat, lon, h2, A, 20, average_wind_direction=225.0,
+                                       height_maps=CityHeightMaps(), **options)
+
+
+def synthetic_rose(sectors=12):
+    rng = np.random.default_rng(1)
+    return WindRose(sectors).add(rng.vonmises(np.radians(240), 1.5, 2000) * 180 / np.pi % 360,
+                                 rng.weibull(2.0, 2000) * 5)
+
+
+def test_obstacles_per_hub_height():
+    height_map, bbox = CityHeightMaps().height_map(lat, lon)
+    rose = synthetic_rose()
+    h2_values = np.array([2.0, 6.0, 12.0, 30.0])
+
+    distances, heights = siting_engine.upwind_obstacles(height_map, bbox, lat, lon, 225.0, h2_values)
+    reduction, sector_distance, sector_height = siting_engine.sector_wind_speed_reduction(
+        height_map, bbox, lat, lon, rose, h2_values, direction_step=5)
+    assert reduction.shape == (len(h2_values),) and sector_distance.shape == (len(h2_values), rose.sectors)
+    for row, h2 in enumerate(h2_values):
+        np.testing.assert_array_equal((distances[row], heights[row]),
+                                      siting_engine.upwind_obstacles(height_map, bbox, lat, lon, 225.0, h2))
+        expected = siting_engine.sector_wind_speed_reduction(height_map, bbox, lat, lon, rose, h2, direction_step=5)
+        np.testing.assert_array_equal(reduction[row], expected[0])
+        np.testing.assert_array_equal((sector_distance[row], sector_height[row]), expected[1:])
+
+
+@pytest.mark.parametrize('wind_rose_years', [None, 3])
+def test_sweep_matches_evaluate_site(sampler, monkeypatch, wind_rose_years):
+    monkeypatch.setattr(siting_engine, 'fetch_wind_rose', lambda *args: synthetic_rose())
+    h2_values, areas = np.array([2.0, 6.0, 12.0, 30.0]), np.array([1.0, 3.0, 12.5])
+    sweep = siting_engine.sweep_site(sampler, lat, lon, h2_values, areas, 20, average_wind_direction=225.0,
+                                     height_maps=CityHeightMaps(), wind_rose_years=wind_rose_years)
+    for row, h2 in enumerate(h2_values):
+        for column, A in enumerate(areas):
+            result = evaluate(sampler, h2, A, wind_rose_years=wind_rose_years)
+            assert sweep['final_wind_speed'][row] == pytest.approx(result['final_wind_speed'])
+            assert sweep['wind_power'][row, column] == pytest.approx(result['wind_power'])
+            assert sweep['total_co2_savings_natural_gas'][row, column] == pytest.approx(
+                result['total_co2_savings_natural_gas'])
+
+    best = sweep['best']
+    assert sweep['wind_power'][best['h2_index'], best['A_index']] == sweep['wind_power'].max()
+    assert (best['h2'], best['A']) == (h2_values[best['h2_index']], areas[best['A_index']])
+
+
+def test_fixed_efficiency_energy(sampler):
+    result = evaluate(sampler)
+    assert result['final_wind_speed'] == max(result['original_wind_speed'] - result['wind_speed_reduction'], 0)
+    assert result['wind_power'] == siting_engine.calculate_wind_power(3.0, result['final_wind_speed'])
+    assert result['annual_energy_output'] == pytest.approx(result['wind_power'] * 8760 / 1000)
+    assert result['total_co2_savings_coal'] == pytest.approx(result['annual_energy_output'] * 0.87 * 20)
+    assert result['turbine_model'] is None and result['capacity_factor'] is None
+
+
+def test_power_curve_energy(sampler):
+    catalogue = synthetic_catalogue(4)
+    power_curve = catalogue.select(catalogue.models[1])
+    result = evaluate(sampler, power_curve=power_curve, weibull_k=2.2)
+    expected = annual_energy_at_mean_speed(power_curve, result['final_wind_speed'], 2.2)[0, 0]
+    assert result['annual_energy_output'] == pytest.approx(expected)
+    assert result['wind_power'] == pytest.approx(expected * 1000 / 8760)
+    assert result['turbine_model'] == catalogue.models[1]
+    assert result['capacity_factor'] == pytest.approx(expected / (power_curve.rated_power[0] * 8760))
+    with pytest.raises(ValueError):
+        evaluate(sampler, power_curve=catalogue)
+
+
+def test_batch_row_with_turbine_model(sampler, monkeypatch, tmp_path):
+    catalogue = synthetic_catalogue(3)
+    path = tmp_path / 'curves.csv'
+    with open(path, 'w') as f:
+        f.write('model,wind_speed,power\n')
+        for model, power in zip(catalogue.models, catalogue.power):
+            for speed, value in zip(catalogue.wind_speeds, power):
+                f.write(f'{model},{speed},{value}\n')
+    # The worker settings are restored after the test
+    for name in ('_sampler', '_height_maps', '_power_curves', '_weibull_k'):
+        monkeypatch.setattr(batch_siting, name, getattr(batch_siting, name))
+    batch_siting._init_worker(siting_engine.geotiff_path, siting_engine.wms_url, power_curves_path=str(path))
+    monkeypatch.setattr(batch_siting, '_height_maps', CityHeightMaps())
+    row = {'site_id': 0, 'lat': lat, 'lon': lon, 'h2': 6.0, 'turbine_type': 'HAWT', 'radius': 1.0,
+           'average_wind_direction': 225.0}
+    without_model = batch_siting.evaluate_row(row)
+    with_model = batch_siting.evaluate_row({**row, 'turbine_model': catalogue.models[2]})
+    unknown_model = batch_siting.evaluate_row({**row, 'turbine_model': 'unknown'})
+    assert without_model.get('error') is None and with_model.get('error') is None
+    assert with_model['turbine_model'] == catalogue.models[2]
+    assert with_model['annual_energy_output'] != without_model['annual_energy_output']
+    assert unknown_model['error'].startswith('ValueError')
+
+    # A power curve doesn't need the turbine size
+    sizeless = {name: value for name, value in row.items() if name not in ('turbine_type', 'radius')}
+    without_size = batch_siting.evaluate_row({**sizeless, 'turbine_model': catalogue.models[2]})
+    assert without_size.get('error') is None and without_size['A'] is None
+    assert without_size['annual_energy_output'] == with_model['annual_energy_output']
+    assert without_size['capacity_factor'] == with_model['capacity_factor'] > 0
+    assert batch_siting.evaluate_row(sizeless)['error'].startswith('ValueError')
@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+import plots
+
+data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The first page is shown without the modules that are only needed by a calculation
+# (pandas and pyarrow are not checked, folium imports them itself)
+_first_run = """
+import json, sys
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file('webapp_wind_LCA.py', default_timeout=300)
+app.run()
+print(json.dumps({'exceptions': [str(e.value) for e in app.exception],
+                  'modules': sorted(name for name in ('rasterio', 'wind_raster', 'results_store', 'placement_optimizer',
+                                                      'matplotlib') if name in sys.modules)}))
+"""
+
+
+def test_first_run_is_light(tmp_path):
+    process = subprocess.run([sys.executable, '-c', _first_run], cwd=data_dir, capture_output=True, text=True,
+                             env={**os.environ, 'PYTHONPATH': data_dir, 'RESULTS_STORE_DIR': str(tmp_path)})
+    assert process.returncode == 0, process.stderr
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    assert result == {'exceptions': [], 'modules': []}
+
+
+def test_plots_are_png_images():
+    import matplotlib.pyplot as plt
+
+    images = [plots.co2_plot(100.0, 60.0, 75.0),
+              plots.height_map_plot(np.random.default_rng(0).uniform(0, 20, (30, 40)), (7.21, 51.48, 7.22, 51.49)),
+              plots.wind_rose_plot(np.arange(12) * 30.0, np.full(12, 1 / 12), 30.0, 'Wind rose'),
+              plots.sweep_plot(np.linspace(2, 30, 5), np.linspace(0.5, 5, 4), np.ones((5, 4)), 9.0, 2.0, 'Radius (m)')]
+    assert all(image.startswith(b'\x89PNG') for image in images)
+    # The figures are not kept by pyplot
+    assert plt.get_fignums() == []
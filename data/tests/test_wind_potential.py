@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import rasterio
+from pyproj import Transformer
+from rasterio.windows import Window
+
+import siting_engine
+import wind_potential
+from wind_raster import WindSpeedSampler, adjust_wind_speed_to_height
+
+hub_heights = [6.0, 12.5]
+
+
+# A 300 x 200 pixel part of the wind speed raster, so the precomputation runs in a moment
+@pytest.fixture(scope='module')
+def source(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('source') / 'wind_speed.tif')
+    window = Window(1200, 1100, 300, 200)
+    with rasterio.open(siting_engine.geotiff_path) as src:
+        profile = src.profile.copy()
+        profile.update(width=window.width, height=window.height, transform=src.window_transform(window),
+                       tiled=False)
+        with rasterio.open(path, 'w', **profile) as dst:
+            dst.write(src.read(window=window))
+    return path
+
+
+@pytest.fixture(scope='module')
+def outputs(source, tmp_path_factory):
+    output_dir = str(tmp_path_factory.mktemp('wind_potential'))
+    paths = wind_potential.precompute(hub_heights, output_dir, source, workers=2, tile_size=64)
+    return output_dir, paths
+
+
+def test_precompute_matches_whole_raster(source, outputs):
+    output_dir, paths = outputs
+    assert wind_potential.available_hub_heights(output_dir) == dict(zip(hub_heights, paths))
+    with rasterio.open(source) as src:
+        v1 = src.read(1, masked=True).astype(np.float32).filled(np.nan)
+
+    for h2, path in zip(hub_heights, paths):
+        v2 = adjust_wind_speed_to_height(v1, h2).astype(np.float32)
+        power_density = siting_engine.calculate_wind_power(1.0, v2).astype(np.float32)
+        expected = [v2, power_density, siting_engine.calculate_annual_energy_output(power_density).astype(np.float32)]
+        with rasterio.open(path) as dst:
+            assert dst.descriptions == tuple(wind_potential.bands)
+            assert len(dst.overviews(1)) == len(wind_potential.overview_factors)
+            for band, values in enumerate(expected, start=1):
+                np.testing.assert_array_equal(dst.read(band), values)
+
+
+def test_precompute_matches_point_queries(source, outputs):
+    _, paths = outputs
+    rng = np.random.default_rng(0)
+    with rasterio.open(paths[0]) as dst, WindSpeedSampler(source) as sampler:
+        rows, cols = rng.integers(0, dst.height, 20), rng.integers(0, dst.width, 20)
+        xs, ys = rasterio.transform.xy(dst.transform, rows, cols)
+        lons, lats = Transformer.from_crs(dst.crs, 'EPSG:4326', always_xy=True).transform(xs, ys)
+        speeds = sampler.wind_speed_at_height(np.array(lats), np.array(lons), hub_heights[0])
+        np.testing.assert_allclose(dst.read(1)[rows, cols], speeds, rtol=1e-6)
+
+
+def test_render_overlay(outputs):
+    _, paths = outputs
+    image, bounds, (vmin, vmax) = wind_potential.render_overlay(paths[1], 'annual_energy', max_size=100)
+    assert image.dtype == np.uint8 and image.shape[2] == 4 and max(image.shape[:2]) <= 120
+    (south, west), (north, east) = bounds
+    assert 6 < west < east < 10 and 50 < south < north < 53
+    assert vmin < vmax
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import rasterio
+from pyproj import Transformer
+
+from siting_engine import geotiff_path
+from wind_raster import WindSpeedSampler, adjust_wind_speed_to_height
+
+
+@pytest.fixture(scope='module')
+def sampler():
+    with WindSpeedSampler(geotiff_path, max_cached_blocks=4) as sampler:
+        yield sampler
+
+
+@pytest.fixture(scope='module')
+def read_point():
+    # Reads one point like the original app did: from the whole band with rasterio's index lookup
+    with rasterio.open(geotiff_path) as src:
+        band, nodata = src.read(1), src.nodata
+        transformer = Transformer.from_crs("EPSG:4326", src.crs, always_xy=True)
+
+        def read(lat, lon):
+            row, col = src.index(*transformer.transform(lon, lat))
+            if not (0 <= row < src.height and 0 <= col < src.width):
+                return np.nan
+            value = float(band[row, col])
+            return np.nan if nodata is not None and value == nodata else value
+
+        yield read
+
+
+def random_points(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    # Mostly inside North Rhine-Westphalia, some outside of the raster
+    return rng.uniform(49.5, 53.0, shape), rng.uniform(5.0, 10.0, shape)
+
+
+def test_scalar(sampler, read_point):
+    lat, lon = 51.4818, 7.2162
+    value = sampler.sample(lat, lon)
+    assert np.ndim(value) == 0
+    np.testing.assert_equal(value, read_point(lat, lon))
+
+
+@pytest.mark.parametrize('shape', [(1,), (50,), (4, 6), (2, 3, 4)])
+def test_arrays_match_single_reads(sampler, read_point, shape):
+    lats, lons = random_points(shape)
+    values = sampler.sample(lats, lons)
+    assert values.shape == shape
+    expected = np.array([read_point(lat, lon) for lat, lon in zip(lats.ravel(), lons.ravel())]).reshape(shape)
+    np.testing.assert_array_equal(values, expected)
+
+
+def test_wind_speed_at_height(sampler):
+    lats, lons = random_points((3, 5), seed=1)
+    np.testing.assert_allclose(sampler.wind_speed_at_height(lats, lons, 6.0),
+                               adjust_wind_speed_to_height(sampler.sample(lats, lons), 6.0))
+    np.testing.assert_allclose(adjust_wind_speed_to_height(5.0, 6.0), 5.0 * (6.0 / 100) ** (1 / 7))
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import location_cache
+import siting_engine
+from replay_server import synthetic_weather
+from wind_rose import WindRose, month_chunks, whole_month_window
+
+
+@pytest.mark.parametrize('end_date, years, window', [
+    ('2024-02-29', 3, ('2021-03-01', '2024-02-29')),
+    ('2024-02-28', 1, ('2023-02-01', '2024-01-31')),
+    ('2024-03-01', 1, ('2023-03-01', '2024-02-29')),
+    ('2024-12-31', 2, ('2023-01-01', '2024-12-31')),
+    ('2025-01-15', 5, ('2020-01-01', '2024-12-31')),
+])
+def test_whole_month_window(end_date, years, window):
+    assert whole_month_window(end_date, years) == window
+
+
+def test_month_chunks():
+    assert month_chunks('2023-12-15', '2024-02-29') == [('2023-12-15', '2023-12-31'), ('2024-01-01', '2024-01-31'),
+                                                         ('2024-02-01', '2024-02-29')]
+
+
+def test_merge_equals_one_rose():
+    rng = np.random.default_rng(0)
+    directions = rng.uniform(0, 360, 5000)
+    speeds = rng.weibull(2.0, 5000) * 5
+    speeds[::50] = 0
+    speeds[::77] = np.nan
+    whole = WindRose(12).add(directions, speeds)
+    parts = WindRose(12)
+    for chunk in np.array_split(np.arange(5000), 7):
+        parts.merge(WindRose.from_dict(WindRose(12).add(directions[chunk], speeds[chunk]).to_dict()))
+    np.testing.assert_allclose(parts.hours, whole.hours)
+    np.testing.assert_allclose(parts.speed_cube_sum, whole.speed_cube_sum)
+    assert parts.calm_hours == whole.calm_hours
+    assert parts.mean_direction() == pytest.approx(whole.mean_direction())
+
+
+def test_sectors():
+    rose = WindRose(12)
+    np.testing.assert_array_equal(rose.sector_of([0, 14.9, 15, 345, 359.9, 360, 180]), [0, 0, 1, 0, 0, 0, 6])
+    counts = WindRose(12).add(np.full(10, 95.0), np.full(10, 3.0))
+    assert counts.prevailing_sector() == 3 and counts.frequencies[3] == 1
+
+
+class WeatherService:
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, api_key, location, start_date, end_date, cancel=None, aggregate_hours=24):
+        self.requests.append((start_date, end_date))
+        return synthetic_weather({'location': location, 'startDateTime': start_date, 'endDateTime': end_date,
+                                  'aggregateHours': str(aggregate_hours)})
+
+
+def test_later_days_reuse_cached_months(monkeypatch, tmp_path):
+    monkeypatch.setattr(location_cache, 'default_cache_path', str(tmp_path / 'locations.sqlite'))
+    service = WeatherService()
+    monkeypatch.setattr(siting_engine, 'fetch_historical_weather', service)
+
+    rose = siting_engine.fetch_wind_rose(51.48, 7.21, years=1, end_date='2024-02-29')
+    assert len(service.requests) == 12 and service.requests[0] == ('2023-03-01', '2023-03-31')
+    assert rose.hours.sum() + rose.calm_hours == 366 * 24
+    # The next days of the same month use only cached months
+    for end_date in ('2024-03-01', '2024-03-17', '2024-03-30'):
+        siting_engine.fetch_wind_rose(51.48, 7.21, years=1, end_date=end_date)
+    assert len(service.requests) == 12
+    # A new month downloads only that month
+    siting_engine.fetch_wind_rose(51.48, 7.21, years=1, end_date='2024-03-31')
+    assert service.requests[12:] == [('2024-03-01', '2024-03-31')]
@@ -0,0 +1,99 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+import requests
+from PIL import Image
+
+import stand_in_wms
+from ndom_decoder import decode_height_map, smooth_height_map
+from wms_tile_cache import TileCache, TiledHeightMapFetcher, tiles_for_bbox
+
+lat, lon = 51.4818, 7.2162
+
+
+@pytest.fixture
+def wms():
+    calls = []
+
+    # The synthetic city, counting the GetMap requests
+    def city(lons, lats):
+        calls.append(lons.shape)
+        return stand_in_wms.synthetic_city(lons, lats)
+
+    server, url = stand_in_wms.serve(height_function=city)
+    yield url, calls
+    server.shutdown()
+
+
+# Reference: the whole window in one GetMap request, like before the tile cache
+def single_getmap(url, bbox, shape):
+    response = requests.get(url, params={'service': 'WMS', 'version': '1.1.1', 'request': 'GetMap',
+                                         'layers': 'nw_ndom', 'styles': '', 'srs': 'EPSG:4326',
+                                         'bbox': ','.join(map(repr, bbox)), 'width': shape[1],
+                                         'height': shape[0], 'format': 'image/png', 'transparent': 'TRUE'})
+    return smooth_height_map(decode_height_map(Image.open(BytesIO(response.content))).astype(float))
+
+
+def test_tiles_match_single_request(wms, tmp_path):
+    url, calls = wms
+    fetcher = TiledHeightMapFetcher(url, 'nw_ndom', cache=TileCache(str(tmp_path)))
+    for point in [(lat, lon), (51.48049, 7.21777), (-33.8568, 151.2153)]:
+        height_map, bbox = fetcher.height_map(*point)
+        assert height_map.shape == (300, 400)
+        assert bbox[0] < point[1] < bbox[2] and bbox[1] < point[0] < bbox[3]
+        np.testing.assert_array_equal(height_map, single_getmap(url, bbox, height_map.shape))
+
+
+def test_cached_tiles_are_not_fetched_again(wms, tmp_path):
+    url, calls = wms
+    height_map, bbox = TiledHeightMapFetcher(url, 'nw_ndom', cache=TileCache(str(tmp_path))).height_map(lat, lon)
+    fetched = len(calls)
+    assert fetched == len(tiles_for_bbox(bbox))
+
+    # A new fetcher on the same cache, and a location a few meters away
+    fetcher = TiledHeightMapFetcher(url, 'nw_ndom', cache=TileCache(str(tmp_path)))
+    np.testing.assert_array_equal(fetcher.height_map(lat, lon)[0], height_map)
+    fetcher.height_map(lat + 0.00002, lon + 0.00002)
+    assert len(calls) == fetched
+
+
+def test_tile_cache_eviction(tmp_path):
+    tile_bytes = 128 + 50 * 50 * 4
+    cache = TileCache(str(tmp_path), max_bytes=3 * tile_bytes)
+    tiles = [np.full((50, 50), i, dtype=np.float32) for i in range(4)]
+    for i, tile in enumerate(tiles[:3]):
+        cache.put(f'tile {i}', tile)
+    # Equal tiles share one file
+    cache.put('copy of tile 2', tiles[2])
+    assert cache.size() == 3 * tile_bytes
+
+    np.testing.assert_array_equal(cache.get('tile 0'), tiles[0])
+    cache.put('tile 3', tiles[3])
+    # Tile 1 was used least recently
+    assert cache.get('tile 1') is None
+    assert cache.size() <= 3 * tile_bytes
+    for key, tile in [('tile 0', tiles[0]), ('tile 2', tiles[2]), ('copy of tile 2', tiles[2]), ('tile 3', tiles[3])]:
+        np.testing.assert_array_equal(cache.get(key), tile)
+
+
+def test_replaced_tile_content_is_removed(tmp_path):
+    tile_bytes = 128 + 50 * 50 * 4
+    cache = TileCache(str(tmp_path))
+    cache.put('tile', np.zeros((50, 50)))
+    cache.put('copy', np.zeros((50, 50)))
+    cache.put('other', np.ones((50, 50)))
+    # The old content is still used by the copy
+    cache.put('tile', np.full((50, 50), 2.0))
+    assert cache.size() == 3 * tile_bytes
+    # Now nothing uses the zeros anymore, and the new content is shared
+    cache.put('copy', np.full((50, 50), 2.0))
+    assert cache.size() == 2 * tile_bytes
+    assert len(list(tmp_path.rglob('*.npy'))) == 2
+    np.testing.assert_array_equal(cache.get('copy'), np.full((50, 50), 2.0))
+    np.testing.assert_array_equal(cache.get('other'), np.ones((50, 50)))
+
+
+def test_tiles_for_bbox():
+    assert tiles_for_bbox((7.2155, 51.4815, 7.2175, 51.4825)) == [
+        (7215, -51483), (7216, -51483), (7217, -51483), (7215, -51482), (7216, -51482), (7217, -51482)]
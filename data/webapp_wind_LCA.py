@@ -1,145 +1,106 @@
 import streamlit as st
-import folium
-from streamlit_folium import st_folium
-from folium.plugins import MousePosition
-import rasterio
-from pyproj import Transformer, Geod
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+import json
 import numpy as np
-import requests
-import pandas as pd
-from datetime import date, timedelta
-from owslib.wms import WebMapService
-from io import BytesIO
-from PIL import Image
-import matplotlib.pyplot as plt
-import math
-
-# Path to your geotiff file
-geotiff_path = (''
-                './data/en_100m_klas.tif')
-
-# Function to fetch historical weather data
-def fetch_historical_weather(api_key, location, start_date, end_date):
-    base_url = 'https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/weatherdata/history'
-    params = {
-        'aggregateHours': '24',
-        'startDateTime': start_date,
-        'endDateTime': end_date,
-        'unitGroup': 'metric',
-        'contentType': 'json',
-        'dayStartTime': '0:0:00',
-        'dayEndTime': '0:0:00',
-        'location': location,
-        'key': api_key,
-    }
-    response = requests.get(base_url, params=params)
-
-    if response.status_code == 200:
-        data = response.json()
-        return data
-    else:
-        st.error(f"Error fetching data: {response.status_code}")
-        return None
-
-# Function to calculate the average wind direction
-def calculate_average_wind_direction(data):
-    if 'locations' in data and data['locations']:
-        location_data = data['locations'][list(data['locations'].keys())[0]]
-        if 'values' in location_data and location_data['values']:
-            values = location_data['values']
-
-            wind_directions = [entry['wdir'] for entry in values]
-
-            wind_directions = pd.Series(pd.to_numeric(wind_directions, errors='coerce'))
-
-            angles = wind_directions.dropna() * (2 * np.pi / 360)
-            sin_sum = sum(np.sin(angles))
-            cos_sum = sum(np.cos(angles))
-            average_direction = np.arctan2(sin_sum, cos_sum) * (360 / (2 * np.pi))
-
-            if average_direction < 0:
-                average_direction += 360
-
-            return average_direction
-        else:
-            st.error("No 'values' found in the API response. Check the data structure.")
-            return None
-    else:
-        st.error("No 'locations' found in the API response. Check the data structure.")
-        return None
-
-# Function to get coordinates from a place name using Nominatim
-def get_coordinates_from_place(place_name):
-    geolocator = Nominatim(user_agent="my_python_geocoder_app")  # Replace with a unique user agent string
-    location = geolocator.geocode(place_name, timeout=30)  # Adjust the timeout value as needed
-
-    if location:
-        return location.latitude, location.longitude
-    else:
-        raise ValueError(f"Could not find coordinates for place: {place_name}")
-
-# Function to retrieve place name from coordinates
-def reverse_geocode(lat, lon):
-    geolocator = Nominatim(user_agent="my_python_geocoder_app")
-    try:
-        location = geolocator.reverse((lat, lon), timeout=10)
-        return location.address
-    except GeocoderTimedOut:
-        return "Timeout: Unable to get the place name"
-
-# Function to get the wind speed at a 100 meters height
-def get_wind_speed_at_height(geotiff_path, lat, lon, h2):
-    with rasterio.open(geotiff_path) as src:
-        # Transform geographic coordinates to the raster's coordinate system
-        transformer = Transformer.from_crs("EPSG:4326", src.crs)
-        x, y = transformer.transform(lat, lon)
-
-        row, col = src.index(x, y)
-
-        # Check if the calculated row and col are within bounds
-        if (row < 0 or row >= src.height) or (col < 0 or col >= src.width):
-            raise ValueError("Latitude and longitude are out of raster bounds.")
-
-        # Read the wind speed at the specified location and height
-        v1 = src.read(1)[row, col]  # Reading the first band (wind speed at ground level)
-
-        # Calculate wind speed at height h2 using power law profile
-        h1 = 100  # Standard height ( 100 meters)
-        a = 1 / 7  # Power law exponent
-        v2 = v1 * ((h2 / h1) ** a)
-
-        return v2
-
-# Function to calculate wind speed reduction due to nearby buildings
-def calculate_wind_speed_reduction(Cd, h, r):
-    delta_V = Cd * h / r
-    return delta_V
-
-# Function to calculate the annual energy output
-def calculate_annual_energy_output(power):
-
-    hours_per_year = 24 * 365
-    annual_energy_output = power * hours_per_year / 1000
-    return annual_energy_output
-
-def calculate_co2_savings(annual_energy_output, co2_per_kwh):
-
-    co2_savings = annual_energy_output * co2_per_kwh
-    return co2_savings
-
-def calculate_total_co2_savings(annual_co2_savings, years):
-
-    total_co2_savings = annual_co2_savings * years
-    return total_co2_savings
-
-# Emission factors for different fossil fuels in kg CO2 per kWh
-emission_factors = {
-    'coal': 0.87,
-    'natural_gas': 0.49,
-    'oil': 0.6
-}
+import plots
+import service_io
+from pipeline_trace import Tracer, activate, span
+from compute_pool import ComputePool, PoolBusy, site_key
+from wind_potential import available_hub_heights, bands
+from siting_engine import (geotiff_path, turbine_types, calculate_swept_area, get_height_map_source, sweep_site)
+
+# The map (folium), raster (rasterio) and results store (pyarrow) modules are imported by the
+# functions that use them, so the first page is shown without waiting for all of them.
+
+# Function to open the wind speed raster once per process
+@st.cache_resource
+def get_wind_speed_sampler(geotiff_path):
+    from wind_raster import WindSpeedSampler
+    return WindSpeedSampler(geotiff_path)
+
+# Function to get the worker pool shared by all sessions, identical calculations run only once
+@st.cache_resource
+def get_compute_pool():
+    return ComputePool()
+
+# Function to open the store of all past results once per process
+@st.cache_resource
+def get_results_store():
+    from results_store import ResultsStore
+    return ResultsStore()
+
+# Functions to render the plots as PNG images. The images of the last calculations are kept,
+# so reruns don't draw them again and the memory used for plots stays bounded.
+@st.cache_data(max_entries=64)
+def get_co2_plot(annual_co2_savings_coal, annual_co2_savings_gas, annual_co2_savings_oil):
+    return plots.co2_plot(annual_co2_savings_coal, annual_co2_savings_gas, annual_co2_savings_oil)
+
+@st.cache_data(max_entries=32)
+def get_height_map_plot(height_map, bbox):
+    return plots.height_map_plot(height_map, bbox)
+
+@st.cache_data(max_entries=64)
+def get_wind_rose_plot(sector_centers, frequencies, sector_width, title):
+    return plots.wind_rose_plot(sector_centers, frequencies, sector_width, title)
+
+@st.cache_data(max_entries=32)
+def get_sweep_plot(h2_values, rotor_sizes, annual_energy_output, best_h2, best_rotor_size, rotor_size_label):
+    return plots.sweep_plot(h2_values, rotor_sizes, annual_energy_output, best_h2, best_rotor_size, rotor_size_label)
+
+# Function to render a precomputed wind potential raster as a map overlay once per process
+@st.cache_data
+def get_wind_potential_overlay(path, band):
+    from wind_potential import render_overlay
+    return render_overlay(path, band)
+
+# Function to show the map to select a location, with the optional layers. overlay is an
+# (image, bounds, name) tuple, previous_results rows of (lat, lon, wind power) and suggested_locations
+# the results of the placement search. Returns what st_folium returns (the last click and the bounds).
+def show_location_map(overlay=None, previous_results=None, suggested_locations=()):
+    import folium
+    from folium.plugins import FastMarkerCluster, MousePosition
+    from streamlit_folium import st_folium
+
+    m = folium.Map(location=[50.775346, 6.083887], zoom_start=13)
+    # Add a mouse position plugin to display latitude and longitude
+    MousePosition().add_to(m)
+    if overlay is not None:
+        image, bounds, name = overlay
+        folium.raster_layers.ImageOverlay(image, bounds=bounds, opacity=0.6, name=name).add_to(m)
+        folium.LayerControl().add_to(m)
+    if previous_results is not None:
+        FastMarkerCluster(previous_results, callback="""function (row) {
+                              var marker = L.marker(new L.LatLng(row[0], row[1]));
+                              marker.bindTooltip('Earlier result: ' + row[2].toFixed(2) + ' W');
+                              return marker;
+                          }""", name="Previous results").add_to(m)
+    for i, location in enumerate(suggested_locations, start=1):
+        folium.Marker([location['lat'], location['lon']], tooltip=f"Suggestion {i}: {location['wind_power']:.2f} W",
+                      icon=folium.Icon(color='green')).add_to(m)
+    return st_folium(m, width=700, height=500)
+
+# Function to show the chosen location and the suggested locations on a closer map
+def show_suggestions_map(lat, lon, suggested_locations):
+    import folium
+    from streamlit_folium import st_folium
+
+    suggestions_map = folium.Map(location=[lat, lon], zoom_start=18)
+    folium.Marker([lat, lon], tooltip="Chosen location").add_to(suggestions_map)
+    for i, location in enumerate(suggested_locations, start=1):
+        folium.Marker([location['lat'], location['lon']],
+                      tooltip=f"Suggestion {i}: {location['wind_power']:.2f} W",
+                      icon=folium.Icon(color='green')).add_to(suggestions_map)
+    st_folium(suggestions_map, width=700, height=400, key='suggestions_map', returned_objects=[])
+
+# Timing of the calculation stages, only collected when the diagnostics are shown
+show_diagnostics = st.sidebar.checkbox("Show timing diagnostics")
+tracer = Tracer() if show_diagnostics else None
+activate(tracer)
+
+# The obstacle reduction uses the average wind direction or a multi-year wind rose
+wind_rose_years = st.sidebar.selectbox(
+    "Wind direction", [0, 1, 3, 5],
+    format_func=lambda years: "Average of the last 30 days" if years == 0 else f"Wind rose of the last {years} years")
+sectors = st.sidebar.selectbox("Sectors of the wind rose", [12, 36], disabled=wind_rose_years == 0)
 
 # Header section
 st.title("Efficient Positioning of Wind Turbines")
@@ -157,31 +118,61 @@ h2 = st.number_input("Enter the height (in meters) for wind speed adjustment:",
 years = st.number_input("Enter the number of years for turbine usage:", min_value=1, value=20)
 
 # Select the type of turbine
-turbine_type = st.selectbox("Select the type of wind turbine:", ["Horizontal-Axis Wind Turbine (HAWT)", "Vertical-Axis Wind Turbine (VAWT)"])
+turbine_type = st.selectbox("Select the type of wind turbine:", list(turbine_types.values()))
 
 # Inputs based on turbine type
-if turbine_type == "Horizontal-Axis Wind Turbine (HAWT)":
+if turbine_type == turbine_types['HAWT']:
     radius = st.number_input("Radius of the wind turbine (in meters):", min_value=0.0, value=1.0, step=0.1)
-    A = math.pi * radius ** 2
-elif turbine_type == "Vertical-Axis Wind Turbine (VAWT)":
+    A = calculate_swept_area(turbine_type, radius=radius)
+elif turbine_type == turbine_types['VAWT']:
     rotor_height = st.number_input("Rotor height (in meters):", min_value=0.0, value=1.0, step=0.1)
     diameter = st.number_input("Rotor diameter (in meters):", min_value=0.0, value=1.5, step=0.1)
-    A = rotor_height * diameter  # A simple approximation
+    A = calculate_swept_area(turbine_type, rotor_height=rotor_height, diameter=diameter)
 
 # Display the calculated swept area
 st.write(f"Calculated swept area of the wind turbine (in square meters): **{A:.2f}**")
+
+# Sweep mode: a grid of hub heights and rotor sizes is calculated for the location in one pass
+sweep = st.checkbox("Compare hub heights and rotor sizes (sweep)")
+if sweep:
+    rotor_size_name = "radius" if turbine_type == turbine_types['HAWT'] else "rotor diameter"
+    h2_range = st.slider("Range of hub heights (in meters):", 1.0, 100.0, (2.0, 30.0), step=0.5)
+    h2_steps = st.number_input("Number of hub heights:", min_value=2, max_value=100, value=20)
+    rotor_size_range = st.slider(f"Range of the {rotor_size_name} (in meters):", 0.1, 20.0, (0.5, 5.0), step=0.1)
+    rotor_size_steps = st.number_input(f"Number of values of the {rotor_size_name}:", min_value=2, max_value=100, value=20)
+    sweep_h2 = np.linspace(h2_range[0], h2_range[1], h2_steps)
+    sweep_rotor_sizes = np.linspace(rotor_size_range[0], rotor_size_range[1], rotor_size_steps)
+    if turbine_type == turbine_types['HAWT']:
+        sweep_areas = calculate_swept_area(turbine_type, radius=sweep_rotor_sizes)
+    else:
+        sweep_areas = calculate_swept_area(turbine_type, rotor_height=rotor_height, diameter=sweep_rotor_sizes)
 #Folium map
 st.write("### Select a location on the map ")
 
-map_center = [51.1657, 10.4515]
-m = folium.Map(location=map_center, zoom_start=6)
-marker = folium.Marker(map_center, popup="Default Location")
-m.add_child(marker)
-m = folium.Map(location=[50.775346, 6.083887], zoom_start=13)
-# Add a mouse position plugin to display latitude and longitude
-MousePosition().add_to(m)
-# Display the map in Streamlit
-output_clicked_coords = st_folium(m, width=700, height=500)
+# Show the precomputed wind potential (see wind_potential.py) as a layer on the map
+overlay = None
+wind_potential_rasters = available_hub_heights()
+if wind_potential_rasters and st.checkbox("Show the precomputed wind potential on the map"):
+    overlay_height = st.selectbox("Hub height of the wind potential layer (in meters):", list(wind_potential_rasters))
+    overlay_band = st.selectbox("Value shown in the wind potential layer:", bands)
+    image, bounds, (vmin, vmax) = get_wind_potential_overlay(wind_potential_rasters[overlay_height], overlay_band)
+    overlay = image, bounds, f"Wind potential: {overlay_band} at {overlay_height:g} m"
+    st.write(f"Colour scale of the layer: {vmin:.2f} (dark) to {vmax:.2f} (bright)")
+# Show the stored results of earlier calculations in the last viewed part of the map as clustered markers
+previous_results = None
+if st.checkbox("Show previous results on the map"):
+    results_store = get_results_store()
+    results_store.refresh()
+    bounds = st.session_state.get('map_bounds') or {'_southWest': {'lat': 50.70, 'lng': 5.95},
+                                                    '_northEast': {'lat': 50.85, 'lng': 6.22}}
+    previous = results_store.query_bbox(bounds['_southWest']['lat'], bounds['_southWest']['lng'],
+                                        bounds['_northEast']['lat'], bounds['_northEast']['lng'],
+                                        columns=['lat', 'lon', 'wind_power'])
+    previous_results = np.column_stack([previous.column(name).to_numpy() for name in previous.column_names]).tolist()
+# Display the map in Streamlit, with the best locations suggested by the last calculation
+output_clicked_coords = show_location_map(overlay, previous_results, st.session_state.get('suggested_locations', []))
+if output_clicked_coords.get('bounds'):
+    st.session_state['map_bounds'] = output_clicked_coords['bounds']
 
 
 # If user has clicked on the map
@@ -190,263 +181,143 @@ if output_clicked_coords['last_clicked']:
         lat = output_clicked_coords['last_clicked']['lat']
         lon = output_clicked_coords['last_clicked']['lng']
         st.write(f"Selected Coordinates: Latitude = {lat:.2f}, Longitude = {lon:.2f}")
-        try:
-            place_name = reverse_geocode(lat, lon)
-            st.write(f"The chosen location is: **{place_name}**")
-        except ValueError as e:
-            st.error(str(e))
+        # The place name is looked up in the background while the calculation runs
+        place_name_slot = st.empty()
+        place_name_future = service_io.submit(service_io.reverse_geocode, lat, lon)
 
 # Button that triggers the calculations
     if st.button("Calculate"):
         try:
-            # Calculate original wind speed at the specified location and height
-            original_wind_speed = get_wind_speed_at_height(geotiff_path, lat, lon, h2)
-
-            # Fetch the wind direction and calculate average
-            api_key = 'RZVMEQKLB4H52H7TGUUZ6GGDK'
-            location = f"{lat},{lon}"
-            end_date = date.today().strftime('%Y-%m-%d')
-            start_date = (date.today() - timedelta(days=30)).strftime('%Y-%m-%d')
-            weather_data = fetch_historical_weather(api_key, location, start_date, end_date)
-            if weather_data:
-                average_wind_direction = calculate_average_wind_direction(weather_data)
-                if average_wind_direction is not None:
-                    st.write(f"Average Wind Direction: {average_wind_direction:.2f} degrees")
-
-                    # Defined the WMS URL
-                    wms_url = 'https://www.wms.nrw.de/geobasis/wms_nw_ndom'
-
-                    # Connection to the WMS service
-                    wms = WebMapService(wms_url)
-                    # Specify the layer containing building height information
-                    building_height_layer = 'nw_ndom'
-
-                    # Define the bounding box (extent) for the area around the specified location
-                    bbox_size = 0.001
-                    bbox = (lon - bbox_size, lat - bbox_size,
-                            lon + bbox_size, lat + bbox_size)
-
-                    # Define the desired image size
-                    width = 400
-                    height = 300
-
-                    # Get the image from the WMS service
-                    img = wms.getmap(layers=[building_height_layer],
-                                     srs='EPSG:4326',
-                                     bbox=bbox,
-                                     size=(width, height),
-                                     format='image/png',
-                                     transparent=True)
-
-                    # Convert the image content to PIL Image
-                    image_bytes = BytesIO(img.read())
-                    image = Image.open(image_bytes)
-                    image = image.convert('RGBA')
-
-                    # Color to height mapping
-                    color_to_height = {
-                        (255, 255, 255, 255): (0, 1.5),
-                        (31, 120, 180, 255): (1.5, 3.0),
-                        (54, 214, 209, 255): (3.0, 5.0),
-                        (64, 207, 39, 255): (5.0, 10.0),
-                        (255, 255, 71, 255): (10.0, 15.0),
-                        (255, 206, 71, 255): (15.0, 20.0),
-                        (255, 127, 0, 255): (20.0, 25.0),
-                        (215, 25, 28, 255): (25.0, 50.0),
-                        (114, 0, 11, 255): 50.0
-                    }
-
-                    # Get image dimensions
-                    width, height = image.size
-
-                    # Create an array to hold the height values
-                    height_map = np.zeros((height, width))
-
-                    # Load the pixel data
-                    pixels = image.load()
-
-                    # First pass: Assign height values based on color
-                    for y in range(height):
-                        for x in range(width):
-                            rgba = pixels[x, y]
-                            if rgba in color_to_height:
-                                height_value = color_to_height[rgba]
-                                if isinstance(height_value, tuple):
-                                    height_map[y, x] = np.mean(height_value)
-                                else:
-                                    height_map[y, x] = height_value
-                            else:
-                                height_map[y, x] = np.nan
-
-                    # Apply bilinear interpolation to smooth transitions between height ranges
-                    for y in range(1, height - 1):
-                        for x in range(1, width - 1):
-                            if not np.isnan(height_map[y, x]):
-                                surrounding_values = [
-                                    height_map[y - 1, x], height_map[y + 1, x],
-                                    height_map[y, x - 1], height_map[y, x + 1]
-                                ]
-                                valid_values = [v for v in surrounding_values if not np.isnan(v)]
-                                if valid_values:
-                                    height_map[y, x] = np.mean(valid_values)
-
-                    # Reproject the height map from EPSG:4326 to EPSG:3857
-                    transformer = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
-                    x_coords = np.linspace(bbox[0], bbox[2], width)
-                    y_coords = np.linspace(bbox[1], bbox[3], height)
-                    X, Y = np.meshgrid(x_coords, y_coords)
-                    X, Y = transformer.transform(X, Y)
-
-                    # Initialize distance and find height data
-                    distance_meters = 1
-                    max_distance = 100  # Set a maximum search distance to avoid infinite loops
-                    height_at_new_location = np.nan
-                    lon2, lat2 = lon, lat  # Initialize to the starting coordinates
-
-                    geod = Geod(ellps='WGS84')
-
-                    # Calculate the wind direction range to search (from average_wind_direction - 10° to average_wind_direction + 10°)
-                    search_start_direction = int(average_wind_direction - 10)
-                    search_end_direction = int(average_wind_direction + 10)
-
-                    # Find the first location with no height data or height data in range 0 to 1.5 meters
-                    found_empty_location = False
-                    while (not found_empty_location) and distance_meters <= max_distance:
-                        # Iterate over the search range
-                        for direction in range(search_start_direction, search_end_direction + 1):
-                            lon2, lat2, _ = geod.fwd(lon, lat, direction, distance_meters)
-                            lon2_idx = np.argmin(np.abs(x_coords - lon2))
-                            lat2_idx = np.argmin(np.abs(y_coords - lat2))
-                            height_at_new_location = height_map[lat2_idx, lon2_idx]
-                            if np.isnan(height_at_new_location) or 0 <= height_at_new_location <= 1.5:
-                                found_empty_location = True
-                                # First no height data or height in range 0-1.5 meters found at: ({lat2:.2f}, {lon2:.2f})
-
-                                break  # Exit the loop once a suitable location is found
-                        if not found_empty_location:
-                            distance_meters += 1
-
-                    # If we found a location with no height data or height in range 0-1.5 meters, look for the next height data higher than h2
-                    if found_empty_location:
-                        # Reset height_at_new_location for the next search
-                        height_at_new_location = np.nan
-                        while (np.isnan(
-                                height_at_new_location) or height_at_new_location <= h2) and distance_meters <= max_distance:
-                            # Iterate over the search range
-                            for direction in range(search_start_direction, search_end_direction + 1):
-                                lon2, lat2, _ = geod.fwd(lon, lat, direction, distance_meters)
-                                lon2_idx = np.argmin(np.abs(x_coords - lon2))
-                                lat2_idx = np.argmin(np.abs(y_coords - lat2))
-                                height_at_new_location = height_map[lat2_idx, lon2_idx]
-                                if not np.isnan(height_at_new_location) and height_at_new_location > h2:
-                                    actual_distance = geod.inv(lon, lat, lon2, lat2)[2]
-                                    st.write(
-                                        f"Distance to the first height data higher than {h2} meters: {actual_distance:.2f} meters")
-                                    st.write(f"Height at the found location: {height_at_new_location:.2f} meters")
-                                    break
-                                    # Exit the loop once a suitable location is found
-                            if not np.isnan(height_at_new_location) and height_at_new_location > h2:
-                                break
-                                # Exit the outer while loop as well
-
-                            distance_meters += 1
-                            # Increment the distance in 1 meter step
-
-                    # Calculate wind speed reduction due to the building at the new location
-                    if np.isnan(height_at_new_location) or height_at_new_location <= h2:
-                        wind_speed_reduction = 0
-
-                        #No valid height data found higher than {h2} meters within the maximum search distance.
-                        st.write(f"Wind Speed Reduction due to nearby building: {wind_speed_reduction:.2f} m/s")
-                    else:
-                        # Calculate wind speed reduction due to the building at the new location
-                        Cd = 0.8  # Drag coefficient
-                        wind_speed_reduction = calculate_wind_speed_reduction(Cd, height_at_new_location,
-                                                                              actual_distance)
-                        st.write(f"Wind Speed Reduction due to nearby building: {wind_speed_reduction:.2f} m/s")
-
-                    # Adjust the original wind speed considering the reduction
-                    final_wind_speed = original_wind_speed - wind_speed_reduction
-
-                    # Check if final wind speed is negative, if so, set it to zero
-                    if final_wind_speed < 0:
-                        final_wind_speed = 0
-                        st.write(
-                            "Final Wind Speed after reduction: 0.00 m/s.")
-                    else:
-                        st.write(
-                            f"Original Wind Speed at ({lat:.2f}, {lon:.2f}) at {h2} meters height: {original_wind_speed:.2f} m/s")
-
-                        st.write(f"Final Wind Speed after reduction: {final_wind_speed:.2f} m/s")
-
-
-
-                    # Function to calculate wind power
-                    def calculate_wind_power(A, final_wind_speed):
-                        rho = 1.2255
-                        efficiency = 0.4
-                        PWind = (rho / 2) * A * final_wind_speed ** 3
-                        PEffective = PWind * efficiency
-                        return PEffective
-
-
-                    wind_power = calculate_wind_power(A, final_wind_speed)
-                    st.write(f"The effective power of the wind turbine is: **{wind_power:.2f} W**")
-
-                    annual_energy_output = calculate_annual_energy_output(wind_power)
-                    st.write(f"The annual energy production is: **{annual_energy_output:.2f} kWh**")
-
-                    annual_co2_savings_coal = calculate_co2_savings(annual_energy_output, emission_factors['coal'])
-                    annual_co2_savings_gas = calculate_co2_savings(annual_energy_output,
-                                                                   emission_factors['natural_gas'])
-                    annual_co2_savings_oil = calculate_co2_savings(annual_energy_output, emission_factors['oil'])
-
-                    total_co2_savings_coal = calculate_total_co2_savings(annual_co2_savings_coal, years)
-                    total_co2_savings_gas = calculate_total_co2_savings(annual_co2_savings_gas, years)
-                    total_co2_savings_oil = calculate_total_co2_savings(annual_co2_savings_oil, years)
-
-                    st.success(
-                        f"The annual CO2 savings compared to natural gas are: **{annual_co2_savings_gas:.2f} kg CO2**")
-
-                    # Plotting the results with custom colors
-                    fossil_fuel_types = ['Coal', 'Natural Gas', 'Oil', 'Wind Turbine']
-                    total_savings = [annual_co2_savings_coal, annual_co2_savings_gas, annual_co2_savings_oil, 0]
-
-                    # Define colors using hex color codes
-                    colors = ['#2d2d96', '#5858cc', '#7e7ed8', '#a4a4e3']
-
-                    fig, ax = plt.subplots()
-                    ax.bar(fossil_fuel_types, total_savings, color=colors)
-                    ax.set_xlabel('Fossil Fuel Type')
-                    ax.set_ylabel('Total CO2  (kg)')
-                    ax.set_title(f'Total CO2 for energy over a year')
-
-                    st.pyplot(fig)
-
-                    st.write(f"If the resulting value is not as expected, the following height map can assist. It displays the heights of the surrounding buildings that could affect wind speed, with the chosen location at the center. This visualization can help in determining an alternative location for optimal wind turbine placement.")
-
-                    # Display the height map
-                    fig, ax = plt.subplots()
-
-                    # Plot the height map
-                    im = ax.imshow(height_map, cmap='viridis', interpolation='none',
-                                   extent=(X.min(), X.max(), Y.min(), Y.max()))
-
-                    # Customize color bar
-                    plt.colorbar(im, ax=ax, label='Height (m)')
-
-                    # Remove axis labels and ticks
-                    ax.set_xticks([])
-                    ax.set_yticks([])
-
-                    # Hide the coordinate values displayed on the corners
-                    ax.set_xlim(left=X.min(), right=X.max())
-                    ax.set_ylim(bottom=Y.min(), top=Y.max())
-
-                    # Add title
-                    ax.set_title('Height Map')
+            with span('evaluate_site'):
+                from results_store import evaluate_site_stored, result_max_age
+                key = site_key(lat, lon, h2, A, turbine_type, years, wind_rose_years, sectors)
+                job = get_compute_pool().submit(key, evaluate_site_stored, get_results_store(),
+                                                get_wind_speed_sampler(geotiff_path), lat, lon, h2, A, years,
+                                                turbine_type, wind_rose_years=wind_rose_years or None,
+                                                sectors=sectors,
+                                                max_age=result_max_age(wind_rose_years or None))
+                result = job.result()
+            if result['from_store']:
+                st.info("These inputs were calculated before, the stored result is shown.")
+            original_wind_speed = result['original_wind_speed']
+            final_wind_speed = result['final_wind_speed']
+            height_map = result['height_map']
+            bbox = result['bbox']
+
+            st.write(f"Average Wind Direction: {result['average_wind_direction']:.2f} degrees")
+
+            wind_rose = result['wind_rose']
+            if wind_rose is not None:
+                # Share of the hours from each direction, the obstacle reduction is weighted with it
+                with span('render_wind_rose'):
+                    st.image(get_wind_rose_plot(wind_rose.sector_centers, wind_rose.frequencies,
+                                                wind_rose.sector_width,
+                                                f'Wind rose of the last {wind_rose_years} years (% of hours)'))
+
+            if not np.isnan(result['obstacle_height']):
+                st.write(
+                    f"Distance to the first height data higher than {h2} meters: {result['obstacle_distance']:.2f} meters")
+                st.write(f"Height at the found location: {result['obstacle_height']:.2f} meters")
+            st.write(f"Wind Speed Reduction due to nearby building: {result['wind_speed_reduction']:.2f} m/s")
+
+            if final_wind_speed == 0:
+                st.write(
+                    "Final Wind Speed after reduction: 0.00 m/s.")
+            else:
+                st.write(
+                    f"Original Wind Speed at ({lat:.2f}, {lon:.2f}) at {h2} meters height: {original_wind_speed:.2f} m/s")
+
+                st.write(f"Final Wind Speed after reduction: {final_wind_speed:.2f} m/s")
+
+            st.write(f"The effective power of the wind turbine is: **{result['wind_power']:.2f} W**")
+            st.write(f"The annual energy production is: **{result['annual_energy_output']:.2f} kWh**")
+
+            annual_co2_savings_coal = result['annual_co2_savings_coal']
+            annual_co2_savings_gas = result['annual_co2_savings_natural_gas']
+            annual_co2_savings_oil = result['annual_co2_savings_oil']
+
+            st.success(
+                f"The annual CO2 savings compared to natural gas are: **{annual_co2_savings_gas:.2f} kg CO2**")
+
+            # Plotting the results with custom colors
+            with span('render_co2_plot'):
+                st.image(get_co2_plot(annual_co2_savings_coal, annual_co2_savings_gas, annual_co2_savings_oil))
+
+            st.write(f"If the resulting value is not as expected, the following height map can assist. It displays the heights of the surrounding buildings that could affect wind speed, with the chosen location at the center. This visualization can help in determining an alternative location for optimal wind turbine placement.")
+
+            # Display the height map
+            with span('render_height_map'):
+                st.image(get_height_map_plot(height_map, bbox))
+
+            # Search the height map for better locations along the average wind direction. The search
+            # runs on a larger map, so the locations near the upwind edge get their obstacles too.
+            with span('placement_search'):
+                from placement_optimizer import best_locations, search_bbox_size
+                try:
+                    search_map, search_bbox = get_height_map_source().height_map(lat, lon,
+                                                                                 bbox_size=search_bbox_size(lat, lon))
+                except ValueError:
+                    search_map, search_bbox = height_map, bbox
+                    st.caption("The surroundings of the height map could not be loaded, so no locations near its upwind edge are suggested.")
+                suggested_locations = best_locations(search_map, search_bbox, result['average_wind_direction'],
+                                                     original_wind_speed, h2, A, within=bbox)
+            st.session_state['suggested_locations'] = suggested_locations
+            if suggested_locations:
+                st.write("### Suggested locations")
+                st.write("These locations in the height map have the highest expected power. They are also shown as green markers on the map above.")
+                st.dataframe([{'Latitude': location['lat'], 'Longitude': location['lon'],
+                               'Wind speed (m/s)': location['final_wind_speed'],
+                               'Power (W)': location['wind_power'],
+                               'Annual energy (kWh)': location['annual_energy_output']}
+                              for location in suggested_locations])
+                show_suggestions_map(lat, lon, suggested_locations)
+        except ValueError as e:
+            st.error(f"Error: {e}")
+        except PoolBusy:
+            st.warning("The server is busy with other calculations, please try again in a moment.")
 
-                    # Display the plot using st.pyplot() with the explicitly created figure
-                    st.pyplot(fig)
+    # Button that triggers the sweep over hub heights and rotor sizes
+    if sweep and st.button("Calculate sweep"):
+        try:
+            with span('sweep_site'):
+                key = site_key(lat, lon, h2_range[0], sweep_areas[0], 'sweep', h2_range[1], h2_steps,
+                               float(sweep_areas[-1]), rotor_size_steps, years, wind_rose_years, sectors)
+                job = get_compute_pool().submit(key, sweep_site, get_wind_speed_sampler(geotiff_path), lat, lon,
+                                                sweep_h2, sweep_areas, years, wind_rose_years=wind_rose_years or None,
+                                                sectors=sectors)
+                sweep_result = job.result()
+            best = sweep_result['best']
+            best_rotor_size = sweep_rotor_sizes[best['A_index']]
+            st.write("### Comparison of hub heights and rotor sizes")
+            st.success(f"The best of the {sweep_result['wind_power'].size} configurations is a hub height of "
+                       f"**{best['h2']:.1f} m** with a {rotor_size_name} of "
+                       f"**{best_rotor_size:.2f} m**: **{best['wind_power']:.2f} W** and "
+                       f"**{best['annual_energy_output']:.2f} kWh** per year.")
+            with span('render_sweep_plot'):
+                st.image(get_sweep_plot(sweep_h2, sweep_rotor_sizes, sweep_result['annual_energy_output'],
+                                        best['h2'], best_rotor_size, f"{rotor_size_name.capitalize()} (m)"))
+            st.write("Wind speed at every hub height, after the reduction by the first building higher than the hub:")
+            st.dataframe([{'Hub height (m)': h, 'Wind speed (m/s)': original, 'Reduction (m/s)': reduction,
+                           'Final wind speed (m/s)': final, 'Distance to the building (m)': distance}
+                          for h, original, reduction, final, distance in zip(
+                              sweep_h2, sweep_result['original_wind_speed'], sweep_result['wind_speed_reduction'],
+                              sweep_result['final_wind_speed'], sweep_result['obstacle_distance'])])
         except ValueError as e:
             st.error(f"Error: {e}")
+        except PoolBusy:
+            st.warning("The server is busy with other calculations, please try again in a moment.")
+
+    try:
+        place_name_slot.write(f"The chosen location is: **{place_name_future.result()}**")
+    except ValueError as e:
+        place_name_slot.error(str(e))
+
+# Diagnostics panel with the time spent in every stage of the calculation
+if tracer is not None:
+    st.write("### Diagnostics")
+    st.write("Load of the calculation pool shared by all sessions:")
+    st.dataframe([get_compute_pool().metrics()])
+if tracer is not None and tracer.spans:
+    st.dataframe(tracer.summary())
+    st.download_button("Download the timings (Chrome trace format)", json.dumps(tracer.chrome_trace()),
+                       file_name="wind_turbine_trace.json", mime="application/json")
@@ -0,0 +1,150 @@
+"""Precompute wind speed, power density and annual energy for the whole wind raster.
+
+Usage:
+    python data/wind_potential.py --hub-heights 6 10 20 --output data/wind_potential
+
+For every hub height a tiled GeoTIFF with overviews is written, with the bands
+wind speed (m/s), power density (W per m² of swept area) and annual energy
+(kWh per m² of swept area). The web app can show them as a map layer.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from siting_engine import calculate_annual_energy_output, calculate_wind_power, geotiff_path
+
+# rasterio is imported by the functions that read and write rasters, so the web app can list the
+# precomputed rasters without loading it
+
+default_output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wind_potential')
+
+bands = ['wind_speed', 'power_density', 'annual_energy']
+overview_factors = [2, 4, 8, 16, 32]
+
+
+def output_path(output_dir, h2):
+    return os.path.join(output_dir, f"wind_potential_h{h2:g}m.tif")
+
+
+# Function to list the precomputed rasters in a directory as {hub height: path}
+def available_hub_heights(output_dir=default_output_dir):
+    rasters = {}
+    for path in glob.glob(os.path.join(output_dir, 'wind_potential_h*m.tif')):
+        match = re.search(r'wind_potential_h([0-9.]+)m\.tif$', path)
+        if match:
+            rasters[float(match.group(1))] = path
+    return dict(sorted(rasters.items()))
+
+
+# Function to compute all bands for one window of the source raster and all hub heights
+def compute_window(source_path, window, hub_heights):
+    import rasterio
+    from wind_raster import adjust_wind_speed_to_height
+
+    with rasterio.open(source_path) as src:
+        v1 = src.read(1, window=window, masked=True).astype(np.float32).filled(np.nan)
+
+    results = []
+    for h2 in hub_heights:
+        v2 = adjust_wind_speed_to_height(v1, h2).astype(np.float32)
+        power_density = calculate_wind_power(1.0, v2).astype(np.float32)
+        annual_energy = calculate_annual_energy_output(power_density).astype(np.float32)
+        results.append(np.stack([v2, power_density, annual_energy]))
+    return window, results
+
+
+def _windows(width, height, tile_size):
+    from rasterio.windows import Window
+
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            yield Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+
+
+# Function to precompute the wind potential rasters for several hub heights over a worker pool
+def precompute(hub_heights, output_dir=default_output_dir, source_path=geotiff_path, workers=None, tile_size=512):
+    import rasterio
+    from rasterio.enums import Resampling
+
+    os.makedirs(output_dir, exist_ok=True)
+    with rasterio.open(source_path) as src:
+        profile = src.profile.copy()
+        width, height = src.width, src.height
+
+    profile.update(dtype='float32', count=len(bands), nodata=np.nan, tiled=True, blockxsize=256, blockysize=256,
+                   compress='deflate', predictor=3)
+    outputs = [rasterio.open(output_path(output_dir, h2), 'w', **profile) for h2 in hub_heights]
+    try:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(compute_window, source_path, window, hub_heights)
+                       for window in _windows(width, height, tile_size)]
+            for future in futures:
+                window, results = future.result()
+                for dst, data in zip(outputs, results):
+                    dst.write(data, window=window)
+
+        for dst, h2 in zip(outputs, hub_heights):
+            dst.descriptions = tuple(bands)
+            dst.update_tags(hub_height=h2)
+            dst.build_overviews(overview_factors, Resampling.average)
+            dst.update_tags(ns='rio_overview', resampling='average')
+    finally:
+        for dst in outputs:
+            dst.close()
+
+    return [output_path(output_dir, h2) for h2 in hub_heights]
+
+
+# Function to render one band of a precomputed raster as an RGBA image in Web Mercator, for a map overlay.
+# The overviews are used, so only about max_size x max_size pixels are read.
+# Returns the image, its bounds [[south, west], [north, east]] and the value range of the colors.
+def render_overlay(path, band='wind_speed', max_size=1024, cmap='viridis'):
+    import matplotlib
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.warp import calculate_default_transform, reproject, transform_bounds
+
+    with rasterio.open(path) as src:
+        scale = max(src.width, src.height) / max_size
+        out_shape = (max(1, int(src.height / scale)), max(1, int(src.width / scale)))
+        data = src.read(bands.index(band) + 1, out_shape=out_shape, resampling=Resampling.average)
+        src_transform = src.transform * src.transform.scale(src.width / out_shape[1], src.height / out_shape[0])
+        src_crs = src.crs
+        src_bounds = src.bounds
+
+    dst_transform, dst_width, dst_height = calculate_default_transform(
+        src_crs, 'EPSG:3857', out_shape[1], out_shape[0], *src_bounds)
+    mercator = np.full((dst_height, dst_width), np.nan, dtype=np.float32)
+    reproject(data, mercator, src_transform=src_transform, src_crs=src_crs, src_nodata=np.nan,
+              dst_transform=dst_transform, dst_crs='EPSG:3857', dst_nodata=np.nan, resampling=Resampling.bilinear)
+
+    vmin, vmax = np.nanpercentile(mercator, [2, 98])
+    image = matplotlib.colormaps[cmap]((mercator - vmin) / (vmax - vmin))
+    image[np.isnan(mercator)] = 0
+
+    west, north = dst_transform * (0, 0)
+    east, south = dst_transform * (dst_width, dst_height)
+    west, south, east, north = transform_bounds('EPSG:3857', 'EPSG:4326', west, south, east, north)
+    return (image * 255).astype(np.uint8), [[south, west], [north, east]], (vmin, vmax)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute wind potential rasters for several hub heights.")
+    parser.add_argument('--hub-heights', type=float, nargs='+', default=[6, 10, 20], help="Hub heights in meters")
+    parser.add_argument('--output', default=default_output_dir, help="Directory for the GeoTIFF files")
+    parser.add_argument('--source', default=geotiff_path, help="Wind speed GeoTIFF at 100 meters")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: all cores)")
+    parser.add_argument('--tile-size', type=int, default=512, help="Size of the windows processed by one task")
+    args = parser.parse_args()
+
+    for path in precompute(args.hub_heights, args.output, args.source, args.workers, args.tile_size):
+        print(f"Wrote {path}")
+
+
+if __name__ == '__main__':
+    main()
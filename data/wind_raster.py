@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from pyproj import Transformer
+
+# Height of the wind speed raster (meters) and power law exponent
+reference_height = 100
+power_law_exponent = 1 / 7
+
+
+# Function to adjust a wind speed to another height using the power law profile
+def adjust_wind_speed_to_height(v1, h2, h1=reference_height, a=power_law_exponent):
+    return v1 * ((np.asarray(h2, dtype=float) / h1) ** a)
+
+
+# Keeps the wind speed raster open and reads only the blocks that contain the requested points
+class WindSpeedSampler:
+
+    def __init__(self, geotiff_path, max_cached_blocks=256):
+        self.geotiff_path = geotiff_path
+        self.max_cached_blocks = max_cached_blocks
+        self._src = rasterio.open(geotiff_path)
+        self._transformer = Transformer.from_crs("EPSG:4326", self._src.crs, always_xy=True)
+        self._inverse_transform = ~self._src.transform
+        self._block_height, self._block_width = self._src.block_shapes[0]
+        self._blocks = OrderedDict()
+        # Datasets must not be read from several threads at the same time
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._src.close()
+        self._blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Function to convert geographic coordinates into raster rows and columns
+    def rowcol(self, lat, lon):
+        x, y = self._transformer.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+        t = self._inverse_transform
+        col = np.floor(t.a * x + t.b * y + t.c).astype(int)
+        row = np.floor(t.d * x + t.e * y + t.f).astype(int)
+        return row, col
+
+    def _read_block(self, block_row, block_col):
+        key = (block_row, block_col)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            return block
+
+        window = Window(block_col * self._block_width, block_row * self._block_height,
+                        self._block_width, self._block_height)
+        window = window.intersection(Window(0, 0, self._src.width, self._src.height))
+        block = self._src.read(1, window=window)
+        self._blocks[key] = block
+        if len(self._blocks) > self.max_cached_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    # Function to read the wind speed at 100 meters for arrays of coordinates
+    def sample(self, lat, lon):
+        row, col = self.rowcol(lat, lon)
+        shape = np.shape(row)
+        # The points are handled as flat arrays and shaped like the input at the end
+        row, col = np.ravel(row), np.ravel(col)
+        inside = (row >= 0) & (row < self._src.height) & (col >= 0) & (col < self._src.width)
+
+        # Points outside of the raster get NaN
+        v1 = np.full(row.shape, np.nan)
+        points = np.flatnonzero(inside)
+        block_rows = row[points] // self._block_height
+        block_cols = col[points] // self._block_width
+        block_ids = block_rows * (self._src.width // self._block_width + 1) + block_cols
+
+        # Group the points by raster block so every block is read at most once
+        order = np.argsort(block_ids, kind='stable')
+        starts = np.flatnonzero(np.diff(block_ids[order], prepend=-1))
+        with self._lock:
+            for group in np.split(order, starts[1:]):
+                if group.size == 0:
+                    continue
+                block_row, block_col = block_rows[group[0]], block_cols[group[0]]
+                block = self._read_block(block_row, block_col)
+                selected = points[group]
+                v1[selected] = block[row[selected] - block_row * self._block_height,
+                                     col[selected] - block_col * self._block_width]
+
+        # Pixels without wind data get NaN as well
+        if self._src.nodata is not None:
+            v1[v1 == self._src.nodata] = np.nan
+
+        return v1.reshape(shape) if shape else v1[0]
+
+    # Function to get the wind speed at hub heights h2 for arrays of coordinates
+    def wind_speed_at_height(self, lat, lon, h2):
+        return adjust_wind_speed_to_height(self.sample(lat, lon), h2)
@@ -0,0 +1,136 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+
+# Hours, wind speed statistics and mean direction per direction sector, accumulated chunk by chunk
+# so a long weather history never has to be kept in memory. Directions are where the wind comes
+# from (degrees), sector 0 is centred on north. Speeds are in m/s.
+class WindRose:
+
+    def __init__(self, sectors=12):
+        self.sectors = sectors
+        self.hours = np.zeros(sectors)
+        self.speed_sum = np.zeros(sectors)
+        self.speed_square_sum = np.zeros(sectors)
+        self.speed_cube_sum = np.zeros(sectors)
+        # Hours without wind have no direction
+        self.calm_hours = 0.0
+        self.sin_sum = 0.0
+        self.cos_sum = 0.0
+
+    @property
+    def sector_width(self):
+        return 360 / self.sectors
+
+    @property
+    def sector_centers(self):
+        return np.arange(self.sectors) * self.sector_width
+
+    # Function to get the sector of directions (degrees)
+    def sector_of(self, directions):
+        return (np.floor((np.asarray(directions, dtype=float) % 360 + self.sector_width / 2) / self.sector_width)
+                .astype(int) % self.sectors)
+
+    # Function to add observations of wind direction and speed (one per hour)
+    def add(self, directions, speeds):
+        directions = np.asarray(directions, dtype=float)
+        speeds = np.asarray(speeds, dtype=float)
+        valid = ~np.isnan(speeds)
+        calm = valid & (speeds <= 0)
+        valid &= ~np.isnan(directions) & ~calm
+        self.calm_hours += np.count_nonzero(calm)
+
+        directions, speeds = directions[valid], speeds[valid]
+        sectors = self.sector_of(directions)
+        self.hours += np.bincount(sectors, minlength=self.sectors)
+        self.speed_sum += np.bincount(sectors, speeds, minlength=self.sectors)
+        self.speed_square_sum += np.bincount(sectors, speeds ** 2, minlength=self.sectors)
+        self.speed_cube_sum += np.bincount(sectors, speeds ** 3, minlength=self.sectors)
+        angles = np.radians(directions)
+        self.sin_sum += np.sin(angles).sum()
+        self.cos_sum += np.cos(angles).sum()
+        return self
+
+    # Function to add the statistics of another wind rose with the same sectors
+    def merge(self, other):
+        if other.sectors != self.sectors:
+            raise ValueError(f"Cannot merge wind roses with {other.sectors} and {self.sectors} sectors")
+        self.hours += other.hours
+        self.speed_sum += other.speed_sum
+        self.speed_square_sum += other.speed_square_sum
+        self.speed_cube_sum += other.speed_cube_sum
+        self.calm_hours += other.calm_hours
+        self.sin_sum += other.sin_sum
+        self.cos_sum += other.cos_sum
+        return self
+
+    # Share of the hours with wind from each sector
+    @property
+    def frequencies(self):
+        total = self.hours.sum()
+        return self.hours / total if total else np.zeros(self.sectors)
+
+    @property
+    def mean_speeds(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.speed_sum / self.hours
+
+    # Function to get the mean wind direction (degrees) of all hours, like calculate_average_wind_direction
+    def mean_direction(self):
+        if not self.hours.any():
+            raise ValueError("The wind rose has no hours with wind.")
+        return float(np.degrees(np.arctan2(self.sin_sum, self.cos_sum)) % 360)
+
+    # Function to get the sector with the most hours
+    def prevailing_sector(self):
+        return int(np.argmax(self.hours))
+
+    def to_dict(self):
+        return {'sectors': self.sectors, 'hours': self.hours.tolist(), 'speed_sum': self.speed_sum.tolist(),
+                'speed_square_sum': self.speed_square_sum.tolist(), 'speed_cube_sum': self.speed_cube_sum.tolist(),
+                'calm_hours': self.calm_hours, 'sin_sum': self.sin_sum, 'cos_sum': self.cos_sum}
+
+    @classmethod
+    def from_dict(cls, data):
+        rose = cls(data['sectors'])
+        for name in ['hours', 'speed_sum', 'speed_square_sum', 'speed_cube_sum']:
+            setattr(rose, name, np.array(data[name], dtype=float))
+        rose.calm_hours, rose.sin_sum, rose.cos_sum = data['calm_hours'], data['sin_sum'], data['cos_sum']
+        return rose
+
+
+# Function to build a wind rose from a Visual Crossing response (wdir in degrees, wspd in km/h)
+def wind_rose_from_weather(data, sectors=12):
+    import pandas as pd
+
+    rose = WindRose(sectors)
+    for location_data in data.get('locations', {}).values():
+        values = location_data.get('values', [])
+        directions = pd.to_numeric(pd.Series([value.get('wdir') for value in values], dtype=object), errors='coerce')
+        speeds = pd.to_numeric(pd.Series([value.get('wspd') for value in values], dtype=object), errors='coerce')
+        rose.add(directions.to_numpy(float), speeds.to_numpy(float) / 3.6)
+    return rose
+
+
+# Function to get the window (first day, last day) of the last years x 12 whole calendar months up to
+# end_date (YYYY-MM-DD). The month of end_date counts only if end_date is its last day, so the window
+# only changes once a month and every month in it can be cached.
+def whole_month_window(end_date, years):
+    end = date.fromisoformat(end_date)
+    if (end + timedelta(days=1)).day != 1:
+        end = end.replace(day=1) - timedelta(days=1)
+    first_month = end.year * 12 + end.month - 1 - (int(years * 12) - 1)
+    return date(first_month // 12, first_month % 12 + 1, 1).isoformat(), end.isoformat()
+
+
+# Function to split the days from start_date to end_date (YYYY-MM-DD) into calendar months.
+# Returns a list of (first day, last day); only the first and last month can be partial.
+def month_chunks(start_date, end_date):
+    first, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    chunks = []
+    while first <= end:
+        next_month = (first.replace(day=1) + timedelta(days=32)).replace(day=1)
+        chunks.append((first.isoformat(), min(next_month - timedelta(days=1), end).isoformat()))
+        first = next_month
+    return chunks
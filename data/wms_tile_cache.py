@@ -0,0 +1,228 @@
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import service_io
+from pipeline_trace import span
+from ndom_decoder import decode_height_map, smooth_height_map
+
+default_cache_dir = os.environ.get('NDOM_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'wind_turbine_tool', 'ndom'))
+
+
+# Size-bounded, content-addressed store for decoded height tiles.
+# Tiles with identical content (e.g. empty fields) share one file, and the least
+# recently used tiles are removed when the cache grows larger than max_bytes.
+class TileCache:
+
+    def __init__(self, cache_dir=default_cache_dir, max_bytes=512 * 1024 ** 2):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(cache_dir, 'blobs'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS tiles (key TEXT PRIMARY KEY, digest TEXT, last_access REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER)")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, 'blobs', digest[:2], digest + '.npy')
+
+    # Function to get a cached tile, None if it is not in the cache
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT digest FROM tiles WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            try:
+                tile = np.load(self._blob_path(row[0]))
+            except OSError:
+                return None
+            with self._db:
+                self._db.execute("UPDATE tiles SET last_access = ? WHERE key = ?", (time.time(), key))
+        return tile
+
+    # Function to store a tile under key
+    def put(self, key, tile):
+        buffer = BytesIO()
+        np.save(buffer, np.ascontiguousarray(tile, dtype=np.float32))
+        data = buffer.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+
+        with self._lock:
+            if not os.path.exists(path):
+                # Write to a temporary file first so other processes never read half a tile
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            with self._db:
+                previous = self._db.execute("SELECT digest FROM tiles WHERE key = ?", (key,)).fetchone()
+                self._db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?)", (digest, len(data)))
+                self._db.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?)", (key, digest, time.time()))
+                # The tile had other content before
+                if previous is not None and previous[0] != digest:
+                    self._remove_unused_blob(previous[0])
+            self._evict()
+
+    def size(self):
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def _evict(self):
+        total = self.size()
+        if total <= self.max_bytes:
+            return
+
+        with self._db:
+            for key, digest in self._db.execute("SELECT key, digest FROM tiles ORDER BY last_access").fetchall():
+                self._db.execute("DELETE FROM tiles WHERE key = ?", (key,))
+                total -= self._remove_unused_blob(digest)
+                if total <= self.max_bytes:
+                    break
+
+    # Function to remove a blob and its file once no tile refers to it anymore. Returns the bytes freed.
+    def _remove_unused_blob(self, digest):
+        if self._db.execute("SELECT 1 FROM tiles WHERE digest = ?", (digest,)).fetchone() is not None:
+            return 0
+        row = self._db.execute("SELECT size FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        self._db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+        return row[0] if row is not None else 0
+
+
+# Function to connect to a WMS service, reusing the GetCapabilities document cached on disk
+def cached_wms_client(url, cache_dir=default_cache_dir, max_age=24 * 3600, version='1.1.1'):
+    # owslib is only needed once per WMS and process, so it is imported here
+    from owslib.wms import WebMapService
+
+    path = os.path.join(cache_dir, 'capabilities', hashlib.sha256(f"{url} {version}".encode()).hexdigest() + '.xml')
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age:
+        with open(path, 'rb') as f:
+            return WebMapService(url, version=version, xml=f.read())
+
+    with span('wms_capabilities'):
+        response = service_io.get('wms', url, {'service': 'WMS', 'request': 'GetCapabilities', 'version': version})
+        wms = WebMapService(url, version=version, xml=response.content)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(response.content)
+    return wms
+
+
+# Fetches the nDOM height map on a fixed tile grid, so nearby queries share the cached tiles.
+# The grid starts at 0°/0° and tiles cover tile_size degrees with tile_pixels (width, height) pixels.
+class TiledHeightMapFetcher:
+
+    def __init__(self, wms_url, layer, cache=None, tile_size=0.001, tile_pixels=(200, 150), wms=None):
+        self.wms_url = wms_url
+        self.layer = layer
+        self.cache = cache if cache is not None else TileCache()
+        self.tile_size = tile_size
+        self.tile_width, self.tile_height = tile_pixels
+        self._wms = wms
+        self._wms_lock = threading.Lock()
+
+    @property
+    def wms(self):
+        with self._wms_lock:
+            if self._wms is None:
+                self._wms = cached_wms_client(self.wms_url, self.cache.cache_dir)
+        return self._wms
+
+    # Size of one pixel in degrees (lon, lat)
+    @property
+    def resolution(self):
+        return self.tile_size / self.tile_width, self.tile_size / self.tile_height
+
+    # Function to get the bounding box (lon/lat) of a tile. Tile rows count southwards from the equator.
+    def tile_bbox(self, col, row):
+        west = round(col * self.tile_size, 9)
+        north = round(-row * self.tile_size, 9)
+        return (west, round(north - self.tile_size, 9), round(west + self.tile_size, 9), north)
+
+    def tile_key(self, col, row):
+        return f"{self.wms_url}|{self.layer}|{self.tile_size}|{self.tile_width}x{self.tile_height}|{col}|{row}"
+
+    # Function to download one tile and decode it into heights
+    def fetch_tile(self, col, row, cancel=None):
+        getmap_url = self.wms.getOperationByName('GetMap').methods[0]['url']
+        params = {
+            'service': 'WMS',
+            'version': '1.1.1',
+            'request': 'GetMap',
+            'layers': self.layer,
+            'styles': '',
+            'srs': 'EPSG:4326',
+            'bbox': ','.join(map(repr, self.tile_bbox(col, row))),
+            'width': self.tile_width,
+            'height': self.tile_height,
+            'format': 'image/png',
+            'transparent': 'TRUE',
+        }
+        with span('wms_getmap', tile=(col, row)):
+            response = service_io.get('wms', getmap_url, params, cancel)
+        if not response.headers.get('Content-Type', '').startswith('image/'):
+            raise ValueError(f"WMS did not return an image: {response.text[:200]}")
+        with span('png_decode', tile=(col, row)):
+            return decode_height_map(Image.open(BytesIO(response.content)))
+
+    # Function to get a tile from the cache, downloading it if needed
+    def get_tile(self, col, row, cancel=None):
+        key = self.tile_key(col, row)
+        with span('tile_cache_lookup'):
+            tile = self.cache.get(key)
+        if tile is None:
+            tile = self.fetch_tile(col, row, cancel)
+            self.cache.put(key, tile)
+        return tile
+
+    # Function to get several tiles, the missing ones are downloaded in parallel
+    def get_tiles(self, tiles, cancel=None):
+        futures = {tile: service_io.submit(self.get_tile, *tile, cancel) for tile in tiles}
+        return {tile: future.result() for tile, future in futures.items()}
+
+    # Function to get the smoothed height map around a location and its bounding box (lon/lat).
+    # The window is snapped to the pixel grid of the tiles.
+    def height_map(self, lat, lon, bbox_size=0.001, cancel=None):
+        dx, dy = self.resolution
+        width = int(round(2 * bbox_size / dx))
+        height = int(round(2 * bbox_size / dy))
+
+        # Window in global pixel coordinates (columns eastwards, rows southwards)
+        col0 = int(round(lon / dx - width / 2))
+        row0 = int(round(-lat / dy - height / 2))
+        tile_cols = range(col0 // self.tile_width, (col0 + width - 1) // self.tile_width + 1)
+        tile_rows = range(row0 // self.tile_height, (row0 + height - 1) // self.tile_height + 1)
+
+        with span('height_map_tiles'):
+            tiles = self.get_tiles([(col, row) for row in tile_rows for col in tile_cols], cancel)
+        mosaic = np.block([[tiles[(col, row)] for col in tile_cols] for row in tile_rows]).astype(float)
+
+        x = col0 - tile_cols[0] * self.tile_width
+        y = row0 - tile_rows[0] * self.tile_height
+        with span('smoothing'):
+            height_map = smooth_height_map(mosaic[y:y + height, x:x + width])
+
+        bbox = (col0 * dx, -(row0 + height) * dy, (col0 + width) * dx, -row0 * dy)
+        return height_map, bbox
+
+
+# Function to get the tiles (col, row) needed for a bounding box (lon/lat), useful to prefetch an area
+def tiles_for_bbox(bbox, tile_size=0.001):
+    west, south, east, north = bbox
+    cols = range(math.floor(west / tile_size), math.ceil(east / tile_size))
+    rows = range(math.floor(-north / tile_size), math.ceil(-south / tile_size))
+    return [(col, row) for row in rows for col in cols]